@@ -0,0 +1,40 @@
+import argparse
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from funnelius.functions import transform, apply_filter
+from synthetic_events import generate_funnel_events
+
+def frame_bytes(df):
+    # bytes held by the dataframe, python string objects included
+    return int(df.memory_usage(deep=True, index=True).sum())
+
+def measure(df, compact):
+    # bytes per input event of the transform and apply_filter outputs
+    data = transform(df, compact=compact)[0]
+    transformed = frame_bytes(data) / len(df)
+    data, __v1 = apply_filter(data, [], [])
+    filtered = frame_bytes(data) / len(df)
+    return transformed, filtered
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure memory per event of the pandas pipeline with and without compact dtypes.')
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--uuid', action='store_true', help='use 36 character uuid strings as user ids')
+    args = parser.parse_args()
+
+    df = generate_funnel_events(events=args.rows)
+    if args.uuid:
+        codes, users = pd.factorize(df['user_id'])
+        df['user_id'] = np.array([str(uuid.UUID(int=code)) for code in range(len(users))], dtype=object)[codes]
+
+    print('rows: ' + str(args.rows) + ', input: ' + str(round(frame_bytes(df) / len(df))) + ' bytes per event')
+    print('mode      transform  apply_filter')
+    for compact in [False, True]:
+        transformed, filtered = measure(df, compact)
+        print(('compact' if compact else 'default').ljust(10) + str(round(transformed)).ljust(11) + str(round(filtered)))
+
+if __name__ == '__main__':
+    main()
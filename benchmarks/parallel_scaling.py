@@ -0,0 +1,39 @@
+import argparse
+import os
+import time
+
+import polars as pl
+
+from funnelius.functions import aggregate_route_index, partitioned_route_index
+from synthetic_events import generate_funnel_events
+
+def run_pipeline(df, backend, workers):
+    # transform, filter and aggregate like render(parallel=workers) does, without drawing
+    started = time.perf_counter()
+    route_index = partitioned_route_index(df, [], [], max(workers, 1), backend, parallel=workers)
+    aggregate_route_index(route_index, route_index['route_num'], 5)
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure how the sharded pipeline scales with worker processes.')
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--backend', choices=['pandas', 'polars'], default='pandas')
+    args = parser.parse_args()
+
+    df = generate_funnel_events(events=args.rows)
+    if args.backend == 'polars':
+        df = pl.from_pandas(df)
+
+    print('cpu cores: ' + str(os.cpu_count()) + ', rows: ' + str(args.rows) + ', backend: ' + args.backend)
+    print('workers  seconds  speedup  efficiency')
+    baseline = None
+    for workers in args.workers:
+        seconds = run_pipeline(df, args.backend, workers)
+        if baseline is None:
+            baseline = seconds * args.workers[0]
+        speedup = baseline / seconds
+        print(str(workers).ljust(9) + str(round(seconds, 2)).ljust(9) + str(round(speedup, 2)).ljust(9) + format(speedup / workers, '.0%'))
+
+if __name__ == '__main__':
+    main()
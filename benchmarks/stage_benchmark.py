@@ -0,0 +1,134 @@
+import argparse
+import csv
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import graphviz
+import polars as pl
+
+from funnelius import functions
+from funnelius.cache import DiskCache
+from funnelius.functions import transform, apply_filter, aggregate, draw_to_bytes
+from funnelius.profiling import reset_peak_memory, current_memory_mb, memory_growth_mb
+from synthetic_events import generate_funnel_events, goal_action
+
+STAGES = ['transform', 'apply_filter', 'aggregate', 'draw']
+FIELDS = ['backend', 'events', 'stage', 'seconds', 'peak_memory_mb', 'rows_out']
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'stages.csv')
+
+def measure(results, stage, function):
+    # runs one stage, records its wall time, the peak memory it added and the rows it returned
+    reset_peak_memory()
+    memory_before = current_memory_mb()
+    started = time.perf_counter()
+    output = function()
+    elapsed = time.perf_counter() - started
+    results.append({'stage': stage, 'seconds': round(elapsed, 3), 'peak_memory_mb': memory_growth_mb(memory_before)})
+    return output
+
+def run_stages(backend, events, seed):
+    # times every stage of render() on one synthetic dataset, meant to be called in a fresh process so peak memory
+    # is not shared between runs. graphs are drawn with empty caches, so draw measures a cold layout
+    functions.render_cache = DiskCache(tempfile.mkdtemp())
+    df = generate_funnel_events(events=events, seed=seed)
+    if backend == 'polars':
+        df = pl.from_pandas(df)
+    goals = [goal_action()]
+
+    results = []
+    data, __v1, __v2 = measure(results, 'transform', lambda: transform(df))
+    results[-1]['rows_out'] = len(data)
+    data, route_num = measure(results, 'apply_filter', lambda: apply_filter(data, [], goals))
+    results[-1]['rows_out'] = len(data)
+    node_data, edge_data, answer_data = measure(results, 'aggregate', lambda: functions.collect_frames(*aggregate(data, route_num, 5)))
+    results[-1]['rows_out'] = len(node_data) + len(edge_data) + len(answer_data)
+    try:
+        measure(results, 'draw', lambda: draw_to_bytes(node_data, edge_data, answer_data, goals, 0, 20, True, True, 5, ['svg']))
+        results[-1]['rows_out'] = len(node_data) + len(edge_data)
+    except graphviz.ExecutableNotFound:
+        #draw needs the graphviz binaries, the data stages are still measured without them
+        pass
+    return [{'backend': backend, 'events': events, **result} for result in results]
+
+def read_baseline(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, newline='') as f:
+        return {(row['backend'], int(row['events']), row['stage']): row for row in csv.DictReader(f)}
+
+def write_baseline(path, results):
+    # one row per backend, size and stage in a stable order, so a regression shows up as a diff of the file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    results = sorted(results, key=lambda row: (row['backend'], row['events'], STAGES.index(row['stage'])))
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS, lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(results)
+
+def change(value, base):
+    if value is None or base is None or base == '' or float(base) == 0:
+        return ''
+    return format(float(value) / float(base) - 1, '+.0%')
+
+def is_regression(row, base, tolerance):
+    # slower or bigger by more than tolerance, tiny absolute differences of small inputs are noise. memory is only
+    # compared when both runs measured it
+    slower = row['seconds'] > float(base['seconds']) * (1 + tolerance) and row['seconds'] - float(base['seconds']) > 0.05
+    bigger = (row['peak_memory_mb'] is not None and base['peak_memory_mb'] != ''
+              and row['peak_memory_mb'] > float(base['peak_memory_mb']) * (1 + tolerance) and row['peak_memory_mb'] - float(base['peak_memory_mb']) > 16)
+    return slower or bigger or str(row['rows_out']) != base['rows_out']
+
+def main():
+    parser = argparse.ArgumentParser(description='Time and memory-profile transform, apply_filter, aggregate and draw on synthetic events, and compare with the stored baseline.')
+    parser.add_argument('--events', type=int, nargs='+', default=[10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7, 10 ** 8])
+    parser.add_argument('--backends', nargs='+', default=['pandas', 'polars'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save', action='store_true', help='write the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='relative slowdown or memory growth reported as a regression')
+    parser.add_argument('--single', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(run_stages(args.backends[0], args.events[0], args.seed)))
+        return
+
+    baseline = read_baseline(args.baseline)
+    results = []
+    regressions = 0
+    print('cpu cores: ' + str(os.cpu_count()) + ', seed: ' + str(args.seed))
+    print('backend  events       stage         seconds  change  peak memory (MB)  change  rows out')
+    for events in args.events:
+        for backend in args.backends:
+            output = subprocess.run([sys.executable, __file__, '--single', '--backends', backend, '--events', str(events), '--seed', str(args.seed)],
+                                    capture_output=True, text=True)
+            if output.returncode != 0:
+                print(backend.ljust(9) + str(events).ljust(13) + 'failed: ' + (output.stderr.strip().splitlines() or ['killed'])[-1])
+                continue
+            for row in json.loads(output.stdout):
+                base = baseline.get((backend, events, row['stage']))
+                flag = ''
+                if base is not None and is_regression(row, base, args.tolerance):
+                    flag = '  regression'
+                    regressions += 1
+                print(backend.ljust(9) + str(events).ljust(13) + row['stage'].ljust(14)
+                      + str(row['seconds']).ljust(9) + change(row['seconds'], base and base['seconds']).ljust(8)
+                      + str(row['peak_memory_mb']).ljust(18) + change(row['peak_memory_mb'], base and base['peak_memory_mb']).ljust(8)
+                      + str(row['rows_out']) + flag)
+                results.append(row)
+
+    if args.save:
+        #sizes that were not run this time keep their baseline rows
+        measured = {(row['backend'], row['events'], row['stage']) for row in results}
+        kept = [row for key, row in baseline.items() if key not in measured]
+        write_baseline(args.baseline, results + [{**row, 'events': int(row['events'])} for row in kept])
+        print('baseline written to ' + args.baseline)
+    elif regressions:
+        sys.exit(str(regressions) + ' regressions against ' + args.baseline)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+import argparse
+import math
+
+import numpy as np
+import pandas as pd
+
+#journeys of the synthetic funnel start on a day in this period, like the vehicle sample data
+FIRST_DAY = np.datetime64('2025-04-01T00:00:00', 'us')
+
+def funnel_levels(action_count, branching):
+    # actions of every level of the funnel. like the vehicle funnel, a shared trunk is followed by levels with one
+    # action per branch (bike, truck, car questions) and a shared tail every branch merges into
+    if branching <= 1 or action_count < branching + 2:
+        return [['step_%02d' % (level + 1)] for level in range(action_count)]
+    branched = max(1, (action_count // 2) // branching)
+    shared = action_count - branched * branching
+    tail = max(1, shared // 3)
+    trunk = shared - tail
+    levels = []
+    for level in range(trunk + branched + tail):
+        if trunk <= level < trunk + branched:
+            levels.append(['step_%02d_b%d' % (level + 1, branch + 1) for branch in range(branching)])
+        else:
+            levels.append(['step_%02d' % (level + 1)])
+    return levels
+
+def generate_funnel_events(events=None, users=None, action_count=19, branching=4, journey_length=6.5, answer_cardinality=10,
+days=30, seed=0, shuffle=True):
+    # seeded synthetic events of a vehicle like funnel. pass the number of users, or the number of events and the
+    # last journey is cut to hit it exactly. users leave after every step with probability 1 / journey_length, pick a
+    # branch once (the first branches are the most common) and give skewed answers out of answer_cardinality values
+    if (events is None) == (users is None):
+        raise ValueError('pass either events or users')
+    rng = np.random.default_rng(seed)
+    levels = funnel_levels(action_count, branching)
+    depth = len(levels)
+    leave = 1.0 / max(journey_length, 1.0)
+
+    if users is None:
+        #expected journey length once journeys are capped at the funnel depth, with some headroom for the cut
+        mean_length = sum((1 - leave) ** step for step in range(depth))
+        users = math.ceil(events / mean_length * 1.05) + 10
+    lengths = np.minimum(rng.geometric(leave, size=users), depth)
+    if events is not None:
+        lengths = lengths[:np.searchsorted(np.cumsum(lengths), events) + 1]
+        lengths[-1] -= lengths.sum() - events
+    users = len(lengths)
+    rows = int(lengths.sum())
+
+    #action of every (level, branch), levels shared by all branches repeat their only action
+    names = [action for level in levels for action in level]
+    codes = np.array([[names.index(level[min(branch, len(level) - 1)]) for branch in range(branching)] for level in levels])
+    branches = (branching * rng.random(users) ** 2).astype(np.int64)
+
+    journey_start = np.cumsum(lengths) - lengths
+    steps = np.arange(rows) - np.repeat(journey_start, lengths)
+    actions = np.array(names, dtype=object)[codes[steps, np.repeat(branches, lengths)]]
+
+    #a few seconds between steps, the first step of a journey starts at its start time
+    gaps = (rng.exponential(8.0, size=rows) * 1e6).astype(np.int64) + 2_000_000
+    gaps[journey_start] = 0
+    offsets = np.cumsum(gaps)
+    offsets -= np.repeat(offsets[journey_start], lengths)
+    start_time = FIRST_DAY + rng.integers(0, days * 86400 * 10 ** 6, size=users).astype('timedelta64[us]')
+    action_start = np.repeat(start_time, lengths) + offsets.astype('timedelta64[us]')
+
+    answer_values = np.array([str(answer) for answer in range(answer_cardinality)], dtype=object)
+    answers = answer_values[(answer_cardinality * rng.random(rows) ** 2).astype(np.int64)]
+
+    df = pd.DataFrame({
+        'user_id': np.repeat(np.arange(users), lengths).astype(str),
+        'action': actions,
+        'action_start': action_start,
+        'answer': answers,
+    })
+    #events usually arrive unordered
+    if shuffle:
+        df = df.take(rng.permutation(rows)).reset_index(drop=True)
+    return df
+
+def goal_action(action_count=19, branching=4):
+    # last action of the funnel, every complete journey ends there
+    return funnel_levels(action_count, branching)[-1][0]
+
+def main():
+    parser = argparse.ArgumentParser(description='Write seeded synthetic funnel events to a csv or parquet file.')
+    parser.add_argument('output')
+    parser.add_argument('--events', type=int, default=1_000_000)
+    parser.add_argument('--action-count', type=int, default=19)
+    parser.add_argument('--branching', type=int, default=4)
+    parser.add_argument('--journey-length', type=float, default=6.5)
+    parser.add_argument('--answer-cardinality', type=int, default=10)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    df = generate_funnel_events(events=args.events, action_count=args.action_count, branching=args.branching,
+                                journey_length=args.journey_length, answer_cardinality=args.answer_cardinality,
+                                days=args.days, seed=args.seed)
+    if args.output.endswith('.parquet'):
+        df.to_parquet(args.output, index=False)
+    else:
+        df.to_csv(args.output, index=False)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+import polars as pl
+
+from funnelius.functions import transform
+from funnelius.profiling import reset_peak_memory, current_memory_mb, memory_growth_mb
+from synthetic_events import generate_funnel_events
+
+def run_single(backend, rows):
+    # runs one measurement, meant to be called in a fresh process so peak memory is not shared between runs
+    df = generate_funnel_events(events=rows)
+    if backend == 'polars':
+        df = pl.from_pandas(df)
+    reset_peak_memory()
+    memory_before = current_memory_mb()
+    started = time.perf_counter()
+    transform(df)
+    elapsed = time.perf_counter() - started
+    return {'backend': backend, 'rows': rows, 'seconds': round(elapsed, 3), 'peak_memory_mb': memory_growth_mb(memory_before)}
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure transform() speed and peak memory for growing inputs.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1_000_000, 10_000_000, 50_000_000])
+    parser.add_argument('--backends', nargs='+', default=['pandas', 'polars'])
+    parser.add_argument('--single', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(run_single(args.backends[0], args.rows[0])))
+        return
+
+    print('backend  rows         seconds  peak memory (MB)')
+    for rows in args.rows:
+        for backend in args.backends:
+            output = subprocess.run([sys.executable, __file__, '--single', '--backends', backend, '--rows', str(rows)],
+                                    capture_output=True, text=True)
+            if output.returncode != 0:
+                print(backend.ljust(9) + str(rows).ljust(13) + 'failed: ' + output.stderr.strip().splitlines()[-1])
+                continue
+            result = json.loads(output.stdout)
+            print(backend.ljust(9) + str(rows).ljust(13) + str(result['seconds']).ljust(9) + str(result['peak_memory_mb']))
+
+if __name__ == '__main__':
+    main()
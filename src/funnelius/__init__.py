@@ -1 +1,4 @@
-from funnelius.functions import render, interactive
\ No newline at end of file
+from funnelius.functions import render, render_segments, render_rolling, rolling_funnels, interactive
+from funnelius.incremental import FunnelState
+from funnelius.engine import Engine
+from funnelius.profiling import Profile
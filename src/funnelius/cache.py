@@ -0,0 +1,151 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+import polars as pl
+
+def estimate_size(value):
+    # approximate memory used by a stage result in bytes, stage results are dataframes or tuples of them
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pl.DataFrame):
+        return int(value.estimated_size())
+    if isinstance(value, (tuple, list)):
+        return sum(estimate_size(item) for item in value)
+    if isinstance(value, dict):
+        return sum(estimate_size(item) for item in value.values())
+    return 64
+
+class StageCache:
+    # least recently used cache for pipeline stage results, bounded by the memory its entries use.
+    # keys should contain a hash of the input data and every parameter the stage depends on.
+    def __init__(self, max_bytes=1024 ** 3):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+
+    def get(self, key, compute):
+        # returns the cached result for key, or runs compute() and stores its result
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+        value = compute()
+        size = estimate_size(value)
+        with self.lock:
+            self.misses += 1
+            if key not in self.entries and size <= self.max_bytes:
+                self.entries[key] = (value, size)
+                self.current_bytes += size
+                self.evict()
+        return value
+
+    def evict(self):
+        # drops least recently used entries until the cache fits in max_bytes
+        with self.lock:
+            while self.current_bytes > self.max_bytes and self.entries:
+                __key, (__value, size) = self.entries.popitem(last=False)
+                self.current_bytes -= size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.current_bytes = 0
+
+def user_cache_directory(name):
+    # cache directory of the current os user, under XDG_CACHE_HOME or ~/.cache. other users can not read or plant entries
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'funnelius', name)
+
+class DiskCache:
+    # least recently used cache of bytes in a local directory, bounded by the size of its files.
+    # file modification times record use, so the order survives restarts and is shared by processes using the directory.
+    # the directory is created for the current user only, a directory that can not be read or written makes get() run
+    # compute() without caching
+    def __init__(self, directory, max_bytes=256 * 1024 ** 2):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.compute_seconds = 0.0
+        self.lock = threading.RLock()
+
+    def path(self, key):
+        # keys are hex digests, so they are safe file names
+        return os.path.join(self.directory, key)
+
+    def get(self, key, compute):
+        # returns the cached bytes for key, or runs compute() and stores its result
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = f.read()
+            os.utime(path)
+            with self.lock:
+                self.hits += 1
+            return value
+        except OSError:
+            pass
+
+        started = time.perf_counter()
+        value = compute()
+        with self.lock:
+            self.misses += 1
+            self.compute_seconds += time.perf_counter() - started
+        if len(value) <= self.max_bytes:
+            self.put(path, value)
+        return value
+
+    def put(self, path, value):
+        #write to a temporary file first so readers never see a partly written entry
+        temporary_path = path + '.' + str(os.getpid()) + '.' + str(threading.get_ident()) + '.tmp'
+        try:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            with open(temporary_path, 'wb') as f:
+                f.write(value)
+            os.replace(temporary_path, path)
+            self.evict()
+        except OSError:
+            #a full disk or a directory of another user only costs the cache entry
+            try:
+                os.remove(temporary_path)
+            except OSError:
+                pass
+
+    def evict(self):
+        # removes least recently used files until the directory fits in max_bytes
+        with self.lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total_bytes = sum(size for __v1, size, __v2 in entries)
+            for __v1, size, path in sorted(entries):
+                if total_bytes <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total_bytes -= size
+
+    def stats(self):
+        # counters of this process, saved_seconds estimates the time hits saved from the average miss
+        with self.lock:
+            average_seconds = self.compute_seconds / self.misses if self.misses > 0 else 0.0
+            return {'hits': self.hits, 'misses': self.misses, 'compute_seconds': self.compute_seconds,
+                    'saved_seconds': self.hits * average_seconds}
+
+    def clear(self):
+        with self.lock:
+            if os.path.isdir(self.directory):
+                for entry in os.scandir(self.directory):
+                    if entry.is_file():
+                        os.remove(entry.path)
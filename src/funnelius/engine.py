@@ -0,0 +1,238 @@
+import os
+
+import pandas as pd
+import polars as pl
+
+from funnelius.functions import (frame_backend, pandas_to_polars, polars_to_pandas, scan_events, filter_date_range, is_duckdb_relation, check_not_duckdb,
+                                 duckdb_connection, scan_events_duckdb, transform_pd, transform_pl, transform_duckdb, transform_sharded,
+                                 apply_filter_pd, apply_filter_pl, apply_filter_duckdb, aggregate_pd, aggregate_pl, aggregate_duckdb,
+                                 aggregate_sharded, route_partials, index_routes, prefix_rows, duration_quantile_columns, collapse_answers_pd,
+                                 collapse_answers_pl, event_columns, load_events, partitioned_route_index, dataset_aggregates, collect_frames,
+                                 compare_aggregates, export_aggregates, draw_to_bytes, draw)
+from funnelius.profiling import profiler, stage, count_rows, is_deferred
+
+class Engine:
+    # runs the funnel pipeline with an explicit backend and default options. inputs are converted to the engine's
+    # backend and every step dispatches on the type of its input, so an engine keeps no per call state and engines with
+    # different backends can serve requests from a thread pool in one process. backend=None keeps the type of every
+    # input, the module level functions run on such a default engine.
+    # the duckdb backend queries files in place with one in-process database per engine, parallel sets its threads
+    def __init__(self, backend=None, duration_accuracy=0.01, parallel=1, compact=False, memory_limit=None):
+        if backend not in [None, 'pandas', 'polars', 'duckdb']:
+            raise ValueError("backend should be None, 'pandas', 'polars' or 'duckdb'")
+        self.backend = backend
+        self.duration_accuracy = duration_accuracy
+        self.parallel = parallel
+        self.compact = compact
+        self.connection = None
+        if backend == 'duckdb':
+            self.connection = duckdb_connection(parallel if parallel > 1 else None, memory_limit)
+
+    def to_backend(self, df):
+        # converts an event or aggregate table to the engine's backend, paths and lazy frames stay lazy for polars
+        if self.backend == 'polars' and isinstance(df, pd.DataFrame):
+            return pandas_to_polars(df)
+        if self.backend == 'pandas':
+            if isinstance(df, (str, os.PathLike)):
+                df = scan_events(df)
+            if isinstance(df, pl.LazyFrame):
+                df = df.collect(engine='streaming')
+            if isinstance(df, pl.DataFrame):
+                return polars_to_pandas(df)
+        if self.backend == 'duckdb':
+            #a duckdb connection is not shared between threads, every input gets its own cursor on the engine's database
+            if isinstance(df, (str, os.PathLike)):
+                return scan_events_duckdb(df, connection=self.connection.cursor())
+            if isinstance(df, pl.LazyFrame):
+                df = df.collect(engine='streaming')
+            if isinstance(df, pl.DataFrame):
+                return self.connection.cursor().from_arrow(df.to_arrow())
+            if isinstance(df, pd.DataFrame):
+                return self.connection.cursor().from_df(df)
+        return df
+
+    def transform(self, df, date_range=None, parallel=None, compact=None):
+        # adds action_order, first_action, action_next, duration and the Start rows, returns them with the first
+        # actions and all actions. parallel and compact default to the engine's
+        parallel = self.parallel if parallel is None else parallel
+        compact = self.compact if compact is None else compact
+        df = self.to_backend(df)
+        if isinstance(df, (str, os.PathLike)):
+            df = scan_events(df, date_range=date_range)
+        else:
+            df = filter_date_range(df, date_range)
+        if is_duckdb_relation(df):
+            return transform_duckdb(df)
+        if parallel > 1:
+            return transform_sharded(df, parallel)
+        if frame_backend(df) == 'polars':
+            return transform_pl(df)
+        else:
+            return transform_pd(df, compact)
+
+    def apply_filter(self, df, first_actions_filter=[], goals=[]):
+        if frame_backend(df) == 'polars':
+            return apply_filter_pl(df, first_actions_filter, goals)
+        elif frame_backend(df) == 'duckdb':
+            return apply_filter_duckdb(df, first_actions_filter, goals)
+        else:
+            return apply_filter_pd(df, first_actions_filter, goals)
+
+    def aggregate(self, df, route_num, max_visible_answers=5, duration_accuracy=None, parallel=None):
+        duration_accuracy = self.duration_accuracy if duration_accuracy is None else duration_accuracy
+        parallel = self.parallel if parallel is None else parallel
+        if frame_backend(df) == 'duckdb':
+            return aggregate_duckdb(df, route_num, max_visible_answers, duration_accuracy)
+        if parallel > 1:
+            return aggregate_sharded(df, route_num, max_visible_answers, duration_accuracy, parallel)
+        if frame_backend(df) == 'polars':
+            return aggregate_pl(df, route_num, max_visible_answers, duration_accuracy)
+        else:
+            return aggregate_pd(df, route_num, max_visible_answers, duration_accuracy)
+
+    def build_route_index(self, df, duration_accuracy=None):
+        # precomputes per route aggregates once after apply_filter, aggregate_route_index then reads any top routes from it
+        check_not_duckdb(df, 'build_route_index')
+        duration_accuracy = self.duration_accuracy if duration_accuracy is None else duration_accuracy
+        return index_routes(route_partials(df, duration_accuracy), frame_backend(df), duration_accuracy)
+
+    def aggregate_route_index(self, route_index, route_num, max_visible_answers=5):
+        # same node, edge and answer data as aggregate() for the first route_num routes, read from a route index
+        stride = route_index['route_num'] + 1
+        route_num = min(route_num, route_index['route_num'])
+
+        #calculte nodes aggregated data from cumulative sums
+        nodes = prefix_rows(route_index['nodes'], route_num, stride)
+        durations = prefix_rows(route_index['durations'], route_num, stride)
+        durations = durations[durations['count'] > 0]
+        quantile_columns = duration_quantile_columns(nodes['action'], durations, route_index['duration_accuracy'])
+        node_agg_data = pd.DataFrame({
+            'action': nodes['action'].to_numpy(),
+            **quantile_columns,
+            'duration_mean': (nodes['duration_sum'] / nodes['duration_count'].where(nodes['duration_count'] > 0)).to_numpy(),
+            'users': nodes['users'].to_numpy(),
+            'conversion_rate': (1.0 - nodes['drops'] / nodes['users']).to_numpy(),
+            'is_drop': False,
+        })
+
+        #calculate edges aggregated data
+        edge_agg_data = prefix_rows(route_index['edges'], route_num, stride)
+        edge_agg_data = edge_agg_data[['action', 'action_next', 'edge_count', 'is_drop']].reset_index(drop=True)
+
+        #some nodes only appear in action_next column but still we should draw them
+        missing_end_points = edge_agg_data[~edge_agg_data['action_next'].isin(node_agg_data['action'])]
+        missing_end_points = missing_end_points.groupby('action_next').agg(users=('edge_count', 'sum'), is_drop=('is_drop', 'first')).reset_index()
+        missing_end_points.rename(columns={'action_next':'action'}, inplace=True)
+        node_agg_data = pd.concat([node_agg_data, missing_end_points], ignore_index=True)
+
+        #calcualte total users
+        total_users = route_index['routes']['users'].iloc[:route_num].sum()
+        node_agg_data['percent_of_total'] = node_agg_data['users'] / total_users
+        node_agg_data['is_drop'] = node_agg_data.pop('is_drop').astype(bool)
+
+        #answer counts are summed, then collapsed like aggregate does
+        answer_agg_data = prefix_rows(route_index['answers'], route_num, stride)
+        answer_agg_data = answer_agg_data[['action', 'answer', 'answer_count']].reset_index(drop=True)
+
+        if route_index['backend'] == 'polars':
+            count_type = pl.get_index_type()
+            node_agg_data = pandas_to_polars(node_agg_data).with_columns(pl.col('users').cast(count_type))
+            edge_agg_data = pandas_to_polars(edge_agg_data).with_columns(pl.col('edge_count').cast(count_type))
+            answer_agg_data = pandas_to_polars(answer_agg_data).with_columns(pl.col('answer_count').cast(count_type))
+            answer_agg_data = collapse_answers_pl(answer_agg_data.lazy(), max_visible_answers).collect()
+        else:
+            answer_agg_data = collapse_answers_pd(answer_agg_data, max_visible_answers)
+        return node_agg_data, edge_agg_data, answer_agg_data
+
+    def render(self, df, title='export', first_actions_filter = [], goals = [], max_path_num = 0, show_drop = True , show_answer=False, max_visible_answers=5, comparison_df = None,
+    gradient = ['#ffcdcd','#fff','#cdffcd'], gradient_metric = 'conversion-rate', metrics = ['conversion-rate','users','percent-of-total','duration-median'], partitions = 0, duration_accuracy = None, parallel = None, export_formats = ['pdf'], output = 'file', export_data = None, date_range = None, compact = None, profile = None):
+        # same options as funnelius.render, duration_accuracy, parallel and compact default to the engine's
+        max_edge_width = 20
+        min_edge_count = 0
+        duration_accuracy = self.duration_accuracy if duration_accuracy is None else duration_accuracy
+        parallel = self.parallel if parallel is None else parallel
+        compact = self.compact if compact is None else compact
+        profile = profiler(profile)
+
+        if output not in ['file', 'bytes']:
+            raise ValueError("output should be 'file' or 'bytes'")
+
+        #comparison_df is one dataset or a list of them
+        if comparison_df is None:
+            comparison_dfs = []
+        elif isinstance(comparison_df, (list, tuple)):
+            comparison_dfs = list(comparison_df)
+        else:
+            comparison_dfs = [comparison_df]
+
+        #answers are not read when they are neither drawn nor exported
+        if show_answer or export_data is not None:
+            columns = event_columns
+        else:
+            columns = [column for column in event_columns if column != 'answer']
+
+        frames = [load_events(self.to_backend(frame), columns, date_range, first_actions_filter) for frame in [df] + comparison_dfs]
+        df = frames[0]
+
+        #duckdb queries already run on all cores and spill to disk by themselves
+        if (partitions > 0 or parallel > 1) and not is_duckdb_relation(df):
+            #out-of-core and parallel mode, user id hash partitions are spilled to disk and processed by parallel workers
+            backend = frame_backend(df)
+            partitions = max(partitions, parallel)
+            with stage(profile, 'route_index', count_rows(*frames)) as record:
+                route_indexes = [partitioned_route_index(frame, first_actions_filter, goals, partitions, backend, duration_accuracy=duration_accuracy, parallel=parallel) for frame in frames]
+                record['rows_out'] = sum(len(route_index['routes']) for route_index in route_indexes)
+            route_num = max(route_index['route_num'] for route_index in route_indexes)
+
+            if max_path_num > 0:
+                route_num = min(route_num,max_path_num)
+
+            with stage(profile, 'aggregate', record['rows_out']) as record:
+                aggregates = [self.aggregate_route_index(route_index, route_num, max_visible_answers) for route_index in route_indexes]
+                record['rows_out'] = sum(count_rows(*aggregate) for aggregate in aggregates)
+        elif len(frames) > 1:
+            #all datasets go through one transform, filter and aggregation keyed by dataset
+            with stage(profile, 'dataset_aggregates', count_rows(*frames)) as record:
+                aggregates = dataset_aggregates(frames, first_actions_filter, goals, max_path_num, max_visible_answers, duration_accuracy)
+                record['rows_out'] = sum(count_rows(*aggregate) for aggregate in aggregates)
+        else:
+            with stage(profile, 'transform', count_rows(df)) as record:
+                data, first_actions, all_actions = self.transform(df, parallel=1, compact=compact)
+                record['rows_out'] = count_rows(data)
+                record['deferred'] = is_deferred(data)
+            with stage(profile, 'apply_filter', record['rows_out']) as record:
+                data, route_num =  self.apply_filter(data, first_actions_filter, goals)
+                record['rows_out'] = count_rows(data)
+                record['deferred'] = is_deferred(data)
+
+            if max_path_num > 0:
+                #route number of a lazy query is not known before it is collected
+                if route_num is None:
+                    route_num = max_path_num
+                else:
+                    route_num = min(route_num,max_path_num)
+
+            with stage(profile, 'aggregate', record['rows_out']) as record:
+                data_node, data_edge, data_answer = self.aggregate(data, route_num, max_visible_answers, duration_accuracy, parallel=1)
+                aggregates = [collect_frames(data_node, data_edge, data_answer)]
+                record['rows_out'] = count_rows(*aggregates[0])
+
+        if len(aggregates) > 1:
+            #metrics of comparison datasets and their change are added as columns
+            with stage(profile, 'compare', sum(count_rows(*aggregate) for aggregate in aggregates)) as record:
+                data_node, data_edge, data_answer = compare_aggregates(aggregates)
+                record['rows_out'] = count_rows(data_node, data_edge, data_answer)
+        else:
+            data_node, data_edge, data_answer = aggregates[0]
+
+        #aggregated data is exported with both outputs
+        if export_data is not None:
+            with stage(profile, 'export', count_rows(data_node, data_edge, data_answer)):
+                export_aggregates(data_node, data_edge, data_answer, export_data)
+
+        if output == 'bytes':
+            return draw_to_bytes(data_node, data_edge, data_answer, goals, min_edge_count, max_edge_width, show_drop, show_answer, max_visible_answers, export_formats, gradient , gradient_metric, metrics, profile)
+        draw(data_node, data_edge, data_answer, goals, min_edge_count, max_edge_width, title, show_drop, show_answer, max_visible_answers, export_formats, gradient , gradient_metric, metrics, None, profile)
+
+#engine of the module level functions, it keeps the backend of every input
+default_engine = Engine()
@@ -2,8 +2,31 @@ import pandas as pd
 import polars as pl
 import graphviz
 import numpy as np
+import os
+import json
+import hashlib
+import tempfile
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from pandas.api.types import is_datetime64_any_dtype as is_datetime
-df_backend = 'pandas'
+from funnelius.sketch import bucket_index, bucket_index_pl, bucket_index_sql, grouped_quantiles, sketch_quantile_pl
+from funnelius.cache import StageCache, DiskCache, user_cache_directory
+from funnelius.profiling import profiler, stage, count_rows
+#node positions of laid out graphs, keyed by graph topology
+layout_cache = StageCache(64 * 1024 ** 2)
+#graphviz output keyed by a hash of the dot source, engine and format
+render_cache = DiskCache(user_cache_directory('render'), 256 * 1024 ** 2)
+
+def frame_backend(df):
+    # backend of a dataframe, every function dispatches on the type of its input so threads share no backend state.
+    # paths are scanned with polars
+    if isinstance(df, (pl.DataFrame, pl.LazyFrame, str, os.PathLike)):
+        return 'polars'
+    elif is_duckdb_relation(df):
+        return 'duckdb'
+    else:
+        return 'pandas'
 
 def format_change_percent(value):
     if np.isnan(value):
@@ -33,88 +56,184 @@ def hex_to_rgb(hex_values):
     return rgb_list
 
 def export_to_csv(node_data, edge_data, answer_data):
-    global df_backend
-    node_data_export, edge_date_export = friendly_drop_names(node_data, edge_data)
-    if df_backend == 'polars':
-        node_data_export.write_csv('node_data.csv')
-        edge_date_export.write_csv('edge_data.csv')
-        answer_data.write_csv('answer_data.csv')
+    export_aggregates(node_data, edge_data, answer_data, 'csv')
+
+def export_aggregates(node_data, edge_data, answer_data, format='parquet', directory='.'):
+    # writes node_data, edge_data and answer_data files in csv, parquet or arrow (ipc) format
+    extensions = {'csv': '.csv', 'parquet': '.parquet', 'arrow': '.arrow'}
+    if format not in extensions:
+        raise ValueError('format should be csv, parquet or arrow')
+    node_data_export, edge_data_export = friendly_drop_names(node_data, edge_data)
+    frames = {'node_data': node_data_export, 'edge_data': edge_data_export, 'answer_data': answer_data}
+    for name, frame in frames.items():
+        path = os.path.join(directory, name + extensions[format])
+        if frame_backend(frame) == 'polars':
+            if format == 'csv':
+                frame.write_csv(path)
+            elif format == 'parquet':
+                frame.write_parquet(path)
+            else:
+                frame.write_ipc(path)
+        else:
+            if format == 'csv':
+                frame.to_csv(path, index=False)
+            elif format == 'parquet':
+                frame.to_parquet(path, index=False)
+            else:
+                import pyarrow.feather
+                pyarrow.feather.write_feather(pandas_to_arrow(frame), path)
+
+def aggregates_to_arrow(node_data, edge_data, answer_data):
+    # node_data, edge_data and answer_data as pyarrow tables. polars frames are handed over without copying, action
+    # labels are dictionary encoded on both backends
+    node_data_export, edge_data_export = friendly_drop_names(node_data, edge_data)
+    frames = [node_data_export, edge_data_export, answer_data]
+    if frame_backend(node_data) == 'polars':
+        tables = [frame.to_arrow() for frame in frames]
     else:
-        node_data_export.to_csv('node_data.csv', index=False)
-        edge_date_export.to_csv('edge_data.csv', index=False)
-        answer_data.to_csv('answer_data.csv', index=False)
+        tables = [pandas_to_arrow(frame) for frame in frames]
+    return tuple(dictionary_labels(table) for table in tables)
+
+def dictionary_labels(table):
+    #pandas categoricals and polars strings both become dictionary<int32, string> columns
+    for name in ['action', 'action_next']:
+        if name in table.column_names:
+            column = table.column(name).cast('string').dictionary_encode()
+            table = table.set_column(table.column_names.index(name), name, column)
+    return table
+
+def pandas_to_arrow(frame):
+    import pyarrow as pa
+    return pa.Table.from_pandas(frame, preserve_index=False)
+
+def friendly_drop_labels_pd(column):
+    #drop labels are renamed in the dictionary of unique values, rows only keep their code
+    codes, labels = pd.factorize(column)
+    labels = pd.Index(labels, dtype=object).str.replace('Funnelius-Drop', 'Drop:', regex=False)
+    if labels.is_unique:
+        return pd.Series(pd.Categorical.from_codes(codes, labels), index=column.index, name=column.name)
+    return pd.Series(labels.take(codes, allow_fill=True, fill_value=np.nan), index=column.index, name=column.name)
 
 def friendly_drop_names_pd(node_data, edge_data):
-    node_data_export = node_data.copy()
-    edge_data_export = edge_data.copy()
+    #shallow copies share the other columns with the input
+    node_data_export = node_data.copy(deep=False)
+    edge_data_export = edge_data.copy(deep=False)
     
-    node_data_export['action'] = node_data_export['action'].str.replace('Funnelius-Drop', 'Drop:', regex = False)
-    edge_data_export['action_next'] = edge_data_export['action_next'].str.replace('Funnelius-Drop', 'Drop:', regex = False)
+    node_data_export['action'] = friendly_drop_labels_pd(node_data['action'])
+    edge_data_export['action_next'] = friendly_drop_labels_pd(edge_data['action_next'])
     return node_data_export, edge_data_export
 
-def friendly_drop_names_pl(node_data, edge_data):
-    node_data_export = node_data.clone()
-    edge_data_export = edge_data.clone()
+def friendly_drop_labels_pl(column, frame):
+    #only the unique labels are rewritten, rows are remapped by lookup
+    labels = frame.get_column(column).drop_nulls().unique()
+    friendly = labels.str.replace('Funnelius-Drop', 'Drop:', literal=True)
+    return pl.col(column).replace(labels, friendly)
 
-    node_data_export = node_data_export.with_columns(
-        pl.col('action').str.replace('Funnelius-Drop', 'Drop:').alias('action')
-    )
-    edge_data_export = edge_data_export.with_columns(
-        pl.col('action_next').str.replace('Funnelius-Drop', 'Drop:').alias('action_next')
-    )
+def friendly_drop_names_pl(node_data, edge_data):
+    node_data_export = node_data.with_columns(friendly_drop_labels_pl('action', node_data))
+    edge_data_export = edge_data.with_columns(friendly_drop_labels_pl('action_next', edge_data))
     return node_data_export, edge_data_export
 
 def friendly_drop_names(node_data, edge_data):
     #check if it is a polars dataframe
-    global df_backend
-    if df_backend == 'polars':
+    if frame_backend(node_data) == 'polars':
         return friendly_drop_names_pl(node_data, edge_data)
     else:
         return friendly_drop_names_pd(node_data, edge_data)
 
-def transform_pd(df):
+def take_values(series, rows, allow_fill=False):
+    # gathers values of a pandas series by position, keeping extension dtypes. -1 means missing when allow_fill is set
+    if isinstance(series.dtype, pd.api.extensions.ExtensionDtype):
+        values = series.array
+    else:
+        values = series.to_numpy()
+    return pd.api.extensions.take(values, rows, allow_fill=allow_fill)
+
+def compact_events_pd(df):
+    # only the event columns are kept. user ids become integer codes and actions become categoricals over one
+    # dictionary that also holds the Start, End and drop labels apply_filter adds later. the dictionary is sorted,
+    # so group-bys on the codes come out in the same order as on plain strings
+    df = df[[column for column in event_columns if column in df.columns]]
+    user_codes = pd.factorize(df['user_id'], sort=True)[0]
+    actions = pd.Index(pd.unique(df['action'].dropna()), dtype=object)
+    labels = actions.append(pd.Index(['Start', 'End'], dtype=object)).append('Funnelius-Drop' + actions)
+    compact = {
+        'user_id': user_codes.astype('int32' if len(user_codes) < 2 ** 31 else 'int64'),
+        'action': pd.Categorical(df['action'], categories=labels.unique().sort_values()),
+    }
+    if 'answer' in df.columns:
+        compact['answer'] = df['answer'].astype('category')
+    return df.assign(**compact)
+
+def decode_categories(table):
+    #aggregated tables are small, categorical keys of compact events are turned back into plain strings
+    for column in table.columns:
+        if isinstance(table[column].dtype, pd.CategoricalDtype):
+            table[column] = table[column].astype(object)
+    return table
+
+def transform_pd(df, compact=False):
+    #work on a shallow copy so new columns are not added to the caller's dataframe
+    if compact:
+        df = compact_events_pd(df)
+    else:
+        df = df.copy(deep=False)
+    df.index = pd.RangeIndex(len(df))
+
     #if answer column ommited, create it with empty values
     if 'answer' not in df.columns:
-        df[required_column] = np.nan
+        df['answer'] = np.nan
 
     #convert action start to timeformat in python
     if not is_datetime(df['action_start']):
         df['action_start'] = pd.to_datetime(df['action_start'])
 
-    #create a column to show order of happened actions
-    df['action_order'] = df.groupby('user_id')['action_start'].rank(method='first').astype(int)
-
-    #create a dataframe for the very first action of every user
-    df_first_action = df[df['action_order']==1][['user_id','action']]
-    df_first_action.rename(columns={'action': 'first_action'}, inplace=True)
-
-    #join it to data frame to have first action of every user. this will be used to filter based on first action
-    data = pd.merge(df, df_first_action, on='user_id', how='left')
-
-    #create_next_action dataframe
-    data_next = data.copy()
-    data_next['action_order'] -= 1
-
-    #join with original data to have next action for every action
-    data = pd.merge(data, data_next[['user_id', 'action_order', 'action', 'action_start']],
-                on=['user_id','action_order'], how='left', suffixes =('','_next'))
+    #sort once by user and action start. lexsort is stable, so ties keep their original order like rank(method='first')
+    user_codes = pd.factorize(df['user_id'], sort=True)[0]
+    action_start = df['action_start'].to_numpy(dtype='datetime64[ns]')
+    order = np.lexsort((action_start, user_codes))
+    row_count = len(order)
+
+    #find where every user's journey starts and whether each action has a next action in the sorted sequence
+    sorted_codes = user_codes[order]
+    is_first = np.ones(row_count, dtype=bool)
+    is_first[1:] = sorted_codes[1:] != sorted_codes[:-1]
+    has_next = np.zeros(row_count, dtype=bool)
+    has_next[:-1] = ~is_first[1:]
+    positions = np.arange(row_count)
+    group_start = np.maximum.accumulate(np.where(is_first, positions, 0))
+
+    #map sorted positions back to original rows, so the output keeps the input row order
+    action_order = np.empty(row_count, dtype='int64')
+    action_order[order] = positions - group_start + 1
+    first_row = np.empty(row_count, dtype='int64')
+    first_row[order] = order[group_start]
+    next_row = np.full(row_count, -1, dtype='int64')
+    next_row[order[has_next]] = order[np.flatnonzero(has_next) + 1]
+
+    data = df
+    data['action_order'] = action_order.astype('int32') if compact else action_order
+    data['first_action'] = take_values(df['action'], first_row)
+    data['action_next'] = take_values(df['action'], next_row, allow_fill=True)
 
     #caculate time spent by user_id in the action
-    data['duration'] = data.apply( lambda row: np.nan if pd.isna(row['action_next'])
-                               else (row['action_start_next'] - row['action_start']).total_seconds(), axis =1 )
-
-
-    #Drop action_start_next column as it is no longer needed
-    data.drop(columns=['action_start_next'], inplace=True)
-
-    #add start Node
-    start_rows = data.groupby('user_id').agg({'action_start': 'min', 'first_action': 'first'})
-    start_rows = start_rows.reset_index()
-    start_rows['action'] = 'Start'
-    start_rows['action_order'] = 0
+    duration = (action_start[next_row] - action_start) / np.timedelta64(1, 's')
+    data['duration'] = np.where(data['action_next'].isna().to_numpy(), np.nan, duration)
+    if compact:
+        data['duration'] = data['duration'].astype('float32')
+
+    #add start Node, start rows come in user_id order like a groupby
+    start_positions = order[np.flatnonzero(is_first)]
+    start_rows = pd.DataFrame({
+        'user_id': take_values(df['user_id'], start_positions),
+        'action': pd.Series('Start', index=range(len(start_positions))).astype(df['action'].dtype),
+        'action_start': take_values(df['action_start'], start_positions),
+        'action_order': np.zeros(len(start_positions), dtype=data['action_order'].dtype),
+        'first_action': take_values(df['action'], start_positions),
+    })
     start_rows['action_next'] = start_rows['first_action']
-    data = pd.concat([data, start_rows[['user_id', 'action', 'action_start', 'action_order', 'first_action', 'action_next']]])
-    
+    data = pd.concat([data, start_rows])
+
     #calculate filter variables 
     first_actions = data[data['action_order']==1]['action'].drop_duplicates().tolist()
     all_actions = data['action'].drop_duplicates().tolist()
@@ -122,52 +241,70 @@ def transform_pd(df):
     
     return data, first_actions, all_actions
 
+def parse_action_start_pl(df, schema):
+    if schema['action_start'] != pl.Datetime:
+        df = df.with_columns(
+            pl.col("action_start").str.to_datetime().alias("action_start")
+        )
+    return df
+
+def prefilter_first_actions_pl(df, first_actions_filter):
+    # keeps only users whose earliest action is in first_actions_filter, so a lazy query skips other users before transform
+    if first_actions_filter == []:
+        return df
+    events = parse_action_start_pl(df.select('user_id', 'action', 'action_start'), df.collect_schema())
+    users = (
+        events.group_by('user_id')
+        .agg(pl.col('action').sort_by('action_start', maintain_order=True).first().alias('first_action'))
+        .filter(pl.col('first_action').is_in(first_actions_filter))
+    )
+    return df.join(users.select('user_id'), on='user_id', how='semi')
+
 def transform_pl(df):
+    #every step is built on a lazy query, an eager dataframe is collected at the end
+    is_lazy = isinstance(df, pl.LazyFrame)
+    #other columns, for example a segment column, can not be carried to the Start rows
+    df = select_events(df.lazy())
+    schema = df.collect_schema()
+
     #if answer column ommited, create it with empty values
-    if 'answer' not in df.columns:
-        df = df.with_columns(pl.lit(None).alias(required_column))
+    if 'answer' not in schema.names():
+        df = df.with_columns(pl.lit(None).alias('answer'))
         
     #convert action start to timeformat in python
-    if df["action_start"].dtype != pl.Datetime:
-        df = df.with_columns(
-            pl.col("action_start").str.to_datetime().alias("action_start")
-        )    
-    #create a column to show order of happened actions
-    df = df.with_columns(
-        pl.col('action_start').rank(method="ordinal").over(pl.col('user_id')).alias('action_order')
+    df = parse_action_start_pl(df, schema)
+    #sort once by user and action start, every derived column below comes from this single ordering
+    data = df.sort(['user_id', 'action_start'], maintain_order=True, nulls_last=True)
+    data = data.with_columns(
+        pl.int_range(pl.len()).alias('__row'),
+        (pl.col('user_id') != pl.col('user_id').shift(1)).fill_null(True).alias('__is_first'),
+        (pl.col('user_id') == pl.col('user_id').shift(-1)).fill_null(False).alias('__has_next')
     )
-    #create a dataframe for the very first action of every user
-    df_first_action = df.filter(
-        pl.col('action_order') == 1
-    ).select(
-        pl.col('user_id'), pl.col('action').alias('first_action')
+    data = data.with_columns(
+        pl.when(pl.col('__is_first')).then(pl.col('__row')).forward_fill().alias('__group_start')
     )
-    #join it to data frame to have first action of every user. this will be used to filter based on first action
-    data = df.join(
-        df_first_action, on='user_id', how='left')
-    #create_next_action dataframe
-    data_next = data.clone()
-    data_next = data_next.with_columns(
-        (pl.col('action_order')-1).alias('action_order')
+    #create a column to show order of happened actions and the very first action of every user
+    data = data.with_columns(
+        (pl.col('__row') - pl.col('__group_start') + 1).cast(pl.get_index_type()).alias('action_order'),
+        pl.col('action').gather(pl.col('__group_start')).alias('first_action'),
+        pl.when(pl.col('__has_next')).then(pl.col('action').shift(-1)).alias('action_next'),
+        pl.when(pl.col('__has_next')).then(pl.col('action_start').shift(-1)).alias('action_start_next')
     )
-    #join with original data to have next action for every action
-    data = data.join(data_next['user_id', 'action_order','action', 'action_start'], on=['user_id', 'action_order'], how='left', suffix='_next')
-    #caculate time spent by user_id in the action
+    #caculate time spent by user_id in the action, total_seconds would drop the fraction of a second
     data = data.with_columns(
         pl.when(pl.col('action_next').is_null()).
         then(np.nan).
-        otherwise((pl.col('action_start_next')-pl.col('action_start')).dt.total_seconds()).
+        otherwise((pl.col('action_start_next')-pl.col('action_start')).dt.total_nanoseconds() / 1e9).
         alias('duration')
     )
-    #Drop action_start_next column as it is no longer needed
-    data = data.drop('action_start_next')
-    #add start Node
-    start_rows = data.group_by(
-        pl.col('user_id')
-    ).agg(
-        pl.col('action_start').min().alias('action_start'),
-        pl.col('first_action').first().alias('first_action')
+    #add start Node, first row of every user already holds the minimum action_start
+    start_rows = data.filter(pl.col('__is_first')).select(
+        pl.col('user_id'),
+        pl.col('action_start'),
+        pl.col('first_action')
     )
+    #Drop helper columns as they are no longer needed
+    data = data.drop('action_start_next', '__row', '__is_first', '__has_next', '__group_start')
     start_rows = start_rows.with_columns(
         pl.lit('Start').alias('action'),
         pl.lit(0).alias('action_order'),
@@ -175,39 +312,259 @@ def transform_pl(df):
         pl.lit('-').alias('answer'),
         pl.col('first_action').alias('action_next')
     )
-    data = pl.concat([data, start_rows['user_id', 'action', 'action_start', 'answer', 'action_order', 'first_action', 'action_next','duration']], how='vertical_relaxed')
+    data = pl.concat([data, start_rows.select('user_id', 'action', 'action_start', 'answer', 'action_order', 'first_action', 'action_next','duration')], how='vertical_relaxed')
     #calculate filter variables 
-    first_actions = data.filter(pl.col('action_order') == 1).select('action').unique().to_series().to_list()
+    first_actions = data.filter(pl.col('action_order') == 1).select('action').unique()
+    all_actions = data.select('action').unique()
+
+    #for a lazy input the filter variables stay lazy too, collect them only when they are needed
+    if is_lazy:
+        return data, first_actions, all_actions
+
+    data = data.collect()
+    first_actions = data.lazy().filter(pl.col('action_order') == 1).select('action').unique().collect().to_series().to_list()
     all_actions = data.select('action').unique().to_series().to_list()
+    return data, first_actions, all_actions
 
+def transform_duckdb(df):
+    # same rows as transform_pd as one lazy duckdb query. the position in the input breaks ties of action_start like
+    # the stable sorts of the other backends
+    answer = 'answer' if 'answer' in df.columns else 'NULL'
+    data = df.query('events', '''
+        WITH numbered AS (
+            SELECT user_id, action, CAST(action_start AS TIMESTAMP) AS action_start, ''' + answer + ''' AS answer, row_number() OVER () AS __row
+            FROM events
+        ), journeys AS (
+            SELECT user_id, action, action_start, answer,
+                row_number() OVER journey AS action_order,
+                first_value(action) OVER journey AS first_action,
+                lead(action) OVER journey AS action_next,
+                (epoch_us(lead(action_start) OVER journey) - epoch_us(action_start)) / 1e6 AS duration
+            FROM numbered
+            WINDOW journey AS (PARTITION BY user_id ORDER BY action_start, __row)
+        )
+        SELECT * FROM journeys
+        UNION ALL
+        SELECT user_id, 'Start', action_start, NULL, 0, first_action, first_action, NULL
+        FROM journeys WHERE action_order = 1
+    ''')
+    #filter variables stay lazy like the ones of a polars lazy query
+    first_actions = data.filter('action_order = 1').project('action').distinct()
+    all_actions = data.project('action').distinct()
     return data, first_actions, all_actions
 
-def transform(df):
-    #check if it is a polars dataframe
-    global df_backend
-    if isinstance(df, pl.DataFrame):
-        df_backend = 'polars'
-        return transform_pl(df)
+#the only event columns funnelius reads
+event_columns = ['user_id', 'action', 'action_start', 'answer']
+
+def scan_events(path, columns=event_columns, date_range=None):
+    # lazily scans an event file. parquet row groups outside date_range are skipped by their statistics,
+    # arrow ipc files are memory mapped so they are not read into memory up front
+    path = str(path)
+    if path.endswith('.parquet'):
+        df = pl.scan_parquet(path)
+    elif path.endswith(('.arrow', '.ipc', '.feather')):
+        df = pl.scan_ipc(path)
+    else:
+        df = pl.scan_csv(path)
+    return select_events(df, columns, date_range)
+
+def select_events(df, columns=event_columns, date_range=None):
+    # projection and date range filter of a lazy event query, both are pushed down to the scan by polars
+    schema = df.collect_schema()
+    df = df.select([column for column in columns if column in schema.names()])
+    return filter_date_range(df, date_range)
+
+def filter_date_range_pd(df, date_range):
+    action_start = df['action_start']
+    if not is_datetime(action_start):
+        action_start = pd.to_datetime(action_start)
+    start, end = date_range
+    keep = np.ones(len(df), dtype=bool)
+    if start is not None:
+        keep &= (action_start >= pd.Timestamp(start)).to_numpy()
+    if end is not None:
+        keep &= (action_start < pd.Timestamp(end)).to_numpy()
+    return df[keep]
+
+def filter_date_range_pl(df, date_range):
+    #datetime columns are compared as they are stored, so parquet statistics can prune row groups
+    df = parse_action_start_pl(df, df.collect_schema())
+    start, end = date_range
+    if start is not None:
+        df = df.filter(pl.col('action_start') >= pd.Timestamp(start).to_pydatetime())
+    if end is not None:
+        df = df.filter(pl.col('action_start') < pd.Timestamp(end).to_pydatetime())
+    return df
+
+def filter_date_range_duckdb(df, date_range):
+    start, end = date_range
+    if start is not None:
+        df = df.filter('action_start >= ' + sql_literal(pd.Timestamp(start)))
+    if end is not None:
+        df = df.filter('action_start < ' + sql_literal(pd.Timestamp(end)))
+    return df
+
+def filter_date_range(df, date_range):
+    # keeps events with start <= action_start < end, date_range is a (start, end) pair and either side can be None
+    if date_range is None:
+        return df
+    if isinstance(df, (pl.DataFrame, pl.LazyFrame)):
+        return filter_date_range_pl(df, date_range)
+    elif is_duckdb_relation(df):
+        return filter_date_range_duckdb(df, date_range)
     else:
-        df_backend = 'pandas'
-        return transform_pd(df)
+        return filter_date_range_pd(df, date_range)
+
+def is_duckdb_relation(df):
+    #duckdb is optional, its relations are recognized without importing it
+    return type(df).__name__ == 'DuckDBPyRelation'
+
+def check_not_duckdb(df, function_name):
+    #route partials are built from dataframes, functions reading them do not run on duckdb relations
+    if is_duckdb_relation(df):
+        raise ValueError(function_name + ' cannot run on a duckdb relation, pass a pandas or polars dataframe or a file path')
+
+def sql_literal(value):
+    if isinstance(value, pd.Timestamp):
+        return "TIMESTAMP '" + value.isoformat(sep=' ') + "'"
+    return "'" + str(value).replace("'", "''") + "'"
+
+def sql_in(column, values):
+    # sql condition of column being one of values, an empty list matches nothing
+    if len(values) == 0:
+        return 'false'
+    return column + ' IN (' + ', '.join(sql_literal(value) for value in values) + ')'
+
+def duckdb_connection(threads=None, memory_limit=None, temp_directory=None):
+    # in-process duckdb database. queries run on all cores unless threads is set, and sorts, windows and joins that
+    # do not fit in memory_limit spill to temp_directory
+    import duckdb
+    config = {'temp_directory': temp_directory or os.path.join(tempfile.gettempdir(), 'funnelius-duckdb')}
+    if threads is not None:
+        config['threads'] = threads
+    if memory_limit is not None:
+        config['memory_limit'] = memory_limit
+    return duckdb.connect(config=config)
+
+def scan_events_duckdb(path, columns=event_columns, date_range=None, connection=None):
+    # duckdb relation over a csv or parquet file (or glob), the file is queried in place. like scan_events, only the
+    # needed columns are read and the date range is pushed down to the scan
+    if connection is None:
+        connection = duckdb_connection()
+    reader = 'read_parquet' if str(path).endswith('.parquet') else 'read_csv'
+    df = connection.sql('SELECT * FROM ' + reader + '(' + sql_literal(os.fspath(path)) + ')')
+    return select_events_duckdb(df, columns, date_range)
+
+def select_events_duckdb(df, columns=event_columns, date_range=None):
+    #action_start is compared as a timestamp, csv columns that were not detected as one are cast
+    expressions = []
+    for column in columns:
+        if column == 'action_start':
+            expressions.append('CAST(action_start AS TIMESTAMP) AS action_start')
+        elif column in df.columns:
+            expressions.append(column)
+    return filter_date_range_duckdb(df.project(', '.join(expressions)), date_range or (None, None))
+
+def collect_frames(*frames):
+    # collects lazy polars results together with the streaming engine, so shared parts of the plan run once
+    if not any(isinstance(frame, pl.LazyFrame) for frame in frames):
+        return frames
+    return pl.collect_all([frame.lazy() for frame in frames], engine='streaming')
+
+def transform(df, parallel=1, date_range=None, compact=False):
+    # transform, apply_filter, aggregate, the route index functions and render run on the default engine
+    from funnelius.engine import default_engine
+    return default_engine.transform(df, date_range, parallel, compact)
+
+def mix_hash(values):
+    # splitmix64 finalizer, spreads bits of uint64 values so summed route hashes do not collide on similar routes
+    values = values + np.uint64(0x9E3779B97F4A7C15)
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+def route_step_hashes(actions, action_orders):
+    # hash of every (action, action_order) step, a route id is the wrapping sum of its steps
+    action_codes, unique_actions = pd.factorize(actions)
+    action_hashes = pd.util.hash_pandas_object(pd.Series(unique_actions, dtype=object), index=False).to_numpy()
+    return mix_hash(action_hashes[action_codes] ^ mix_hash(np.asarray(action_orders).astype('uint64')))
+
+def route_ids_pd(df):
+    # returns an integer route id for every user, a hash of the (action, action_order) pairs of the journey
+    user_codes, users = pd.factorize(df['user_id'])
+    #hash every step once, then sum them per user. a sum does not need the steps to be sorted
+    step_hashes = route_step_hashes(df['action'], df['action_order'].to_numpy())
+    user_routes = np.zeros(len(users), dtype='uint64')
+    np.add.at(user_routes, user_codes, step_hashes)
+    return user_codes, user_routes.view('int64')
+
+#joins the actions of a route, it sorts before any printable character so joined routes sort like lists of actions
+route_path_separator = '\x1f'
+
+def route_paths_pd(user_codes, user_routes, actions, action_orders):
+    # actions of every route in journey order joined by route_path_separator, read from one user per route. user_routes
+    # holds the route code of every user, paths are returned by route code. routes of equal user counts are ranked by
+    # their path, which is the same on every backend unlike route ids
+    representatives = np.zeros(len(user_routes), dtype=bool)
+    representatives[np.unique(user_routes, return_index=True)[1]] = True
+    rows = np.flatnonzero(representatives[user_codes] & (action_orders > 0))
+    routes = user_routes[user_codes[rows]]
+    rows = rows[np.lexsort((action_orders[rows], routes))]
+    routes = user_routes[user_codes[rows]]
+    starts = np.flatnonzero(np.r_[True, routes[1:] != routes[:-1]])
+    #string concatenation along every route, each action keeps a separator that is cut from the end of the path
+    steps = pd.Series(take_values(actions, rows)).astype(str).to_numpy(dtype=object) + route_path_separator
+    paths = np.add.reduceat(steps, starts) if len(steps) > 0 else steps
+    return pd.Series(paths, dtype=object).str[:-1].to_numpy()
+
+def route_paths_pl(df, representatives):
+    # same paths as route_paths_pd, representatives holds the user_id and route_id of one user per route
+    return (
+        df.filter(pl.col('action_order') > 0).select('user_id', 'action', 'action_order')
+        .join(representatives.select('user_id', 'route_id'), on='user_id', how='inner')
+        .group_by('route_id')
+        .agg(pl.col('action').sort_by('action_order').cast(pl.String).str.join(route_path_separator).alias('route_path'))
+    )
 
 def apply_filter_pd(df, first_actions_filter, goals):
     #filter based on first actions
     if first_actions_filter != []:
         df = df[df['first_action'].isin(first_actions_filter) ]
 
-    #decide how to show end point for user
-    df['action_next'] = df.apply( lambda row: 'End' if pd.isna(row['action_next']) and row['action'] in goals else 
-                                    ('Funnelius-Drop'+row['action'] if pd.isna(row['action_next']) else row['action_next']), axis=1)
-
-    #Calculate priority of route
-    df_user_route = df.sort_values(['user_id','action_order']).groupby('user_id')['action'].apply(lambda x: ' '.join(x)).reset_index(name='actions')
-    df_route_priority = df_user_route.groupby('actions').agg(user_count = ('user_id','count')).reset_index().sort_values(by=['user_count'], ascending = False)
-    df_route_priority['route_order'] = df_route_priority['user_count'].sort_values(ascending = False).rank(method='first', ascending=False).astype(int)
-    df_user_route = pd.merge(df_user_route, df_route_priority[['actions', 'route_order']], on = 'actions', how = 'left')[['user_id','route_order']]
-    df = pd.merge(df,df_user_route, on = 'user_id', how = 'left')
-    route_num = df_user_route['route_order'].max()
+    #work on a shallow copy so the dataframe returned by transform stays untouched
+    df = df.copy(deep=False)
+    df.index = pd.RangeIndex(len(df))
+
+    #decide how to show end point for user, is_drop flags rows whose next step is a drop
+    is_end = df['action_next'].isna().to_numpy()
+    is_drop = is_end & ~df['action'].isin(goals).to_numpy()
+    if isinstance(df['action_next'].dtype, pd.CategoricalDtype):
+        #compact events already hold End and drop labels in the action dictionary, only the codes change
+        labels = df['action_next'].cat.categories
+        codes = df['action_next'].cat.codes.to_numpy().copy()
+        codes[is_end] = labels.get_loc('End')
+        codes[is_drop] = labels.get_indexer('Funnelius-Drop' + labels)[df['action'].cat.codes.to_numpy()[is_drop]]
+        df['action_next'] = pd.Categorical.from_codes(codes, dtype=df['action_next'].dtype)
+    else:
+        action_next = df['action_next'].to_numpy(dtype=object, copy=True)
+        action_next[is_end] = 'End'
+        action_next[is_drop] = 'Funnelius-Drop' + df['action'].to_numpy(dtype=object)[is_drop]
+        df['action_next'] = action_next
+    df['is_drop'] = is_drop
+
+    #Calculate priority of route, routes are integer ids so counting users per route is an integer group-by
+    user_codes, user_routes = route_ids_pd(df)
+    route_codes, route_ids = pd.factorize(user_routes)
+    user_count = np.bincount(route_codes)
+    #most common route comes first, ties are ordered by the actions of the route
+    route_paths = route_paths_pd(user_codes, route_codes, df['action'], df['action_order'].to_numpy())
+    routes = pd.DataFrame({'users': user_count, 'route_path': route_paths})
+    route_rank = routes.sort_values(['users', 'route_path'], ascending=[False, True]).index.to_numpy()
+    route_order = np.empty(len(user_count), dtype='int64')
+    route_order[route_rank] = np.arange(1, len(user_count) + 1)
+    df['route_id'] = user_routes[user_codes]
+    df['route_order'] = route_order[route_codes][user_codes]
+    route_num = len(user_count)
     
     return df, route_num
 
@@ -225,80 +582,172 @@ def apply_filter_pl(df, first_actions_filter, goals):
         .when(pl.col('action_next').is_null())
         .then(pl.lit('Funnelius-Drop') + pl.col('action'))
         .otherwise(pl.col('action_next'))
-        .alias('action_next')
+        .alias('action_next'),
+        (pl.col('action_next').is_null() & ~pl.col('action').is_in(goals)).alias('is_drop')
     ])
 
-    #Calculate priority of route
+    #Calculate priority of route, every route is an integer id summed from hashed (action, action_order) steps
     df_user_route = (
-        df.sort(['user_id', 'action_order'])
-        .group_by('user_id')
-        .agg(pl.col('action').alias('actions'))
-        .with_columns([
-            pl.col('actions').list.join(' ').alias('actions')
-        ])
+        df.group_by('user_id')
+        .agg(pl.struct('action', 'action_order').hash(seed=0).sum().reinterpret(signed=True).alias('route_id'))
     )
 
-    # Count users per unique route
+    # Count users per unique route, most common route comes first and ties are ordered by the actions of the route
     df_route_priority = (
         df_user_route
-        .group_by('actions')
-        .agg(pl.count('user_id').alias('user_count'))
-        .sort('user_count', descending=True)
+        .group_by('route_id')
+        .agg(pl.len().alias('user_count'), pl.col('user_id').first())
+    )
+    df_route_priority = (
+        df_route_priority
+        .join(route_paths_pl(df, df_route_priority), on='route_id', how='left')
+        .sort(['user_count', 'route_path'], descending=[True, False])
         .with_columns([
-            pl.col('user_count').rank("ordinal", descending=True).alias('route_order')
+            pl.int_range(1, pl.len() + 1).alias('route_order')
         ])
     )
 
     # Join route priority back to users
-    df_user_route = df_user_route.join(df_route_priority.select(['actions', 'route_order']), on='actions', how='left').select(['user_id', 'route_order'])
+    df_user_route = df_user_route.join(df_route_priority.select(['route_id', 'route_order']), on='route_id', how='left')
 
-    # Merge route order back to main df
+    # Merge route id and order back to main df
     df = df.join(df_user_route, on='user_id', how='left')
 
-    # Get max route number
-    route_num = df_user_route['route_order'].max()
+    # Get max route number, for a lazy query it is unknown until it is collected
+    if isinstance(df, pl.LazyFrame):
+        route_num = None
+    else:
+        route_num = df_route_priority.height
 
     return df, route_num
 
+def apply_filter_duckdb(df, first_actions_filter, goals):
+    # routes are ranked with a window over route user counts, ties are ordered by the actions of the route like
+    # apply_filter_pd. the route number is not known before the query runs, like for a polars lazy query
+    first_actions = 'true' if first_actions_filter == [] else sql_in('first_action', first_actions_filter)
+    is_goal = sql_in('action', goals)
+    df = df.query('journeys', '''
+        WITH flagged AS (
+            SELECT * REPLACE (
+                CASE WHEN action_next IS NULL AND ''' + is_goal + ''' THEN 'End'
+                     WHEN action_next IS NULL THEN 'Funnelius-Drop' || action
+                     ELSE action_next END AS action_next
+            ), action_next IS NULL AND NOT ''' + is_goal + ''' AS is_drop
+            FROM journeys
+            WHERE ''' + first_actions + '''
+        ), user_routes AS (
+            --a route id is the wrapping sum of hashed (action, action_order) steps
+            SELECT user_id, CAST(CASE WHEN route_hash >= 9223372036854775808 THEN route_hash - 18446744073709551616 ELSE route_hash END AS BIGINT) AS route_id
+            FROM (SELECT user_id, sum(hash(action, action_order)) % 18446744073709551616 AS route_hash FROM flagged GROUP BY user_id)
+        ), route_counts AS (
+            SELECT route_id, count(*) AS users, any_value(user_id) AS representative
+            FROM user_routes GROUP BY route_id
+        ), route_paths AS (
+            --actions of one user per route joined like route_paths_pd
+            SELECT route_id, any_value(users) AS users, string_agg(CAST(action AS VARCHAR), chr(31) ORDER BY action_order) AS route_path
+            FROM route_counts JOIN flagged ON flagged.user_id = route_counts.representative AND flagged.action_order > 0
+            GROUP BY route_id
+        ), routes AS (
+            SELECT route_id, row_number() OVER (ORDER BY users DESC, route_path) AS route_order
+            FROM route_paths
+        )
+        SELECT flagged.*, route_id, route_order
+        FROM flagged JOIN user_routes USING (user_id) JOIN routes USING (route_id)
+    ''')
+    return df, None
+
 def apply_filter(df, first_actions_filter, goals):
-    #check if it is a polars dataframe
-    global df_backend
-    if df_backend == 'polars':
-        return apply_filter_pl(df, first_actions_filter, goals)
+    from funnelius.engine import default_engine
+    return default_engine.apply_filter(df, first_actions_filter, goals)
+
+def decode_routes_pd(df, route_ids):
+    #one representative user per route is enough to read its actions back
+    representatives = df[df['route_id'].isin(route_ids)].drop_duplicates('route_id')['user_id']
+    rows = df[df['user_id'].isin(representatives)].sort_values(['user_id', 'action_order'])
+    return rows.groupby('route_id')['action'].agg(list).to_dict()
+
+def decode_routes_pl(df, route_ids):
+    representatives = df.filter(pl.col('route_id').is_in(route_ids)).unique('route_id')['user_id']
+    rows = df.filter(pl.col('user_id').is_in(representatives.implode()))
+    routes = rows.group_by('route_id').agg(pl.col('action').sort_by('action_order'))
+    return dict(zip(routes['route_id'].to_list(), routes['action'].to_list()))
+
+def decode_routes(df, route_ids):
+    # returns {route_id: [actions]} for the given integer route ids of a dataframe returned by apply_filter
+    if np.isscalar(route_ids):
+        route_ids = [route_ids]
+    if frame_backend(df) == 'polars':
+        return decode_routes_pl(df, route_ids)
     else:
-        return apply_filter_pd(df, first_actions_filter, goals)
+        return decode_routes_pd(df, route_ids)
+
+
+#node duration columns that are read from a duration sketch, and their quantiles
+duration_quantiles = {'duration_median': 0.5, 'duration_p90': 0.9, 'duration_p99': 0.99}
 
+def duration_sketch_pd(df, keys, duration_accuracy):
+    #durations counted per logarithmic bucket, quantiles read from these counts are mergeable
+    durations = df[df['duration'].notna()]
+    buckets = pd.Series(bucket_index(durations['duration'].to_numpy(), duration_accuracy), index=durations.index, name='bucket')
+    return decode_categories(durations.groupby([durations[key] for key in keys] + [buckets], observed=True).size().reset_index(name='count'))
 
-def aggregate_pd(df, route_num, max_visible_answers):
+def duration_quantile_columns(actions, durations, duration_accuracy):
+    # duration quantiles of every action from (action, bucket, count) rows of a duration sketch
+    codes = pd.Index(actions).get_indexer(durations['action'])
+    durations = durations[codes >= 0]
+    codes = codes[codes >= 0]
+    columns = {}
+    for column, quantile in duration_quantiles.items():
+        columns[column] = grouped_quantiles(codes, durations['bucket'].to_numpy(), durations['count'].to_numpy(), len(actions), quantile, duration_accuracy)
+    return columns
+
+def aggregate_pd(df, route_num, max_visible_answers, duration_accuracy=0.01):
     # filter maximum routes
     df = df[df['route_order'] <= route_num]
 
-    #calculte nodes aggregated data///////////////////////////////////////////////////////////////////////////////
-    node_agg_data = df.groupby('action').agg(
-        duration_median = ('duration', 'median'),
+    #calculte nodes aggregated data, is_drop comes from apply_filter so every metric is a plain named aggregation
+    node_agg_data = decode_categories(df.groupby('action', observed=True).agg(
         duration_mean = ('duration', 'mean'),
         users = ('user_id', 'count'),
-        conversion_rate = ('user_id', lambda x: 1.0 - sum(df.loc[x.index, 'action_next'].str[:14] == 'Funnelius-Drop') / len(x)),
-    ).reset_index()   
+        drop_rate = ('is_drop', 'mean'),
+    ).reset_index())
+    node_agg_data['conversion_rate'] = 1.0 - node_agg_data.pop('drop_rate')
+    #duration quantiles come from a sketch with duration_accuracy relative error
+    quantile_columns = duration_quantile_columns(node_agg_data['action'], duration_sketch_pd(df, ['action'], duration_accuracy), duration_accuracy)
+    for position, (column, values) in enumerate(quantile_columns.items()):
+        node_agg_data.insert(1 + position, column, values)
+    node_agg_data['is_drop'] = False
 
     #some nodes only appear in action_next column but still we should draw them
     missing_end_points = df[~df['action_next'].isin(df['action'])]
-    missing_end_points = missing_end_points.groupby('action_next').agg(
-        users = ('user_id', 'count')
-    ).reset_index()  
+    missing_end_points = decode_categories(missing_end_points.groupby('action_next', observed=True).agg(
+        users = ('user_id', 'count'),
+        is_drop = ('is_drop', 'first')
+    ).reset_index())
     missing_end_points.rename(columns={'action_next':'action'}, inplace=True)
     
     node_agg_data = pd.concat([node_agg_data, missing_end_points])
     
 
     #calcualte total users
-    total_users = int(df[df['action'] == 'Start']['user_id'].count())
-    node_agg_data['percent_of_total'] =  node_agg_data.apply( lambda row: row['users']/total_users , axis=1)
+    total_users = int(df[df['action_order'] == 0]['user_id'].count())
+    node_agg_data['percent_of_total'] = node_agg_data['users'] / total_users
+    node_agg_data['is_drop'] = node_agg_data.pop('is_drop').astype(bool)
     #//////////////////////////////////////////////////////////////////////////////////////////////////////////
     
     #Calculate aggregated answer data ////////////////////////////////////////////////////////////////////////
-    answer_agg_data = df.groupby(['action','answer']).agg(answer_count = ('answer','count'))
-    answer_agg_data = answer_agg_data.reset_index()
+    answer_agg_data = df.groupby(['action','answer'], observed=True).agg(answer_count = ('answer','count'))
+    answer_agg_data = decode_categories(answer_agg_data.reset_index())
+    answer_agg_data = collapse_answers_pd(answer_agg_data, max_visible_answers)
+    #/////////////////////////////////////////////////////////////////////////////////////////////////////////
+
+    #calculate edges aggregated data 
+    edge_agg_data = df.groupby(['action', 'action_next'], observed=True).agg(edge_count=('user_id', 'count'), is_drop=('is_drop', 'first')).reset_index()
+
+    return node_agg_data, decode_categories(edge_agg_data), answer_agg_data
+
+def collapse_answers_pd(answer_agg_data, max_visible_answers):
+    # keeps the most common answers of every action, the rest are summed into 'Other items'
     answer_agg_data = answer_agg_data.sort_values(['action', 'answer_count'], ascending=[True, False])
     answer_agg_data['answer_order'] = answer_agg_data.groupby('action').cumcount() + 1
     answer_agg_data.loc[answer_agg_data['answer_order'] > max_visible_answers, 'answer'] = 'Other items'
@@ -309,49 +758,60 @@ def aggregate_pd(df, route_num, max_visible_answers):
     answer_agg_data = pd.merge(answer_agg_data,answer_total,on='action',how='left')
     answer_agg_data['answer_percent'] = answer_agg_data['answer_count']/answer_agg_data['total']
     answer_agg_data = answer_agg_data.drop('total', axis=1)
-    #/////////////////////////////////////////////////////////////////////////////////////////////////////////
-
-    #calculate edges aggregated data 
-    edge_agg_data = df.groupby(['action', 'action_next']).agg(edge_count=('user_id', 'count')).reset_index()
-
-    return node_agg_data, edge_agg_data, answer_agg_data
-
-def aggregate_pl(df, route_num, max_visible_answers):
-    # filter maximum routes
-    df = df.filter(pl.col('route_order') <= route_num)
+    return answer_agg_data
+
+def aggregate_pl(df, route_num, max_visible_answers, duration_accuracy=0.01):
+    #aggregation is one lazy query, an eager dataframe is collected at the end
+    is_lazy = isinstance(df, pl.LazyFrame)
+    df = df.lazy()
+
+    # filter maximum routes, None means all routes
+    if route_num is not None:
+        df = df.filter(pl.col('route_order') <= route_num)
+    #durations of last actions are NaN and Start rows carry 0, treat both as missing like pandas does
+    duration = pl.when(pl.col('action_order') > 0).then(pl.col('duration').fill_nan(None))
     #calculte nodes aggregated data///////////////////////////////////////////////////////////////////////////////
+    #duration quantiles come from a sketch with duration_accuracy relative error
+    duration_sketch = (
+        df.filter(duration.is_not_null())
+        .group_by(['action', bucket_index_pl(duration, duration_accuracy).alias('bucket')])
+        .agg(pl.len().alias('count'))
+        .sort(['action', 'bucket'])
+        .group_by('action', maintain_order=True)
+        .agg([sketch_quantile_pl(quantile, duration_accuracy).alias(column) for column, quantile in duration_quantiles.items()])
+    )
     node_agg_data = (
         df.group_by('action')
         .agg(
-            pl.median('duration').alias('duration_median'),
-            pl.mean('duration').alias('duration_mean'),
+            duration.mean().alias('duration_mean'),
             pl.count('user_id').alias('users'),
-            (
-                1.0 - (
-                    pl.col('action_next').str.starts_with('Funnelius-Drop').sum() 
-                    / pl.count('user_id')
-                )
-            ).alias('conversion_rate')
+            (1.0 - pl.col('is_drop').mean()).alias('conversion_rate'),
+            pl.lit(False).alias('is_drop')
         )
+        .join(duration_sketch, on='action', how='left')
+        .select('action', *duration_quantiles, 'duration_mean', 'users', 'conversion_rate', 'is_drop')
+        .with_columns(pl.col(*duration_quantiles, 'duration_mean').fill_null(np.nan))
     )
     #some nodes only appear in action_next column but still we should draw them
     missing_end_points = df.filter(~pl.col('action_next').is_in(pl.col('action').implode()))
 
     missing_end_points = missing_end_points.group_by('action_next').agg(
-        pl.lit(np.nan).alias('duration_median'),
+        *[pl.lit(np.nan).alias(column) for column in duration_quantiles],
         pl.lit(np.nan).alias('duration_mean'),
         pl.count('user_id').alias('users'),
         pl.lit(np.nan).alias('conversion_rate'),
+        pl.col('is_drop').first().alias('is_drop')
     )
     missing_end_points = missing_end_points.rename({'action_next': 'action'})
 
     node_agg_data = pl.concat([node_agg_data, missing_end_points])
 
-    #calcualte total users
-    total_users = df.filter(pl.col("action") == "Start").select(pl.count("user_id")).item()
+    #calcualte total users, every user has one Start row so the Start node holds the total
+    total_users = pl.col('users').filter(pl.col('action') == 'Start').first()
     node_agg_data = node_agg_data.with_columns(
         (pl.col("users") / total_users).alias("percent_of_total")
     )
+    node_agg_data = node_agg_data.select(pl.exclude('is_drop'), pl.col('is_drop'))
     #//////////////////////////////////////////////////////////////////////////////////////////////////////////
     #Calculate aggregated answer data ////////////////////////////////////////////////////////////////////////
     # Step 1: Group by ['action', 'answer'] and count
@@ -359,9 +819,23 @@ def aggregate_pl(df, route_num, max_visible_answers):
         df.group_by(['action', 'answer'])
         .agg(pl.count('answer').alias('answer_count'))
     )
+    answer_agg_data = collapse_answers_pl(answer_agg_data, max_visible_answers)
+    #/////////////////////////////////////////////////////////////////////////////////////////////////////////
+
+    #calculate edges aggregated data 
+    edge_agg_data = (
+        df.group_by(['action', 'action_next'])
+        .agg(pl.count('user_id').alias('edge_count'), pl.col('is_drop').first().alias('is_drop'))
+    )
 
+    if not is_lazy:
+        node_agg_data, edge_agg_data, answer_agg_data = collect_frames(node_agg_data, edge_agg_data, answer_agg_data)
+    return node_agg_data, edge_agg_data, answer_agg_data
+
+def collapse_answers_pl(answer_agg_data, max_visible_answers):
+    # keeps the most common answers of every action, the rest are summed into 'Other items'
     # Step 2: Sort by 'action' and descending 'answer_count'
-    answer_agg_data = answer_agg_data.sort(['action', 'answer_count'], descending=[False, True])
+    answer_agg_data = answer_agg_data.sort(['action', 'answer_count', 'answer'], descending=[False, True, False])
 
     # Step 3: Assign answer_order within each 'action'
     answer_agg_data = answer_agg_data.with_columns(
@@ -402,31 +876,346 @@ def aggregate_pl(df, route_num, max_visible_answers):
 
     # Step 10: Drop 'total' column
     answer_agg_data = answer_agg_data.drop('total')
-    #/////////////////////////////////////////////////////////////////////////////////////////////////////////
+    return answer_agg_data
+
+def aggregate_duckdb(df, route_num, max_visible_answers, duration_accuracy=0.01):
+    # node, edge, answer and duration sketch counts come from one grouping sets query, so the transform and route
+    # ranking run once. the small grouped tables are finished with pandas, the results are pandas dataframes
+    if route_num is not None:
+        df = df.filter('route_order <= ' + str(int(route_num)))
+    bucket = bucket_index_sql('duration', duration_accuracy)
+    groups = df.query('routes', '''
+        SELECT GROUPING(action_next, answer, bucket) AS grouping_set, action, action_next, answer, bucket,
+            count(user_id) AS users,
+            sum(CAST(is_drop AS INTEGER)) AS drops,
+            sum(duration) AS duration_sum,
+            count(duration) AS duration_count,
+            count(answer) AS answer_count,
+            bool_or(is_drop) AS is_drop
+        FROM (SELECT *, ''' + bucket + ''' AS bucket FROM routes)
+        GROUP BY GROUPING SETS ((action), (action, bucket), (action, action_next), (action, answer))
+    ''').df()
+    #grouping bits are action_next, answer, bucket from high to low, a set clears the bits of its own keys
+    nodes = groups[groups['grouping_set'] == 7].sort_values('action').reset_index(drop=True)
+    durations = groups[(groups['grouping_set'] == 6) & (groups['duration_count'] > 0)].rename(columns={'duration_count': 'count'})
+    edge_agg_data = groups[groups['grouping_set'] == 3][['action', 'action_next', 'users', 'is_drop']].rename(columns={'users': 'edge_count'})
+    edge_agg_data = edge_agg_data.sort_values(['action', 'action_next']).reset_index(drop=True)
+    answer_agg_data = groups[(groups['grouping_set'] == 5) & (groups['answer_count'] > 0)][['action', 'answer', 'answer_count']]
+    #numeric answer columns come back as nullable integers, they take the 'Other items' label like object columns
+    answer_agg_data = answer_agg_data.astype({'answer': object}).sort_values(['action', 'answer'])
+
+    #calculte nodes aggregated data
+    quantile_columns = duration_quantile_columns(nodes['action'], durations, duration_accuracy)
+    node_agg_data = pd.DataFrame({
+        'action': nodes['action'].to_numpy(),
+        **quantile_columns,
+        'duration_mean': (nodes['duration_sum'] / nodes['duration_count'].where(nodes['duration_count'] > 0)).to_numpy(),
+        'users': nodes['users'].to_numpy(),
+        'conversion_rate': (1.0 - nodes['drops'] / nodes['users']).to_numpy(),
+        'is_drop': False,
+    })
 
-    #calculate edges aggregated data 
-    edge_agg_data = (
-        df.group_by(['action', 'action_next'])
-        .agg(pl.count('user_id').alias('edge_count'))
-    )
+    #some nodes only appear in action_next column but still we should draw them
+    missing_end_points = edge_agg_data[~edge_agg_data['action_next'].isin(node_agg_data['action'])]
+    missing_end_points = missing_end_points.groupby('action_next').agg(users=('edge_count', 'sum'), is_drop=('is_drop', 'first')).reset_index()
+    missing_end_points.rename(columns={'action_next':'action'}, inplace=True)
+    node_agg_data = pd.concat([node_agg_data, missing_end_points], ignore_index=True)
+
+    #calcualte total users, every user has one Start row
+    total_users = node_agg_data.loc[node_agg_data['action'] == 'Start', 'users'].sum()
+    node_agg_data['percent_of_total'] = node_agg_data['users'] / total_users
+    node_agg_data['is_drop'] = node_agg_data.pop('is_drop').astype(bool)
 
+    answer_agg_data = collapse_answers_pd(answer_agg_data.reset_index(drop=True), max_visible_answers)
     return node_agg_data, edge_agg_data, answer_agg_data
 
-def aggregate(df, route_num, max_visible_answers):
-    #check if it is a polars dataframe
-    global df_backend
-    if df_backend == 'polars':
-        return aggregate_pl(df, route_num, max_visible_answers)
+def aggregate_sharded(df, route_num, max_visible_answers, duration_accuracy, parallel):
+    # aggregate over user id hash shards in parallel processes, workers return route partials that are summed here
+    with tempfile.TemporaryDirectory() as shard_directory:
+        shard_paths = spill_partitions(df, parallel, shard_directory)
+        partials_list = map_shards(shard_route_partials, shard_paths, parallel, frame_backend(df), duration_accuracy)
+    route_index = index_routes(merge_route_partials(partials_list), frame_backend(df), duration_accuracy)
+    if route_num is None:
+        route_num = route_index['route_num']
+    return aggregate_route_index(route_index, route_num, max_visible_answers)
+
+def shard_route_partials(path, backend, duration_accuracy):
+    # route partials of one shard of a filtered dataframe, runs in a worker process
+    return route_partials(read_shard(path, backend), duration_accuracy)
+
+def aggregate(df, route_num, max_visible_answers, duration_accuracy=0.01, parallel=1):
+    from funnelius.engine import default_engine
+    return default_engine.aggregate(df, route_num, max_visible_answers, duration_accuracy, parallel)
+
+def route_partials_pd(df, duration_accuracy=0.01, segment_keys=[]):
+    #partial aggregates of every route. users, drops, durations, edges and answers are all sums over routes
+    keys = segment_keys + ['route_id']
+    routes = df[df['action_order'] == 0].groupby(keys).agg(users=('user_id', 'count'), route_order=('route_order', 'first')).reset_index()
+    #paths of routes, indexed by the route codes of their users
+    user_codes, users = pd.factorize(df['user_id'])
+    route_codes, route_ids = pd.factorize(df['route_id'])
+    user_routes = np.empty(len(users), dtype='int64')
+    user_routes[user_codes] = route_codes
+    route_paths = pd.Series(route_paths_pd(user_codes, user_routes, df['action'], df['action_order'].to_numpy()), index=route_ids)
+    routes['route_path'] = route_paths.reindex(routes['route_id'].to_numpy()).to_numpy()
+    nodes = df.groupby(keys + ['action'], observed=True).agg(
+        users = ('user_id', 'count'),
+        drops = ('is_drop', 'sum'),
+        duration_sum = ('duration', 'sum'),
+        duration_count = ('duration', 'count'),
+    ).reset_index()
+    #quantiles are not additive, duration sketch bucket counts are
+    durations = duration_sketch_pd(df, keys + ['action'], duration_accuracy)
+    edges = df.groupby(keys + ['action', 'action_next'], observed=True).agg(edge_count=('user_id', 'count'), is_drop=('is_drop', 'first')).reset_index()
+    answers = df.groupby(keys + ['action', 'answer'], observed=True).agg(answer_count=('answer', 'count')).reset_index()
+    return {'routes': routes, 'nodes': decode_categories(nodes), 'durations': durations, 'edges': decode_categories(edges), 'answers': decode_categories(answers)}
+
+def polars_to_pandas(df):
+    # small aggregate tables are moved between backends column by column, this does not need pyarrow
+    return pd.DataFrame({column: df[column].to_numpy() for column in df.columns})
+
+def pandas_to_polars(df):
+    #polars only takes ms, us and ns datetimes from numpy, and nulls of object columns as None
+    columns = {column: df[column].to_numpy() for column in df.columns}
+    for column, values in columns.items():
+        if values.dtype.kind == 'M':
+            columns[column] = values.astype('datetime64[ns]')
+        elif values.dtype.kind == 'O':
+            columns[column] = np.where(pd.isna(values), None, values)
+    return pl.DataFrame(columns)
+
+def route_partials_pl(df, duration_accuracy=0.01, segment_keys=[]):
+    df = df.lazy()
+    keys = segment_keys + ['route_id']
+    #durations of last actions are NaN and Start rows carry 0, treat both as missing like aggregate_pl does
+    duration = pl.when(pl.col('action_order') > 0).then(pl.col('duration').fill_nan(None))
+    routes = df.filter(pl.col('action_order') == 0).group_by(keys).agg(
+        pl.count('user_id').alias('users'),
+        pl.col('route_order').first().alias('route_order')
+    )
+    representatives = df.filter(pl.col('action_order') == 0).group_by('route_id').agg(pl.col('user_id').first())
+    routes = routes.join(route_paths_pl(df, representatives), on='route_id', how='left')
+    nodes = df.group_by(keys + ['action']).agg(
+        pl.count('user_id').alias('users'),
+        pl.col('is_drop').sum().alias('drops'),
+        duration.sum().alias('duration_sum'),
+        duration.count().alias('duration_count')
+    )
+    durations = (
+        df.filter(duration.is_not_null())
+        .group_by(keys + ['action', bucket_index_pl(duration, duration_accuracy).alias('bucket')])
+        .agg(pl.len().alias('count'))
+    )
+    edges = df.group_by(keys + ['action', 'action_next']).agg(pl.count('user_id').alias('edge_count'), pl.col('is_drop').first().alias('is_drop'))
+    answers = df.group_by(keys + ['action', 'answer']).agg(pl.count('answer').alias('answer_count'))
+    partials = collect_frames(routes, nodes, durations, edges, answers)
+    return dict(zip(['routes', 'nodes', 'durations', 'edges', 'answers'], [polars_to_pandas(partial) for partial in partials]))
+
+def route_partials(df, duration_accuracy=0.01, segment_keys=[]):
+    # per route partial aggregates of a dataframe returned by apply_filter, as pandas tables for both backends.
+    # segment_keys are grouped by too, so one pass gives the partials of every segment
+    if frame_backend(df) == 'polars':
+        return route_partials_pl(df, duration_accuracy, segment_keys)
     else:
-        return aggregate_pd(df, route_num, max_visible_answers)
+        return route_partials_pd(df, duration_accuracy, segment_keys)
+
+def merge_route_partials(partials_list):
+    # sums route partials of disjoint sets of users, route ids are content hashes so they match across the sets
+    tables = [
+        ('routes', ['route_id'], {'users': 'sum', 'route_path': 'first'}),
+        ('nodes', ['route_id', 'action'], {'users': 'sum', 'drops': 'sum', 'duration_sum': 'sum', 'duration_count': 'sum'}),
+        ('durations', ['route_id', 'action', 'bucket'], {'count': 'sum'}),
+        ('edges', ['route_id', 'action', 'action_next'], {'edge_count': 'sum', 'is_drop': 'first'}),
+        ('answers', ['route_id', 'action', 'answer'], {'answer_count': 'sum'}),
+    ]
+    #route orders of shards of one filtered dataframe are global and kept, partitions rank their routes after merging
+    if all('route_order' in partials['routes'].columns for partials in partials_list):
+        tables[0] = ('routes', ['route_id'], {'users': 'sum', 'route_path': 'first', 'route_order': 'first'})
+    merged = {}
+    for name, keys, columns in tables:
+        table = pd.concat([partials[name] for partials in partials_list], ignore_index=True)
+        merged[name] = table.groupby(keys, sort=False, dropna=False).agg(columns).reset_index()
+    return merged
+
+def index_routes(partials, backend, duration_accuracy=0.01):
+    # orders routes by users and turns per route partial aggregates into cumulative sums along that order
+    routes = partials['routes']
+    if 'route_order' not in routes.columns:
+        #most common route comes first, ties are ordered by the actions of the route like apply_filter does
+        routes = routes.sort_values(['users', 'route_path'], ascending=[False, True])
+        routes['route_order'] = np.arange(1, len(routes) + 1)
+    routes = routes.sort_values('route_order').reset_index(drop=True)
+    route_order = pd.Series(routes['route_order'].to_numpy(), index=routes['route_id'].to_numpy())
+
+    index = {'backend': backend, 'route_num': len(routes), 'routes': routes, 'duration_accuracy': duration_accuracy}
+    tables = [
+        ('nodes', ['action'], ['users', 'drops', 'duration_sum', 'duration_count']),
+        ('durations', ['action', 'bucket'], ['count']),
+        ('edges', ['action', 'action_next'], ['edge_count']),
+        ('answers', ['action', 'answer'], ['answer_count']),
+    ]
+    for name, keys, columns in tables:
+        table = partials[name].copy()
+        table['route_order'] = route_order.reindex(table['route_id'].to_numpy()).to_numpy()
+        table = table.sort_values(keys + ['route_order']).reset_index(drop=True)
+        table['key'] = table.groupby(keys, sort=False, dropna=False).ngroup()
+        table[columns] = table.groupby('key')[columns].cumsum()
+        index[name] = table
+    return index
+
+def prefix_rows(table, route_num, stride):
+    # for every key, the row holding cumulative sums up to route_num. rows are sorted by (key, route_order)
+    keys = table['key'].to_numpy()
+    num_keys = int(keys[-1]) + 1 if len(keys) > 0 else 0
+    combined = keys * stride + table['route_order'].to_numpy()
+    positions = np.searchsorted(combined, np.arange(num_keys) * stride + route_num, side='right') - 1
+    valid = positions >= 0
+    valid[valid] = keys[positions[valid]] == np.arange(num_keys)[valid]
+    return table.iloc[positions[valid]]
+
+def aggregate_route_index(route_index, route_num, max_visible_answers):
+    from funnelius.engine import default_engine
+    return default_engine.aggregate_route_index(route_index, route_num, max_visible_answers)
+
+def build_route_index(df, duration_accuracy=0.01):
+    from funnelius.engine import default_engine
+    return default_engine.build_route_index(df, duration_accuracy)
+
+def spill_partitions(df, partitions, directory):
+    # writes events into user id hash partitions on disk with a streaming sink, a user's whole journey lands in one partition
+    if isinstance(df, (str, os.PathLike)):
+        df = scan_events(df)
+    elif isinstance(df, pd.DataFrame):
+        df = pandas_to_polars(df)
+    df = df.lazy().with_columns((pl.col('user_id').hash(seed=0) % partitions).alias('__partition'))
+    df.sink_ipc(pl.PartitionBy(directory, key='__partition', include_key=False), mkdir=True)
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory))
+
+def read_shard(path, backend):
+    # reads the Arrow IPC files of one partition, polars memory maps uncompressed IPC files instead of copying them
+    shard = pl.scan_ipc(os.path.join(path, '*.ipc')).collect()
+    if backend == 'pandas':
+        shard = polars_to_pandas(shard)
+    return shard
+
+def map_shards(function, shard_paths, parallel, *args):
+    # runs function(shard_path, *args) for every shard, in a pool of worker processes when parallel > 1.
+    # workers get a path and read the shard themselves, only small partial results are pickled back
+    if parallel <= 1:
+        return [function(path, *args) for path in shard_paths]
+    #polars runs its own threads, forking a process that uses them can deadlock. spawned workers import the caller's
+    #main module again, so scripts using parallel need an if __name__ == '__main__' guard
+    with ProcessPoolExecutor(parallel, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return list(pool.map(function, shard_paths, *[itertools.repeat(arg) for arg in args]))
+
+def partition_route_partials(path, first_actions_filter, goals, backend, duration_accuracy):
+    # route partials of one partition of raw events, runs in a worker process when parallel > 1
+    partition = pl.scan_ipc(os.path.join(path, '*.ipc'))
+    partition = prefilter_first_actions_pl(partition, first_actions_filter).collect()
+    if partition.height == 0:
+        return None
+    if backend == 'pandas':
+        partition = polars_to_pandas(partition)
+    data, __v1, __v2 = transform(partition)
+    del partition
+    data, __v1 = apply_filter(data, first_actions_filter, goals)
+    partials = route_partials(data, duration_accuracy)
+    #route orders of a partition are local, routes are ranked again after merging
+    partials['routes'] = partials['routes'].drop(columns='route_order')
+    return partials
+
+def partitioned_route_index(df, first_actions_filter, goals, partitions, backend='polars', directory=None, duration_accuracy=0.01, parallel=1):
+    # out-of-core route index for event files larger than memory, only one partition per worker is in memory at a time.
+    # partitions are transformed and filtered on their own and their route partials are summed.
+    with tempfile.TemporaryDirectory(dir=directory) as spill_directory:
+        partition_paths = spill_partitions(df, partitions, spill_directory)
+        partials_list = map_shards(partition_route_partials, partition_paths, parallel, first_actions_filter, goals, backend, duration_accuracy)
+    partials_list = [partials for partials in partials_list if partials is not None]
+    return index_routes(merge_route_partials(partials_list), backend, duration_accuracy)
+
+def transform_shard(path, backend):
+    # transforms one shard of raw events in a worker process, the result is written next to the shard as Arrow IPC
+    data, first_actions, all_actions = transform(read_shard(path, backend))
+    if backend == 'pandas':
+        data = pandas_to_polars(data)
+    data.write_ipc(path + '.ipc')
+    return first_actions, all_actions
+
+def transform_sharded(df, parallel):
+    # transform over user id hash shards in parallel processes, journeys never cross shards
+    backend = 'pandas' if isinstance(df, pd.DataFrame) else 'polars'
+    with tempfile.TemporaryDirectory() as shard_directory:
+        shard_paths = spill_partitions(df, parallel, shard_directory)
+        actions = map_shards(transform_shard, shard_paths, parallel, backend)
+        data = pl.concat([pl.read_ipc(path + '.ipc') for path in shard_paths], how='vertical_relaxed')
+    if backend == 'pandas':
+        data = polars_to_pandas(data)
+    first_actions = list(dict.fromkeys(itertools.chain.from_iterable(first for first, __v1 in actions)))
+    all_actions = list(dict.fromkeys(itertools.chain.from_iterable(every for __v1, every in actions)))
+    return data, first_actions, all_actions
 
-def draw_nodes_pd(node_data, answer_data, has_comparison_data, dot, metrics, goals, show_answer, conditional_format_metric, conditional_format_gradient, max_metric, min_metric, show_drop):
-    for index, node in node_data.iterrows():
-        draw_single_node(node, node_data, answer_data, has_comparison_data, dot, metrics, goals, show_answer, conditional_format_metric, conditional_format_gradient, max_metric, min_metric, show_drop)
+def render_model_pd(node_data, answer_data):
+    return node_data.to_dict('records'), answer_data.to_dict('records')
+
+def render_model_pl(node_data, answer_data):
+    return node_data.to_dicts(), answer_data.to_dicts()
+
+def node_colors(values, excluded, conditional_format_gradient):
+    # fill color of every node, values are interpolated along the 3 point gradient between min and max of not excluded nodes
+    values = np.asarray(values, dtype=float)
+    included = values[~excluded]
+    included = included[~np.isnan(included)]
+    color_distance = np.zeros(len(values))
+    if len(included) > 0 and included.max() != included.min():
+        color_distance = (values - included.min()) / (included.max() - included.min())
+        color_distance[np.isnan(color_distance)] = 0
+
+    rgb_list = np.array(hex_to_rgb(conditional_format_gradient), dtype=float)
+    lower_half = (color_distance < 0.5)[:, None]
+    rgb = np.where(lower_half,
+                   rgb_list[0] + (rgb_list[1] - rgb_list[0]) * color_distance[:, None] / 0.5,
+                   rgb_list[1] + (rgb_list[2] - rgb_list[1]) * (color_distance[:, None] - 0.5) / 0.5)
+    return ['#%02x%02x%02x' % tuple(color) for color in rgb.astype(int)]
+
+def drop_flags_pd(node_data, edge_data):
+    if 'is_drop' not in node_data.columns:
+        node_data = node_data.assign(is_drop=node_data['action'].astype(str).str.startswith('Funnelius-Drop'))
+    if 'is_drop' not in edge_data.columns:
+        edge_data = edge_data.assign(is_drop=edge_data['action_next'].astype(str).str.startswith('Funnelius-Drop'))
+    return node_data, edge_data
+
+def drop_flags_pl(node_data, edge_data):
+    if 'is_drop' not in node_data.columns:
+        node_data = node_data.with_columns(pl.col('action').cast(pl.String).str.starts_with('Funnelius-Drop').alias('is_drop'))
+    if 'is_drop' not in edge_data.columns:
+        edge_data = edge_data.with_columns(pl.col('action_next').cast(pl.String).str.starts_with('Funnelius-Drop').alias('is_drop'))
+    return node_data, edge_data
+
+def drop_flags(node_data, edge_data):
+    # node and edge data built without an is_drop column, by hand or by earlier versions, get it from the drop node names
+    if frame_backend(node_data) == 'polars':
+        return drop_flags_pl(node_data, edge_data)
+    else:
+        return drop_flags_pd(node_data, edge_data)
+
+def render_model(node_data, answer_data, conditional_format_metric, conditional_format_gradient, excluded_actions):
+    # rows and lookup indexes draw_single_node reads, built once instead of filtering dataframes for every node
+    if frame_backend(node_data) == 'polars':
+        nodes, answers = render_model_pl(node_data, answer_data)
+    else:
+        nodes, answers = render_model_pd(node_data, answer_data)
 
-def draw_nodes_pl(node_data, answer_data, has_comparison_data, dot, metrics, goals, show_answer, conditional_format_metric, conditional_format_gradient, max_metric, min_metric, show_drop):
-    for node in node_data.iter_rows(named=True):
-        draw_single_node(node, node_data, answer_data, has_comparison_data, dot, metrics, goals, show_answer, conditional_format_metric, conditional_format_gradient, max_metric, min_metric, show_drop)
+    users = {}
+    for node in nodes:
+        users.setdefault(node['action'], node['users'])
+    action_answers = {}
+    for answer in answers:
+        action_answers.setdefault(answer['action'], []).append(answer)
+
+    metric_values = [np.nan if node[conditional_format_metric] is None else node[conditional_format_metric] for node in nodes]
+    excluded = np.array([node['action'] in excluded_actions for node in nodes], dtype=bool)
+    colors = node_colors(metric_values, excluded, conditional_format_gradient)
+    return {'nodes': nodes, 'users': users, 'answers': action_answers, 'colors': colors}
 
 def generate_answer_label(answer, has_comparison_data):
         label_answer_percent = format(answer['answer_percent'], '.0%')
@@ -447,49 +1236,34 @@ def generate_answer_label(answer, has_comparison_data):
 
 def generate_answers_text(action_answers, has_comparison_data):
     label = ''
-    global df_backend
-    if df_backend == 'pandas':
-        for index,answer in action_answers.iterrows():
-            label += generate_answer_label(answer, has_comparison_data) 
-    else:
-        for answer in action_answers.iter_rows(named=True):
-            label += generate_answer_label(answer, has_comparison_data) 
+    for answer in action_answers:
+        label += generate_answer_label(answer, has_comparison_data) 
     return label
 
-def conditional_metric_min_max(node_data, conditional_format_metric, excluded_actions):
-    global df_backend
-    if df_backend == 'pandas':
-        max_metric = node_data.query('action not in @excluded_actions')[conditional_format_metric].max()
-        min_metric = node_data.query('action not in @excluded_actions')[conditional_format_metric].min()
-    else:
-        max_metric = node_data.filter(~pl.col("action").is_in(excluded_actions))[conditional_format_metric].max()
-        min_metric = node_data.filter(~pl.col("action").is_in(excluded_actions))[conditional_format_metric].min()
-    return max_metric, min_metric
-
 def draw_nodes(node_data, answer_data, has_comparison_data, dot, metrics, goals, show_answer, conditional_format_metric, conditional_format_gradient, excluded_actions, show_drop):
     conditional_format_metric = conditional_format_metric.replace('-','_')
-    max_metric,min_metric = conditional_metric_min_max(node_data, conditional_format_metric, excluded_actions)
-    
-    #check if it is a polars dataframe
-    global df_backend
-    if df_backend == 'polars':
-        draw_nodes_pl(node_data, answer_data, has_comparison_data, dot, metrics, goals, show_answer, conditional_format_metric, conditional_format_gradient, max_metric, min_metric, show_drop)
-    else:
-        draw_nodes_pd(node_data, answer_data, has_comparison_data, dot, metrics, goals, show_answer, conditional_format_metric, conditional_format_gradient, max_metric, min_metric, show_drop)   
-
-def draw_single_node(node, node_data, answer_data, has_comparison_data, dot, metrics, goals, show_answer, conditional_format_metric, conditional_format_gradient, max_metric, min_metric, show_drop):
-    global df_backend
-
+    # draws every node and returns {action: label} of the drawn nodes
+    model = render_model(node_data, answer_data, conditional_format_metric, conditional_format_gradient, excluded_actions)
+    labels = {}
+    for node, color in zip(model['nodes'], model['colors']):
+        label = draw_single_node(node, model, color, has_comparison_data, dot, metrics, goals, show_answer, show_drop)
+        if label is not None:
+            labels[str(node['action'])] = label
+    return labels
+
+def draw_single_node(node, model, conditional_color, has_comparison_data, dot, metrics, goals, show_answer, show_drop):
     #prepare label variables
     label_users = str(node['users'])
     label_percent_of_total = format_metric(node['percent_of_total'], '.0%')
     label_conversion_rate = format_metric(node['conversion_rate'], '.0%')
     label_duration_median = format_metric(node['duration_median'], '.1f')
+    label_duration_p90 = format_metric(node['duration_p90'], '.1f')
+    label_duration_p99 = format_metric(node['duration_p99'], '.1f')
     label_duration_mean = format_metric(node['duration_mean'], '.1f')
 
     if has_comparison_data == 1:
         change_vars = {}
-        change_metrics = ['users','conversion_rate','duration_median','duration_mean','percent_of_total']
+        change_metrics = ['users','conversion_rate','duration_median','duration_p90','duration_p99','duration_mean','percent_of_total']
         for metric in change_metrics:
             change_vars['label_'+metric+'_change'] = format_change_percent(node[metric+'_change'])
             #set label colors
@@ -505,24 +1279,26 @@ def draw_single_node(node, node_data, answer_data, has_comparison_data, dot, met
         shape = 'circle'
         label = node['action']
 
-    elif node['action'][:14] == 'Funnelius-Drop':
+    elif node['is_drop']:
         color = '#ffc8c8'
         shape = 'cds'
-        if df_backend == 'pandas':
-            action_previous_users = node_data[node_data['action'] == node['action'].replace('Funnelius-Drop','')]['users'].iloc[0]
-        else:
-            action_previous_users = node_data.filter(pl.col("action") == node["action"].replace("Funnelius-Drop", "")).select("users").to_series()[0]
-        label = format(node['users']/action_previous_users, '.0%')+' ('+label_users+')'
+        action_previous_users = model['users'][node['action'].replace('Funnelius-Drop','')]
+        #nodes only found in comparison datasets have no users to drop from
+        drop_rate = node['users']/action_previous_users if action_previous_users > 0 else np.nan
+        label = format_metric(drop_rate, '.0%')+' ('+label_users+')'
 
     else:
         shape = 'box'
-        color = "#fff"
+        #conditional format color comes precomputed from the render model
+        color = conditional_color
         if has_comparison_data == 1:
             colspan = '3'
             users_change_code = '<TD><B><FONT COLOR="'+change_vars['color_users_change']+'">(' + change_vars['label_users_change'] +')</FONT></B></TD>'
             conversion_rate_change_code = '<TD><B><FONT COLOR="'+change_vars['color_conversion_rate_change']+'">('+ change_vars['label_conversion_rate_change']+')</FONT></B></TD>'
             percent_of_total_change_code = '<TD><B><FONT COLOR="'+change_vars['color_percent_of_total_change']+'">('+ change_vars['label_percent_of_total_change']+')</FONT></B></TD>'
             duration_median_change_code = '<TD><B><FONT COLOR="'+change_vars['color_duration_median_change']+'">('+ change_vars['label_duration_median_change']+')</FONT></B></TD>'
+            duration_p90_change_code = '<TD><B><FONT COLOR="'+change_vars['color_duration_p90_change']+'">('+ change_vars['label_duration_p90_change']+')</FONT></B></TD>'
+            duration_p99_change_code = '<TD><B><FONT COLOR="'+change_vars['color_duration_p99_change']+'">('+ change_vars['label_duration_p99_change']+')</FONT></B></TD>'
             duration_mean_change_code = '<TD><B><FONT COLOR="'+change_vars['color_duration_mean_change']+'">('+ change_vars['label_duration_mean_change']+')</FONT></B></TD>'
         else:
             colspan = '2'
@@ -530,6 +1306,8 @@ def draw_single_node(node, node_data, answer_data, has_comparison_data, dot, met
             conversion_rate_change_code = ''
             percent_of_total_change_code = ''
             duration_median_change_code = ''
+            duration_p90_change_code = ''
+            duration_p99_change_code = ''
             duration_mean_change_code = ''
 
         label = '<<TABLE BORDER="0" CELLBORDER="0" CELLPADDING="1" CELLSPACing="0" BGCOLOR="transparent" STYLE="rounded">'
@@ -545,16 +1323,16 @@ def draw_single_node(node, node_data, answer_data, has_comparison_data, dot, met
                 label += '<TR><TD ALIGN="LEFT">Conversion:</TD><TD>' + label_conversion_rate + '</TD>' + conversion_rate_change_code + '</TR>'
             if 'duration-median' in metrics:
                 label += '<TR><TD ALIGN="LEFT">Duration Median (sec):</TD><TD>' + label_duration_median + '</TD>' + duration_median_change_code +'</TR>'
+            if 'duration-p90' in metrics:
+                label += '<TR><TD ALIGN="LEFT">Duration P90 (sec):</TD><TD>' + label_duration_p90 + '</TD>' + duration_p90_change_code +'</TR>'
+            if 'duration-p99' in metrics:
+                label += '<TR><TD ALIGN="LEFT">Duration P99 (sec):</TD><TD>' + label_duration_p99 + '</TD>' + duration_p99_change_code +'</TR>'
             if 'duration-mean' in metrics:
                 label += '<TR><TD ALIGN="LEFT">Duration Mean (sec):</TD><TD>' + label_duration_mean + '</TD>' + duration_mean_change_code +'</TR>'
         #add answers//////////////////////////////////////////////////////////////////////////////////////////////////////////////////
         if show_answer == True:
             if not node['action'] in goals:
-                if df_backend == 'pandas':
-                    action_answers = answer_data[answer_data['action'] == node['action']]
-                else:
-                    action_answers = answer_data.filter(pl.col('action') == node['action'])
-                    
+                action_answers = model['answers'].get(node['action'], [])
                 if len(action_answers) > 0:
                     label += '<TR><TD COLSPAN="' + colspan + '" ALIGN="CENTER"><B>Answers</B></TD></TR>'
                     label += '<TR><TD COLSPAN="' + colspan + '" ALIGN="CENTER" BGCOLOR="#aaa"></TD></TR>'
@@ -564,34 +1342,14 @@ def draw_single_node(node, node_data, answer_data, has_comparison_data, dot, met
         
         label += '</TABLE>>'
 
-        #calculate conditional format colors //////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////
-        
-        if max_metric == min_metric or np.isnan(node[conditional_format_metric]):
-            color_distance = 0
-        else:
-            color_distance = (node[conditional_format_metric]- min_metric)/(max_metric- min_metric)
-
-        rgb_list = hex_to_rgb(conditional_format_gradient)
-        
-        if color_distance < 0.5:
-            color_red_part   = rgb_list[0][0] + (rgb_list[1][0]-rgb_list[0][0])*color_distance/0.5
-            color_green_part = rgb_list[0][1] + (rgb_list[1][1]-rgb_list[0][1])*color_distance/0.5
-            color_blue_part  = rgb_list[0][2] + (rgb_list[1][2]-rgb_list[0][2])*color_distance/0.5
-        else:
-            color_red_part   = rgb_list[1][0] + (rgb_list[2][0]-rgb_list[1][0])*(color_distance-0.5)/0.5
-            color_green_part = rgb_list[1][1] + (rgb_list[2][1]-rgb_list[1][1])*(color_distance-0.5)/0.5
-            color_blue_part  = rgb_list[1][2] + (rgb_list[2][2]-rgb_list[1][2])*(color_distance-0.5)/0.5                 
-        color = '#%02x%02x%02x' % ( int(color_red_part), int(color_green_part), int(color_blue_part) )
-        #/////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////////
-    
-    
-    if (node['action'][:14] == 'Funnelius-Drop' and show_drop) or node['action'][:14] != 'Funnelius-Drop':    
+    if show_drop or not node['is_drop']:
         dot.node(node['action'], shape = shape, label = label, style = 'filled, rounded', fillcolor=color,\
         href='', penwidth ='0.2', tooltip = node['action'])
+        return label
 
 def draw_single_edge(edge, max_edge_count, min_edge_count, max_edge_width, dot, has_comparison_data, show_drop):
     edge_style = 'solid'
-    if (edge['action_next'][:14] == 'Funnelius-Drop' and show_drop) or edge['action_next'][:14] != 'Funnelius-Drop':  
+    if show_drop or not edge['is_drop']:
         if edge['edge_count'] >= min_edge_count:
             #calculate edge width
             edge_width = (edge['edge_count']-min_edge_count)/(max_edge_count-min_edge_count)*max_edge_width
@@ -599,13 +1357,13 @@ def draw_single_edge(edge, max_edge_count, min_edge_count, max_edge_width, dot,
             edge_width = str(edge_width)
             
             #set edge color
-            if edge['action_next'][:14] == 'Funnelius-Drop':
+            if edge['is_drop']:
                 edge_color = '#%02x%02x%02x' % (255,200,200)
             else:
                 edge_color = '#%02x%02x%02x' % (200,200,200)
 
             #only show edge labels for funnel not drops
-            if edge['action_next'][:14] == 'Funnelius-Drop':
+            if edge['is_drop']:
                 label = ''
                 edge_dir = 'forward'
                 head_port = 'center'
@@ -624,25 +1382,45 @@ def draw_single_edge(edge, max_edge_count, min_edge_count, max_edge_width, dot,
             dot.edge(str(edge['action']), str(edge['action_next']), label=label , penwidth = edge_width, 
             color = edge_color, style = edge_style, dir = edge_dir, tailport = tailport, 
             headport = head_port, weight = weight)
+            return label, edge_width, weight
 
 def draw_edges(edge_data, min_edge_count, max_edge_width, dot, has_comparison_data, show_drop):
     max_edge_count = edge_data['edge_count'].max()
 
     #check if it is a polars dataframe
-    global df_backend
-    if df_backend == 'polars':
-        for edge in edge_data.iter_rows(named=True):
-            draw_single_edge(edge, max_edge_count, min_edge_count, max_edge_width, dot, has_comparison_data, show_drop)
+    if frame_backend(edge_data) == 'polars':
+        edges = edge_data.to_dicts()
     else:
-        for index, edge in edge_data.iterrows(): 
-            draw_single_edge(edge, max_edge_count, min_edge_count, max_edge_width, dot, has_comparison_data, show_drop)
-
-def draw(node_data, edge_data, answer_data, goals, min_edge_count, max_edge_width, title, show_drop, show_answer, max_visible_answers,
+        edges = edge_data.to_dict('records')
+    # draws every edge and returns {(action, action_next): (label, width, weight)} of the drawn edges
+    edge_attributes = {}
+    for edge in edges:
+        attributes = draw_single_edge(edge, max_edge_count, min_edge_count, max_edge_width, dot, has_comparison_data, show_drop)
+        if attributes is not None:
+            edge_attributes[(str(edge['action']), str(edge['action_next']))] = attributes
+    return edge_attributes
+
+def layout_key(node_labels, edge_attributes):
+    # hash of the drawn nodes and edges with every attribute dot lays them out by: node labels, edge labels, widths and
+    # weights. colors do not change the key, so a new gradient reuses the layout
+    return hashlib.sha256(repr((sorted(node_labels.items()), sorted(edge_attributes.items()))).encode()).hexdigest()
+
+def graph_layout(dot):
+    # runs the dot layout once and returns the position of every node in points
+    layout = json.loads(dot.pipe(format='json', engine='dot'))
+    return {node['name']: node['pos'] for node in layout.get('objects', []) if 'pos' in node}
+
+def render_graph(dot, ext):
+    # graphviz output of a laid out graph, a source that was rendered before is read from the render cache
+    key = hashlib.sha256(('neato\n-n2\n' + ext + '\n' + dot.source).encode()).hexdigest()
+    return render_cache.get(key, lambda: dot.pipe(format=ext, engine='neato', neato_no_op=2))
+
+def draw_to_bytes(node_data, edge_data, answer_data, goals, min_edge_count, max_edge_width, show_drop, show_answer, max_visible_answers,
 export_formats, conditional_format_gradient=['#ffc8c8','#fff','#c8ffc8'], 
-conditional_format_metric = 'conversion-rate', metrics=['conversion-rate','users','percent-of-total','duration-median']):
-
-    #export data to csv
-    export_to_csv(node_data, edge_data, answer_data)
+conditional_format_metric = 'conversion-rate', metrics=['conversion-rate','users','percent-of-total','duration-median'], profile=None):
+    # draws the graph and returns {format: bytes} piped from graphviz, nothing is written to the working directory
+    profile = profiler(profile)
+    node_data, edge_data = drop_flags(node_data, edge_data)
 
     #set parameters
     excluded_actions = ['Start', 'End'] + goals
@@ -653,127 +1431,388 @@ conditional_format_metric = 'conversion-rate', metrics=['conversion-rate','users
     if 'users_compare' in node_data.columns:
         has_comparison_data = 1
 
-    #initialize graphvize engine
-    dot = graphviz.Digraph(comment='')
-    dot.attr(label='', labelloc='top', fontsize='20', fontcolor='black', bgcolor=bgcolor)
-
-    # Draw nodes //////////////////////////////////////////////////////////////////////////////////////////////////////////////////
-    draw_nodes(node_data, answer_data, has_comparison_data, dot, metrics, goals, show_answer, conditional_format_metric, conditional_format_gradient, excluded_actions, show_drop)
-
-    #draw edges////////////////////////////////////////////
-    draw_edges(edge_data, min_edge_count, max_edge_width, dot, has_comparison_data, show_drop)
+    with stage(profile, 'dot', count_rows(node_data, edge_data, answer_data)) as record:
+        #initialize graphvize engine
+        dot = graphviz.Digraph(comment='')
+        dot.attr(label='', labelloc='top', fontsize='20', fontcolor='black', bgcolor=bgcolor)
+
+        # Draw nodes //////////////////////////////////////////////////////////////////////////////////////////////////////////////////
+        node_labels = draw_nodes(node_data, answer_data, has_comparison_data, dot, metrics, goals, show_answer, conditional_format_metric, conditional_format_gradient, excluded_actions, show_drop)
+
+        #draw edges////////////////////////////////////////////
+        edge_attributes = draw_edges(edge_data, min_edge_count, max_edge_width, dot, has_comparison_data, show_drop)
+        record['bytes_out'] = len(dot.source.encode())
+
+    #lay the graph out once, or reuse the positions of a graph with the same nodes, labels and edges
+    with stage(profile, 'layout') as record:
+        misses = layout_cache.misses
+        positions = layout_cache.get(('layout', layout_key(node_labels, edge_attributes)), lambda: graph_layout(dot))
+        record['cached'] = layout_cache.misses == misses
+    for name, pos in positions.items():
+        dot.node(name, pos=pos)
+    dot.attr(splines='true')
+
+    #render graph, neato -n2 keeps the given positions and only routes edges
+    outputs = {}
+    for ext in export_formats:
+        with stage(profile, 'graphviz ' + ext) as record:
+            misses = render_cache.misses
+            outputs[ext] = render_graph(dot, ext)
+            record['bytes_out'] = len(outputs[ext])
+            record['cached'] = render_cache.misses == misses
+    return outputs
 
-    #render graph 
-    for ext in export_formats:       
-        dot.render(title, view=False, format=ext)
-
-def merge_with_compare(data_node,data_compare_node,data_edge,data_compare_edge,data_answer,data_compare_answer):
-    global df_backend
-    if df_backend == 'pandas':
-        data_node = pd.merge(data_node, data_compare_node[['action','conversion_rate','users','duration_median','duration_mean','percent_of_total']], on='action', how='left', suffixes =('','_compare')) #add nodes compare data
-        data_edge = pd.merge(data_edge, data_compare_edge[['action','action_next','edge_count']], on=['action','action_next'], how='left', suffixes =('','_compare')) #add edge compare data
-        data_answer  = pd.merge(data_answer, data_compare_answer[['action','answer','answer_percent']], on=['action','answer'], how='left', suffixes =('','_compare')) #add answer compare data
-    else:
-        data_node = pdata_node = data_node.join(data_compare_node.select(["action","conversion_rate","users","duration_median","duration_mean","percent_of_total"]),on="action",how="left",suffix="_compare") #add nodes compare data
-        data_edge = data_edge.join(data_compare_edge.select(["action", "action_next", "edge_count"]), on=["action", "action_next"], how="left", suffix="_compare") #add edge compare data
-        data_answer = data_answer.join(data_compare_answer.select(["action", "answer", "answer_percent"]), on=["action", "answer"], how="left", suffix="_compare") #add answer compare data         
-    
-    return data_node,data_edge,data_answer
-
-def add_compare_only_nodes(data_node, data_compare_node):
-    global df_backend
-    if df_backend == 'pandas':
-        nodes_only_in_comparison = data_compare_node[~data_compare_node['action'].isin(data_node['action'])]
-        nodes_only_in_comparison = nodes_only_in_comparison[['action']]
-        nodes_only_in_comparison[['users', 'percent_of_total']] = 0
-        nodes_only_in_comparison[['conversion_rate', 'duration_median', 'duration_mean',
-        'conversion_rate_change', 'duration_median_change', 'duration_mean_change']] = np.nan
-        nodes_only_in_comparison[['users_change', 'percent_of_total_change']] = -1
-        data_node = pd.concat([data_node, nodes_only_in_comparison])
-    else:
-        nodes_only_in_comparison = data_compare_node[~data_compare_node['action'].isin(data_node['action'])]
-        nodes_only_in_comparison = nodes_only_in_comparison.select(pl.col('action'))
-        nodes_only_in_comparison = nodes_only_in_comparison.with_columns(
-            pl.lit(0).alias('users'), 
-            pl.lit(0).alias('percent_of_total'),
-            pl.lit(np.nan).alias('conversion_rate'), 
-            pl.lit(np.nan).alias('duration_median'), 
-            pl.lit(np.nan).alias('duration_mean'),
-            pl.lit(np.nan).alias('conversion_rate_change'), 
-            pl.lit(np.nan).alias('duration_median_change'), 
-            pl.lit(np.nan).alias('duration_mean_change'),
-            pl.lit(-1).alias('users_change'), 
-            pl.lit(-1).alias('percent_of_total_change')
-        )
-        data_node = pl.concat([data_node, nodes_only_in_comparison])   
-
-    return data_node     
-
-def add_compare_only_edges(data_edge, data_compare_edge):
-    global df_backend
-    if df_backend == 'pandas':
-        edges_only_in_comparison = data_compare_edge.merge(data_edge, on=['action','action_next'], how='left', indicator=True)
-        edges_only_in_comparison = edges_only_in_comparison[edges_only_in_comparison['_merge'] == 'left_only'].drop(columns=['_merge'])
-        edges_only_in_comparison = edges_only_in_comparison[['action', 'action_next']]
-        edges_only_in_comparison['edge_count'] = 0
-        edges_only_in_comparison['edge_count_change'] = -1
-        data_edge = pd.concat([data_edge, edges_only_in_comparison])
+def draw(node_data, edge_data, answer_data, goals, min_edge_count, max_edge_width, title, show_drop, show_answer, max_visible_answers,
+export_formats, conditional_format_gradient=['#ffc8c8','#fff','#c8ffc8'], 
+conditional_format_metric = 'conversion-rate', metrics=['conversion-rate','users','percent-of-total','duration-median'], export_data=None, profile=None):
+    profile = profiler(profile)
+
+    #export aggregated data as csv, parquet or arrow files
+    if export_data is not None:
+        with stage(profile, 'export', count_rows(node_data, edge_data, answer_data)):
+            export_aggregates(node_data, edge_data, answer_data, export_data)
+
+    outputs = draw_to_bytes(node_data, edge_data, answer_data, goals, min_edge_count, max_edge_width, show_drop, show_answer, max_visible_answers,
+    export_formats, conditional_format_gradient, conditional_format_metric, metrics, profile)
+    for ext, output in outputs.items():
+        with open(title + '.' + ext, 'wb') as f:
+            f.write(output)
+
+#metrics compared between datasets, with the keys of their aggregate table
+compare_metrics = {
+    'node': (['action'], ['conversion_rate','users','duration_median','duration_p90','duration_p99','duration_mean','percent_of_total']),
+    'edge': (['action', 'action_next'], ['edge_count']),
+    'answer': (['action', 'answer'], ['answer_percent']),
+}
+#counts are 0 for a row that only comparison datasets have
+count_metrics = ['users', 'percent_of_total', 'edge_count']
+
+def compare_suffix(k):
+    #the first comparison keeps the _compare and _change names draw() reads
+    return '' if k == 1 else '_' + str(k)
+
+def compare_table(tables, keys, metrics, keep_new_rows):
+    # one row per key with the metrics of every dataset side by side. rows of the first dataset keep their order, rows
+    # only found in comparison datasets follow when keep_new_rows is set
+    stacked = pd.concat([table.assign(__dataset=k) for k, table in enumerate(tables)], ignore_index=True)
+    rows = stacked.drop_duplicates(keys)
+    if not keep_new_rows:
+        rows = rows[rows['__dataset'] == 0]
+    compare_columns = [metric + '_compare' + compare_suffix(k) for k in range(1, len(tables)) for metric in metrics]
+    change_columns = [metric + '_change' + compare_suffix(k) for k in range(1, len(tables)) for metric in metrics]
+
+    #a single pivot puts every dataset's metrics in its own columns
+    wide = stacked.pivot(index=keys, columns='__dataset', values=metrics)
+    wide.columns = [metric if k == 0 else metric + '_compare' + compare_suffix(k) for metric, k in wide.columns]
+    wide = wide.reindex(columns=metrics + compare_columns)
+    data = rows.drop(columns=metrics + ['__dataset']).merge(wide.reset_index(), on=keys, how='left')
+
+    for metric in metrics:
+        if metric in count_metrics:
+            data[metric] = data[metric].fillna(0).astype(tables[0][metric].dtype)
+    for k in range(1, len(tables)):
+        for metric in metrics:
+            data[metric + '_change' + compare_suffix(k)] = data[metric] / data[metric + '_compare' + compare_suffix(k)] - 1
+    return data[list(tables[0].columns) + compare_columns + change_columns]
+
+def compare_aggregates(aggregates):
+    # node, edge and answer data of the first dataset with the metrics of every other dataset k as *_compare_k columns
+    # and the relative change as *_change_k columns, the first comparison is named *_compare and *_change.
+    # nodes and edges only found in comparison datasets are added with 0 users
+    backend = frame_backend(aggregates[0][0])
+    results = []
+    for (name, (keys, metrics)), tables in zip(compare_metrics.items(), zip(*aggregates)):
+        if backend == 'polars':
+            tables = [polars_to_pandas(table) for table in tables]
+        data = compare_table(list(tables), keys, metrics, name != 'answer')
+        results.append(pandas_to_polars(data) if backend == 'polars' else data)
+    return tuple(results)
+
+def concat_datasets(frames):
+    # stacks the events of every dataset. user ids become integer codes that differ between datasets, so the same user
+    # in two datasets makes two journeys and user_id % len(frames) gives the dataset back
+    num_datasets = len(frames)
+    if all(isinstance(frame, pd.DataFrame) for frame in frames):
+        parts = []
+        for frame in frames:
+            frame = frame[[column for column in event_columns if column in frame.columns]]
+            if not is_datetime(frame['action_start']):
+                frame = frame.assign(action_start=pd.to_datetime(frame['action_start']))
+            parts.append(frame)
+        events = pd.concat(parts, ignore_index=True)
+        datasets = np.repeat(np.arange(num_datasets), [len(part) for part in parts])
+        events['user_id'] = pd.factorize(events['user_id'])[0].astype('int64') * num_datasets + datasets
+        return events
+    parts = []
+    for k, frame in enumerate(frames):
+        if isinstance(frame, pd.DataFrame):
+            frame = pandas_to_polars(frame)
+        frame = select_events(frame.lazy())
+        parts.append(parse_action_start_pl(frame, frame.collect_schema()).with_columns(pl.lit(k).alias('__dataset')))
+    events = pl.concat(parts, how='diagonal_relaxed')
+    user_codes = pl.col('user_id').rank('dense').cast(pl.Int64) - 1
+    return events.with_columns((user_codes * num_datasets + pl.col('__dataset')).alias('user_id')).drop('__dataset')
+
+def dataset_aggregates(frames, first_actions_filter, goals, max_path_num, max_visible_answers, duration_accuracy):
+    # node, edge and answer data of every dataset from one keyed pipeline over the stacked events. routes are ranked
+    # inside every dataset, every dataset shows up to max_path_num of its own routes
+    if is_duckdb_relation(frames[0]):
+        #every dataset is its own duckdb query. datasets with fewer routes than max_path_num show all of them, so
+        #max_path_num limits them like the largest route number capped by max_path_num does
+        aggregates = []
+        for frame in frames:
+            data, __v1, __v2 = transform(frame)
+            data, __v1 = apply_filter(data, first_actions_filter, goals)
+            aggregates.append(aggregate(data, max_path_num if max_path_num > 0 else None, max_visible_answers, duration_accuracy))
+        return aggregates
+
+    num_datasets = len(frames)
+    data, __v1, __v2 = transform(concat_datasets(frames))
+    data, __v1 = apply_filter(data, first_actions_filter, goals)
+    if isinstance(data, pd.DataFrame):
+        data = data.assign(__dataset=data['user_id'].to_numpy() % num_datasets)
     else:
-        edges_only_in_comparison = data_compare_edge.join(data_edge, on=["action", "action_next"], how="left", indicator=True)
-        edges_only_in_comparison = edges_only_in_comparison.filter(pl.col("_merge") == "left_only").drop("_merge")
-        edges_only_in_comparison = edges_only_in_comparison.select(pl.col('action'), pl.col('action_next'))
-        edges_only_in_comparison = edges_only_in_comparison.with_columns(pl.lit(0).alias('edge_count'), pl.lit(-1).alias('edge_count_change'))
-        data_edge = pl.concat([data_edge, edges_only_in_comparison])
+        data = data.with_columns((pl.col('user_id') % num_datasets).alias('__dataset'))
 
-    return data_edge  
+    backend = frame_backend(data)
+    partials = split_segment_partials(route_partials(data, duration_accuracy, ['__dataset']), range(num_datasets))
+    route_indexes = [index_routes(partials[k], backend, duration_accuracy) for k in range(num_datasets)]
+    route_num = max(route_index['route_num'] for route_index in route_indexes)
+    if max_path_num > 0:
+        route_num = min(route_num, max_path_num)
+    return [aggregate_route_index(route_index, route_num, max_visible_answers) for route_index in route_indexes]
+
+def load_events(df, columns=event_columns, date_range=None, first_actions_filter=[]):
+    # event input of the render functions. paths are scanned and lazy frames selected with only the needed columns and
+    # dates, lazy inputs drop users by first action before the transform
+    if isinstance(df, (str, os.PathLike)):
+        df = scan_events(df, columns, date_range)
+    elif isinstance(df, pl.LazyFrame):
+        df = select_events(df, columns, date_range)
+    elif is_duckdb_relation(df):
+        df = select_events_duckdb(df, columns, date_range)
+    else:
+        df = filter_date_range(df, date_range)
+    if isinstance(df, pl.LazyFrame):
+        df = prefilter_first_actions_pl(df, first_actions_filter)
+    return df
 
 def render(df, title='export', first_actions_filter = [], goals = [], max_path_num = 0, show_drop = True , show_answer=False, max_visible_answers=5, comparison_df = None, 
-gradient = ['#ffcdcd','#fff','#cdffcd'], gradient_metric = 'conversion-rate', metrics = ['conversion-rate','users','percent-of-total','duration-median']):
+gradient = ['#ffcdcd','#fff','#cdffcd'], gradient_metric = 'conversion-rate', metrics = ['conversion-rate','users','percent-of-total','duration-median'], partitions = 0, duration_accuracy = 0.01, parallel = 1, export_formats = ['pdf'], output = 'file', export_data = None, date_range = None, compact = False, profile = None):
+    from funnelius.engine import default_engine
+    return default_engine.render(df, title, first_actions_filter, goals, max_path_num, show_drop, show_answer, max_visible_answers, comparison_df,
+    gradient, gradient_metric, metrics, partitions, duration_accuracy, parallel, export_formats, output, export_data, date_range, compact, profile)
+
+def user_segments_pd(df, segment_col):
+    #segment of every user is the value on their earliest event, ties keep the input order like transform
+    action_start = df['action_start']
+    if not is_datetime(action_start):
+        action_start = pd.to_datetime(action_start)
+    user_codes, users = pd.factorize(df['user_id'])
+    order = np.lexsort((action_start.to_numpy(dtype='datetime64[ns]'), user_codes))
+    sorted_codes = user_codes[order]
+    first_rows = order[np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])]
+    return pd.Series(take_values(df[segment_col], first_rows), index=users[user_codes[first_rows]])
+
+def user_segments_pl(df, segment_col):
+    df = parse_action_start_pl(df.lazy(), df.lazy().collect_schema())
+    return df.group_by('user_id').agg(pl.col(segment_col).sort_by('action_start', maintain_order=True).first().alias('__segment'))
+
+def segment_events(df, data, segment_col):
+    # adds a __segment column to a dataframe returned by apply_filter, rows of users without a segment are left out
+    if segment_col == 'first_action':
+        #every row, Start rows included, already carries the first action of its user
+        segment = data['first_action'] if isinstance(data, pd.DataFrame) else pl.col('first_action')
+    elif isinstance(data, pd.DataFrame):
+        segment = data['user_id'].map(user_segments_pd(df, segment_col))
+    else:
+        segments = user_segments_pl(df, segment_col)
+        if isinstance(data, pl.DataFrame):
+            segments = segments.collect()
+        data = data.join(segments, on='user_id', how='left')
+        segment = pl.col('__segment')
+    if isinstance(data, pd.DataFrame):
+        data = data.assign(__segment=segment.to_numpy())
+        return data[data['__segment'].notna().to_numpy()]
+    return data.with_columns(segment.alias('__segment')).filter(pl.col('__segment').is_not_null())
+
+def split_segment_partials(partials, segment_values=None):
+    # splits route partials grouped by a segment key into route partials of every segment. the key is the first
+    # column, segment_values lists segments that are returned even when they have no users
+    key = partials['routes'].columns[0]
+    groups = {name: dict(list(table.groupby(key))) for name, table in partials.items()}
+    if segment_values is None:
+        segment_values = groups['routes']
+    segments = {}
+    for segment in segment_values:
+        segments[segment] = {
+            name: groups[name].get(segment, partials[name].iloc[:0]).drop(columns=[key]).reset_index(drop=True)
+            for name in partials
+        }
+        #routes are ranked again inside every segment
+        segments[segment]['routes'] = segments[segment]['routes'].drop(columns=['route_order'])
+    return segments
+
+def draw_segment(arguments):
+    # draws the graph of one segment, runs in a worker process when render_segments has parallel > 1
+    return draw_to_bytes(*arguments)
+
+def draw_segments(draw_arguments, parallel):
+    #graphviz runs in the workers, every worker gets the small aggregate tables of its segments
+    if parallel > 1 and len(draw_arguments) > 1:
+        with ProcessPoolExecutor(min(parallel, len(draw_arguments)), mp_context=multiprocessing.get_context('spawn')) as pool:
+            return list(pool.map(draw_segment, draw_arguments))
+    return [draw_segment(arguments) for arguments in draw_arguments]
+
+def write_segments(title, outputs):
+    # writes the graphs of every segment to title_<segment>.<ext>
+    for segment, segment_outputs in outputs.items():
+        for ext, output_bytes in segment_outputs.items():
+            with open(title + '_' + str(segment).replace(os.sep, '_') + '.' + ext, 'wb') as f:
+                f.write(output_bytes)
+
+def render_segments(df, segment_col, title='export', first_actions_filter = [], goals = [], max_path_num = 0, show_drop = True, show_answer = False, max_visible_answers = 5,
+gradient = ['#ffcdcd','#fff','#cdffcd'], gradient_metric = 'conversion-rate', metrics = ['conversion-rate','users','percent-of-total','duration-median'], duration_accuracy = 0.01, parallel = 1, export_formats = ['pdf'], output = 'file', date_range = None):
+    # renders one funnel for every value of segment_col, for example a country column or first_action. a user belongs
+    # to the segment of their earliest event. transform and apply_filter run once, the partial aggregates of all
+    # segments come from one group-by and the graphs are drawn in parallel worker processes
     max_edge_width = 20
     min_edge_count = 0
 
-    if comparison_df is None:
-        has_comparison_df = False
-    else:
-        has_comparison_df = True
-
-    data, first_actions, all_actions = transform(df)
-    if has_comparison_df == True:
-        data_compare, __v1, all_actions_compare = transform(comparison_df)
-
-    data, route_num =  apply_filter(data, first_actions_filter, goals)
-    if has_comparison_df == True:
-        data_compare, route_num_compare = apply_filter(data_compare, first_actions_filter, goals)
-        oute_num = max(route_num, route_num_compare)
-
-    if max_path_num > 0:
-        route_num = min(route_num,max_path_num)
-    
-    data_node, data_edge, data_answer = aggregate(data, route_num, max_visible_answers)
-    if has_comparison_df == True:
-        data_compare_node, data_compare_edge, data_compare_answer = aggregate(data_compare, route_num, max_visible_answers)
-
-        #merge data with compare_data
-        data_node, data_edge, data_answer = merge_with_compare(data_node,data_compare_node,data_edge,data_compare_edge,data_answer,data_compare_answer) #add compare data
-        
-        #calculate increase/decrease percentages for nodes
-        metrics = ['conversion_rate','duration_median','percent_of_total','users']
-        for metric in metrics:
-            data_node[metric+'_change'] = data_node[metric]/data_node[metric+'_compare'] - 1
-
-        #calculate increase/decrease percentages for answers
-        data_answer['answer_percent_change'] = data_answer['answer_percent']/data_answer['answer_percent_compare'] - 1
-
-        #calculate increase/decrease percentages for edges
-        data_edge['edge_count_change'] = data_edge['edge_count']/data_edge['edge_count_compare'] - 1
-        
-        #add nodes that were present in comparison data but not in original data
-        data_node = add_compare_only_nodes(data_node, data_compare_node)
-
-        #add edges that were present in comparison data but not in original data
-        data_edge = add_compare_only_edges(data_edge, data_compare_edge)
+    if output not in ['file', 'bytes']:
+        raise ValueError("output should be 'file' or 'bytes'")
+
+    #answers are not read when they are not drawn, the segment column is read with the events
+    columns = event_columns if show_answer else [column for column in event_columns if column != 'answer']
+    if segment_col != 'first_action':
+        columns = columns + [segment_col]
+    df = load_events(df, columns, date_range, first_actions_filter)
+    check_not_duckdb(df, 'render_segments')
+
+    data, __v1, __v2 = transform(df)
+    data, __v1 = apply_filter(data, first_actions_filter, goals)
+    data = segment_events(df, data, segment_col)
+
+    backend = frame_backend(data)
+    segments = split_segment_partials(route_partials(data, duration_accuracy, ['__segment']))
+    draw_arguments = []
+    for segment, partials in segments.items():
+        route_index = index_routes(partials, backend, duration_accuracy)
+        route_num = route_index['route_num']
+        if max_path_num > 0:
+            route_num = min(route_num, max_path_num)
+        data_node, data_edge, data_answer = aggregate_route_index(route_index, route_num, max_visible_answers)
+        draw_arguments.append((data_node, data_edge, data_answer, goals, min_edge_count, max_edge_width, show_drop, show_answer, max_visible_answers,
+        export_formats, gradient, gradient_metric, metrics))
+
+    outputs = dict(zip(segments, draw_segments(draw_arguments, parallel)))
+    if output == 'bytes':
+        return outputs
+    write_segments(title, outputs)
+
+def cohort_events(data):
+    # adds a __cohort column to a dataframe returned by apply_filter, the day of the first event of every user
+    if isinstance(data, pd.DataFrame):
+        first_event = data.groupby('user_id', sort=False, observed=True)['action_start'].transform('min')
+        return data.assign(__cohort=first_event.dt.floor('D').to_numpy())
+    return data.with_columns(pl.col('action_start').min().over('user_id').dt.truncate('1d').alias('__cohort'))
+
+#count columns of route partials, they are summed when partials are merged and negated when they are subtracted
+partial_counts = {
+    'routes': ['users'],
+    'nodes': ['users', 'drops', 'duration_sum', 'duration_count'],
+    'durations': ['count'],
+    'edges': ['edge_count'],
+    'answers': ['answer_count'],
+}
+
+def negate_partials(partials):
+    #polars counts are unsigned, they are widened before the sign flips
+    negated = {}
+    for name, table in partials.items():
+        table = table.copy()
+        for column in partial_counts[name]:
+            values = table[column]
+            table[column] = -(values.astype('int64') if values.dtype.kind in 'biu' else values)
+        negated[name] = table
+    return negated
+
+def window_partials(running, entering, leaving):
+    # route partials of the next window, the entering day is added and the leaving day is subtracted. rows whose
+    # first count falls to 0 have no users left in the window and are removed
+    parts = [running] + [entering] + ([negate_partials(leaving)] if leaving is not None else [])
+    merged = merge_route_partials(parts)
+    return {name: table[table[partial_counts[name][0]] != 0].reset_index(drop=True) for name, table in merged.items()}
+
+def rolling_aggregates(df, window_days=7, first_actions_filter = [], goals = [], max_path_num = 0, max_visible_answers = 5, duration_accuracy = 0.01, date_range = None, columns = event_columns):
+    # yields (window_end, node_data, edge_data, answer_data) of the trailing window_days days ending on every day.
+    # users are keyed by the day of their first event, partial aggregates of every day come from one group-by after
+    # transform and apply_filter, and each window is the previous one plus the entering day minus the leaving day.
+    # windows start once window_days days of data are there, or on the last day when there are fewer. window_end is the
+    # midnight timestamp of the last day
+    df = load_events(df, columns, date_range, first_actions_filter)
+    check_not_duckdb(df, 'rolling_aggregates')
+    data, __v1, __v2 = transform(df)
+    data, __v1 = apply_filter(data, first_actions_filter, goals)
+    data = cohort_events(data)
+
+    backend = frame_backend(data)
+    days = split_segment_partials(route_partials(data, duration_accuracy, ['__cohort']))
+    if len(days) == 0:
+        return
+    first_day, last_day = min(days), max(days)
+    window_start = min(first_day + pd.Timedelta(days=window_days - 1), last_day)
+    empty = {name: table.iloc[:0] for name, table in next(iter(days.values())).items()}
+
+    running = empty
+    for day in pd.date_range(first_day, last_day, freq='D'):
+        running = window_partials(running, days.get(day, empty), days.get(day - pd.Timedelta(days=window_days)))
+        if day < window_start or len(running['routes']) == 0:
+            continue
+        route_index = index_routes(running, backend, duration_accuracy)
+        route_num = route_index['route_num']
+        if max_path_num > 0:
+            route_num = min(route_num, max_path_num)
+        yield (day, *aggregate_route_index(route_index, route_num, max_visible_answers))
+
+def rolling_funnels(df, window_days=7, first_actions_filter = [], goals = [], max_path_num = 0, max_visible_answers = 5, duration_accuracy = 0.01, date_range = None):
+    # time series of node metrics over trailing windows, one row per window_end and action. window_end is a datetime
+    # column on both backends
+    check_not_duckdb(df, 'rolling_funnels')
+    columns = [column for column in event_columns if column != 'answer']
+    node_frames = []
+    for window_end, data_node, __v1, __v2 in rolling_aggregates(df, window_days, first_actions_filter, goals, max_path_num, max_visible_answers, duration_accuracy, date_range, columns):
+        if isinstance(data_node, pd.DataFrame):
+            node_frames.append(data_node.assign(window_end=window_end)[['window_end'] + list(data_node.columns)])
+        else:
+            node_frames.append(data_node.select(pl.lit(window_end.to_pydatetime()).alias('window_end'), pl.all()))
+    if frame_backend(df) == 'polars':
+        return pl.concat(node_frames, how='vertical_relaxed') if node_frames else pl.DataFrame()
+    return pd.concat(node_frames, ignore_index=True) if node_frames else pd.DataFrame()
+
+def render_rolling(df, window_days=7, title='export', first_actions_filter = [], goals = [], max_path_num = 0, show_drop = True, show_answer = False, max_visible_answers = 5,
+gradient = ['#ffcdcd','#fff','#cdffcd'], gradient_metric = 'conversion-rate', metrics = ['conversion-rate','users','percent-of-total','duration-median'], duration_accuracy = 0.01, parallel = 1, export_formats = ['pdf'], output = 'file', date_range = None):
+    # renders the funnel of the trailing window_days days ending on every day to title_<yyyy-mm-dd>.<ext>, or returns
+    # {window_end: {ext: bytes}} with output='bytes'. graphs are drawn in parallel worker processes like render_segments
+    max_edge_width = 20
+    min_edge_count = 0
 
-    draw(data_node, data_edge, data_answer, goals, min_edge_count, max_edge_width, title, show_drop, show_answer, max_visible_answers, ['pdf'], gradient , gradient_metric, metrics)
+    if output not in ['file', 'bytes']:
+        raise ValueError("output should be 'file' or 'bytes'")
+    check_not_duckdb(df, 'render_rolling')
+
+    columns = event_columns if show_answer else [column for column in event_columns if column != 'answer']
+    windows = []
+    draw_arguments = []
+    for window_end, data_node, data_edge, data_answer in rolling_aggregates(df, window_days, first_actions_filter, goals, max_path_num, max_visible_answers, duration_accuracy, date_range, columns):
+        windows.append(window_end.strftime('%Y-%m-%d'))
+        draw_arguments.append((data_node, data_edge, data_answer, goals, min_edge_count, max_edge_width, show_drop, show_answer, max_visible_answers,
+        export_formats, gradient, gradient_metric, metrics))
+
+    outputs = dict(zip(windows, draw_segments(draw_arguments, parallel)))
+    if output == 'bytes':
+        return outputs
+    write_segments(title, outputs)
 
 def interactive():
     import subprocess
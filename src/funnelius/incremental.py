@@ -0,0 +1,175 @@
+from collections import Counter, defaultdict
+
+import numpy as np
+import pandas as pd
+import polars as pl
+
+from funnelius.functions import (collapse_answers_pd, collapse_answers_pl, duration_quantiles, pandas_to_polars,
+                                 polars_to_pandas, route_step_hashes)
+from funnelius.sketch import DDSketch
+
+class FunnelState:
+    # running funnel aggregates for an append-only event table. update() only touches users that appear in the new
+    # events: their old end of journey and route are taken back and the extended journey is added again.
+    # frames() returns the node, edge and answer data of all routes, the same frames aggregate() gives to draw().
+    def __init__(self, first_actions_filter=[], goals=[], max_visible_answers=5, backend='pandas', duration_accuracy=0.01):
+        self.first_actions_filter = list(first_actions_filter)
+        self.goals = set(goals)
+        self.max_visible_answers = max_visible_answers
+        self.backend = backend
+        self.duration_accuracy = duration_accuracy
+
+        #per user state: [last action, last action start, number of actions, route id]
+        self.users = {}
+        self.ignored_users = set()
+
+        self.node_users = Counter()
+        self.node_drops = Counter()
+        self.duration_sum = Counter()
+        self.durations = defaultdict(lambda: DDSketch(self.duration_accuracy))
+        self.edges = Counter()
+        self.drop_edges = set()
+        self.answers = Counter()
+        self.routes = Counter()
+
+    @property
+    def route_num(self):
+        return len(self.routes)
+
+    def end_of_journey(self, action):
+        #where a journey that stops at action goes, and whether it is a drop
+        if action in self.goals:
+            return 'End', False
+        return 'Funnelius-Drop' + action, True
+
+    def update(self, new_events_df):
+        # adds a batch of events, events of a user must not be older than the ones already added for that user
+        events = new_events_df
+        if isinstance(events, pl.DataFrame):
+            events = polars_to_pandas(events)
+        if 'answer' in events.columns:
+            answers = events['answer'].to_numpy(dtype=object)
+        else:
+            answers = np.full(len(events), np.nan, dtype=object)
+        starts = pd.to_datetime(events['action_start']).to_numpy(dtype='datetime64[ns]')
+        user_codes, user_ids = pd.factorize(events['user_id'])
+
+        #sort the batch by user and time, then extend every user's journey with its slice
+        order = np.lexsort((starts, user_codes))
+        user_codes = user_codes[order]
+        actions = events['action'].to_numpy(dtype=object)[order]
+        starts = starts[order]
+        answers = answers[order]
+        boundaries = np.flatnonzero(user_codes[1:] != user_codes[:-1]) + 1
+        begins = np.concatenate([[0], boundaries])
+        ends = np.concatenate([boundaries, [len(order)]])
+        for begin, end in zip(begins, ends):
+            if end > begin:
+                self.extend_journey(user_ids[user_codes[begin]], actions[begin:end], starts[begin:end], answers[begin:end])
+        return self
+
+    def extend_journey(self, user_id, actions, starts, answers):
+        if user_id in self.ignored_users:
+            return
+        state = self.users.get(user_id)
+        if state is None:
+            #a new user starts from the Start node
+            if self.first_actions_filter != [] and actions[0] not in self.first_actions_filter:
+                self.ignored_users.add(user_id)
+                return
+            previous_action, previous_start, action_count = 'Start', None, 0
+            route_id = int(route_step_hashes(np.array(['Start'], dtype=object), [0])[0])
+            self.node_users['Start'] += 1
+            if self.backend == 'polars':
+                self.answers[('Start', '-')] += 1
+        else:
+            previous_action, previous_start, action_count, route_id = state
+            if starts[0] < previous_start:
+                raise ValueError('events of user ' + str(user_id) + ' are older than events already added to the funnel state')
+            #take back the old end of the journey and the old route
+            next_action, is_drop = self.end_of_journey(previous_action)
+            self.remove(self.edges, (previous_action, next_action))
+            if is_drop:
+                self.remove(self.node_drops, previous_action)
+            self.remove(self.routes, route_id)
+
+        #route ids are the wrapping sum of step hashes, like apply_filter computes them
+        step_hashes = route_step_hashes(actions, np.arange(action_count + 1, action_count + len(actions) + 1))
+        route_id = (route_id + int(step_hashes.sum())) % 2 ** 64
+
+        for action, start, answer in zip(actions, starts, answers):
+            self.edges[(previous_action, action)] += 1
+            if previous_start is not None:
+                duration = (start - previous_start) / np.timedelta64(1, 's')
+                self.duration_sum[previous_action] += duration
+                self.durations[previous_action].add(duration)
+            self.node_users[action] += 1
+            if not pd.isna(answer):
+                self.answers[(action, answer)] += 1
+            previous_action, previous_start = action, start
+
+        next_action, is_drop = self.end_of_journey(previous_action)
+        self.edges[(previous_action, next_action)] += 1
+        if is_drop:
+            self.node_drops[previous_action] += 1
+            self.drop_edges.add((previous_action, next_action))
+        self.routes[route_id] += 1
+        self.users[user_id] = [previous_action, previous_start, action_count + len(actions), route_id]
+
+    def remove(self, counter, key):
+        counter[key] -= 1
+        if counter[key] == 0:
+            del counter[key]
+
+    def frames(self):
+        # node_data, edge_data and answer_data for every route, ready for draw()
+        actions = sorted(self.node_users)
+        users = np.array([self.node_users[action] for action in actions], dtype='int64')
+
+        #duration quantiles from the duration sketch of every action
+        quantile_columns = {column: np.array([self.durations[action].quantile(quantile) for action in actions])
+                            for column, quantile in duration_quantiles.items()}
+        duration_count = np.array([self.durations[action].count for action in actions], dtype=float)
+        duration_sum = np.array([self.duration_sum[action] for action in actions], dtype=float)
+        drops = np.array([self.node_drops[action] for action in actions], dtype=float)
+
+        node_agg_data = pd.DataFrame({
+            'action': pd.Series(actions, dtype=object),
+            **quantile_columns,
+            'duration_mean': np.divide(duration_sum, duration_count, out=np.full(len(actions), np.nan), where=duration_count > 0),
+            'users': users,
+            'conversion_rate': 1.0 - drops / users,
+            'is_drop': False,
+        })
+
+        edge_keys = sorted(self.edges)
+        edge_agg_data = pd.DataFrame({
+            'action': pd.Series([key[0] for key in edge_keys], dtype=object),
+            'action_next': pd.Series([key[1] for key in edge_keys], dtype=object),
+            'edge_count': np.array([self.edges[key] for key in edge_keys], dtype='int64'),
+            'is_drop': np.array([key in self.drop_edges for key in edge_keys], dtype=bool),
+        })
+
+        #some nodes only appear in action_next column but still we should draw them
+        missing_end_points = edge_agg_data[~edge_agg_data['action_next'].isin(node_agg_data['action'])]
+        missing_end_points = missing_end_points.groupby('action_next').agg(users=('edge_count', 'sum'), is_drop=('is_drop', 'first')).reset_index()
+        missing_end_points.rename(columns={'action_next':'action'}, inplace=True)
+        node_agg_data = pd.concat([node_agg_data, missing_end_points], ignore_index=True)
+        node_agg_data['percent_of_total'] = node_agg_data['users'] / self.node_users['Start']
+        node_agg_data['is_drop'] = node_agg_data.pop('is_drop').astype(bool)
+
+        answer_agg_data = pd.DataFrame({
+            'action': pd.Series([key[0] for key in self.answers], dtype=object),
+            'answer': pd.Series([key[1] for key in self.answers], dtype=object),
+            'answer_count': np.array(list(self.answers.values()), dtype='int64'),
+        }).sort_values(['action', 'answer']).reset_index(drop=True)
+
+        if self.backend == 'polars':
+            count_type = pl.get_index_type()
+            node_agg_data = pandas_to_polars(node_agg_data).with_columns(pl.col('users').cast(count_type))
+            edge_agg_data = pandas_to_polars(edge_agg_data).with_columns(pl.col('edge_count').cast(count_type))
+            answer_agg_data = pandas_to_polars(answer_agg_data).with_columns(pl.col('answer_count').cast(count_type))
+            answer_agg_data = collapse_answers_pl(answer_agg_data.lazy(), self.max_visible_answers).collect()
+        else:
+            answer_agg_data = collapse_answers_pd(answer_agg_data, self.max_visible_answers)
+        return node_agg_data, edge_agg_data, answer_agg_data
@@ -1,54 +1,137 @@
 import streamlit as st
 import pandas as pd
-import numpy as np
-from functions import transform, apply_filter, aggregate, draw, hex_to_rgb
-
-compare_file = None
-# function used to write a sample python code and jupyter noot book files /////////////////////////////////////////////////
+import polars as pl
+import hashlib
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from functions import transform, apply_filter, compare_aggregates, select_events, polars_to_pandas, build_route_index, aggregate_route_index, draw_to_bytes, hex_to_rgb
+from cache import StageCache
+from profiling import Profile, stage, count_rows
+
+compare_files = []
+# function used to generate a sample python code, it is kept in memory so sessions do not share files /////////////////////
 def write_python():
-    global csv_file
-    global compare_file
-    global first_actions_filter
-    global goals
-    global max_routes
-    global show_drop
-    global show_answer
-    global max_visible_answers
-    global gradient
-    global gradient_metric
-    global metrics
-
-    with open('funnelius_code.py', 'w') as f:
-        text = '# import neccessary libraries\n'
-        text += 'import pandas as pd\n'
-        text += 'import funnelius as fs\n'
-        text += '\n#read csv file\n'
-        text += 'df = pd.read_csv("'+csv_file.name+'")\n'
-
-
-        if compare_file is not None:
-            text += '\n#read comparison file\n'
-            text += 'df_compare = pd.read_csv("'+compare_file.name+'")\n'
-
-        text += '\n# render graph\n'    
-        text += 'fs.render(df'
-
-        if compare_file is not None:
-            text += ', comparison_df=df_compare'
-
-        text+= ', first_actions_filter=[' + ','.join(first_actions_filter)+']'
-        text+= ', goals=[' + ','.join(goals)+']'
-        text+= ', max_path_num=' + str(max_routes)
-        text+= ', show_drop=' + str(show_drop)
-        text+= '\n, show_answer=' + str(show_answer)
-        text+= ', max_visible_answers=' + str(max_visible_answers)
-        text+= ', gradient=' + '["'+'","'.join(x for x in gradient)+'"]'
-        text+= ', gradient_metric="' + gradient_metric+'"'
-        text+= '\n, metrics=["' + '","'.join(metrics) + '"]'
-
-        text +=')'
-        f.write(text)
-        f.close()
+    text = '# import neccessary libraries\n'
+    text += 'import pandas as pd\n'
+    text += 'import funnelius as fs\n'
+    text += '\n#read event file\n'
+    text += 'df = ' + read_events_code(csv_file.name) + '\n'
+
+
+    if compare_files != []:
+        text += '\n#read comparison files\n'
+        for k, compare_file in enumerate(compare_files):
+            text += 'df_compare_' + str(k + 1) + ' = ' + read_events_code(compare_file.name) + '\n'
+
+    text += '\n# render graph\n'    
+    text += 'fs.render(df'
+
+    if compare_files != []:
+        text += ', comparison_df=[' + ', '.join('df_compare_' + str(k + 1) for k in range(len(compare_files))) + ']'
+
+    text+= ', first_actions_filter=[' + ','.join(first_actions_filter)+']'
+    text+= ', goals=[' + ','.join(goals)+']'
+    text+= ', max_path_num=' + str(max_routes)
+    text+= ', show_drop=' + str(show_drop)
+    text+= '\n, show_answer=' + str(show_answer)
+    text+= ', max_visible_answers=' + str(max_visible_answers)
+    text+= ', gradient=' + '["'+'","'.join(x for x in gradient)+'"]'
+    text+= ', gradient_metric="' + gradient_metric+'"'
+    text+= '\n, metrics=["' + '","'.join(metrics) + '"]'
+
+    text +=')'
+    return text
+
+def read_events_code(file_name):
+    #parquet and arrow files are passed to render as paths, it only scans the columns and rows it needs
+    if file_name.endswith(event_file_types[1:]):
+        return '"' + file_name + '"'
+    return 'pd.read_csv("' + file_name + '")'
+
+# event files /////////////////////////////////////////////////////////////////////////////
+event_file_types = ('.csv', '.parquet', '.arrow', '.ipc', '.feather')
+
+def read_events(uploaded_file):
+    # parquet and arrow uploads are read with only the event columns, csv files are parsed by pandas
+    data = uploaded_file.getvalue()
+    if uploaded_file.name.endswith('.parquet'):
+        return polars_to_pandas(select_events(pl.scan_parquet(data)).collect())
+    elif uploaded_file.name.endswith(event_file_types[2:]):
+        return polars_to_pandas(select_events(pl.scan_ipc(data)).collect())
+    return pd.read_csv(io.BytesIO(data))
+
+# cached pipeline stages //////////////////////////////////////////////////////////
+# every widget change reruns this script, stage results are reused when their file and parameters did not change
+stage_cache_max_bytes = 2 * 1024 ** 3
+
+@st.cache_resource
+def get_stage_cache():
+    # one cache shared by all sessions of the app
+    return StageCache(stage_cache_max_bytes)
+
+def file_hash(uploaded_file):
+    # content hash of an uploaded file, remembered per upload so a big file is hashed only once
+    hashes = st.session_state.setdefault('file_hashes', {})
+    if uploaded_file.file_id not in hashes:
+        hashes[uploaded_file.file_id] = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+    return hashes[uploaded_file.file_id]
+
+def cached_transform(uploaded_file):
+    key = ('transform', file_hash(uploaded_file))
+    return get_stage_cache().get(key, lambda: transform(read_events(uploaded_file), compact=True))
+
+def cached_apply_filter(uploaded_file, first_actions_filter, goals):
+    key = ('apply_filter', file_hash(uploaded_file), frozenset(first_actions_filter), frozenset(goals))
+    return get_stage_cache().get(key, lambda: apply_filter(cached_transform(uploaded_file)[0], first_actions_filter, goals))
+
+def cached_route_index(uploaded_file, first_actions_filter, goals):
+    # per route aggregates, built once per filter so moving the paths slider is a prefix-sum lookup
+    key = ('route_index', file_hash(uploaded_file), frozenset(first_actions_filter), frozenset(goals))
+    return get_stage_cache().get(key, lambda: build_route_index(cached_apply_filter(uploaded_file, first_actions_filter, goals)[0]))
+
+def cached_aggregate(uploaded_file, first_actions_filter, goals, max_routes, max_visible_answers):
+    key = ('aggregate', file_hash(uploaded_file), frozenset(first_actions_filter), frozenset(goals), max_routes, max_visible_answers)
+    return get_stage_cache().get(key, lambda: aggregate_route_index(cached_route_index(uploaded_file, first_actions_filter, goals), max_routes, max_visible_answers))
+
+def profile_stage(profile, name, compute, rows_in=None):
+    # runs a cached stage and records it for the Performance panel, cached marks results reused from the stage cache
+    cache = get_stage_cache()
+    with stage(profile, name, rows_in) as record:
+        misses = cache.misses
+        result = compute()
+        record['cached'] = cache.misses == misses
+        record['rows_out'] = count_rows(*result) if name.startswith('aggregate') else count_rows(result[0])
+    return result
+
+# background rendering ////////////////////////////////////////////////////////////
+@st.cache_resource
+def get_render_executor():
+    # graphviz work of all sessions runs here, so a script run can stop waiting for a render that became stale
+    return ThreadPoolExecutor(max_workers=2)
+
+def render_in_background(render_key, render):
+    # runs render(profile=...) on the render executor and waits for it. a newer widget state reruns the script, which
+    # stops this wait at the next streamlit call and cancels the older render if it has not started yet. returns the
+    # result and the profile of the render that produced it
+    latest = st.session_state.get('latest_render')
+    if latest is None or latest[0] != render_key:
+        if latest is not None:
+            latest[1].cancel()
+        render_profile = Profile()
+        latest = (render_key, get_render_executor().submit(render, profile=render_profile), render_profile)
+        st.session_state['latest_render'] = latest
+    progress = st.empty()
+    while not latest[1].done():
+        progress.caption('Rendering funnel ...')
+        time.sleep(0.05)
+    progress.empty()
+    return latest[1].result(), latest[2]
+
+def render_pdf(*args, **kwargs):
+    # only runs when Download PDF is clicked, the layout of the svg is reused from the layout cache
+    return draw_to_bytes(*args, **kwargs)['pdf']
 
 # setting initial parameters //////////////////////////////////////////////////////
 max_edge_width = 20
@@ -68,6 +151,8 @@ gradient_lookup = {
 metric_lookup = {
     'conversion-rate':'Conversion Rate',
     'duration-median':'Duration Median',
+    'duration-p90':'Duration P90',
+    'duration-p99':'Duration P99',
     'duration-mean':'Duration Mean',
     'percent-of-total':'% of Total Users',
     'users':'Users'
@@ -78,22 +163,21 @@ st.sidebar.title('Funnelius')
 
 
 st.sidebar.subheader("Load Data", divider="gray")
-csv_file = st.sidebar.file_uploader("Choose a CSV file", accept_multiple_files=False)
+csv_file = st.sidebar.file_uploader("Choose a CSV, Parquet or Arrow file", type=[file_type.lstrip('.') for file_type in event_file_types], accept_multiple_files=False)
 if csv_file is not None:
-    raw_data = pd.read_csv(csv_file)
-
 
     # compare file //////////////////////////////////////////////////////////////////////////////////
-    compare = st.sidebar.checkbox("Compare with another file", value = False)
+    compare = st.sidebar.checkbox("Compare with other files", value = False)
     if compare == True:
-        compare_file = st.sidebar.file_uploader("Choose a CSV file to compare", accept_multiple_files=False)
-        if compare_file is not None:
-            compare_data = pd.read_csv(compare_file)
+        compare_files = st.sidebar.file_uploader("Choose files to compare", type=[file_type.lstrip('.') for file_type in event_file_types], accept_multiple_files=True)
+        if compare_files:
             has_compare = 1
+        else:
+            compare_files = []
 
-    data, first_actions, all_actions = transform(raw_data)
-    if has_compare == 1:
-        data_compare, __v1, all_actions_compare = transform(compare_data)
+    #stages of this script run, shown in the Performance panel
+    profile = Profile()
+    data, first_actions, all_actions = profile_stage(profile, 'transform', lambda: cached_transform(csv_file))
     
 
 
@@ -109,9 +193,9 @@ if csv_file is not None:
         default=[],
     ) 
 
-    data, route_num =  apply_filter(data, first_actions_filter, goals)
-    if has_compare == 1:
-        data_compare, route_num_compare = apply_filter(data_compare, first_actions_filter, goals)
+    data, route_num = profile_stage(profile, 'apply_filter', lambda: cached_apply_filter(csv_file, first_actions_filter, goals), len(data))
+    for k, compare_file in enumerate(compare_files):
+        data_compare, route_num_compare = profile_stage(profile, 'apply_filter compare_' + str(k + 1), lambda: cached_apply_filter(compare_file, first_actions_filter, goals))
         route_num = max(route_num, route_num_compare)
     
 
@@ -119,9 +203,8 @@ if csv_file is not None:
 
     # show percentage of sampling based on maximum routes selected
     if max_routes < route_num:
-        all_route_users = len(pd.unique(data['user_id']))
-        sampled_route_users = len(pd.unique(data.query('route_order <= @max_routes')['user_id']))
-        st.sidebar.text(str(int(sampled_route_users/all_route_users*100))+'% of data')
+        route_users = cached_route_index(csv_file, first_actions_filter, goals)['routes']['users']
+        st.sidebar.text(str(int(route_users.iloc[:max_routes].sum()/route_users.sum()*100))+'% of data')
 
     show_answer = st.sidebar.checkbox("Show Answer contriburion", value = False)
     if show_answer == True:
@@ -129,48 +212,18 @@ if csv_file is not None:
     else:
         max_visible_answers = 5 
  
-    data_node, data_edge, data_answer = aggregate(data, max_routes, max_visible_answers)
+    data_node, data_edge, data_answer = profile_stage(profile, 'aggregate', lambda: cached_aggregate(csv_file, first_actions_filter, goals, max_routes, max_visible_answers), len(data))
     if has_compare == 1:
-        data_compare_node, data_compare_edge, data_compare_answer = aggregate(data_compare, max_routes, max_visible_answers)
-
-
-        #add compare data to original data   
-        
-        #merge data with compare_data
-        data_node = pd.merge(data_node, data_compare_node[['action','conversion_rate','users','duration_median','duration_mean','percent_of_total']], on='action', how='left', suffixes =('','_compare')) #add nodes compare data
-        data_edge = pd.merge(data_edge, data_compare_edge[['action','action_next','edge_count']], on=['action','action_next'], how='left', suffixes =('','_compare')) #add edge compare data
-        data_answer  = pd.merge(data_answer, data_compare_answer[['action','answer','answer_percent']], on=['action','answer'], how='left', suffixes =('','_compare')) #add edge compare data
-        
-        #calculate increase/decrease percentages for nodes
-        metrics = ['conversion_rate','duration_median','duration_mean','percent_of_total','users']
-        for metric in metrics:
-            data_node[metric+'_change'] = data_node[metric]/data_node[metric+'_compare'] - 1
-
-        #calculate increase/decrease percentages for answers
-        data_answer['answer_percent_change'] = data_answer['answer_percent']/data_answer['answer_percent_compare'] - 1
-
-        #calculate increase/decrease percentages for edges
-        data_edge['edge_count_change'] = data_edge['edge_count']/data_edge['edge_count_compare'] - 1
-        
-        #add nodes that were present in comparison data but not in original data
-        nodes_only_in_comparison = data_compare_node[~data_compare_node['action'].isin(data_node['action'])]
-        nodes_only_in_comparison = nodes_only_in_comparison[['action']]
-        nodes_only_in_comparison[['users', 'percent_of_total']] = 0
-        nodes_only_in_comparison[['conversion_rate', 'duration_median', 'duration_mean',
-        'conversion_rate_change', 'duration_median_change', 'duration_mean_change']] = np.nan
-        nodes_only_in_comparison[['users_change', 'percent_of_total_change']] = -1
-        data_node = pd.concat([data_node, nodes_only_in_comparison])
-
-        #add edges that were present in comparison data but not in original data
-        edges_only_in_comparison = data_compare_edge.merge(data_edge, on=['action','action_next'], how='left', indicator=True)
-        edges_only_in_comparison = edges_only_in_comparison[edges_only_in_comparison['_merge'] == 'left_only'].drop(columns=['_merge'])
-        edges_only_in_comparison = edges_only_in_comparison[['action', 'action_next']]
-        edges_only_in_comparison['edge_count'] = 0
-        edges_only_in_comparison['edge_count_change'] = -1
-        data_edge = pd.concat([data_edge, edges_only_in_comparison])
-
-
-    metrics = st.sidebar.pills('Metrics to show', ['users','conversion-rate','percent-of-total','duration-median', 'duration-mean'], selection_mode = 'multi', 
+        #metrics of every comparison file and their change are added as columns, the graph shows the first one
+        aggregates = [(data_node, data_edge, data_answer)]
+        for k, compare_file in enumerate(compare_files):
+            aggregates.append(profile_stage(profile, 'aggregate compare_' + str(k + 1), lambda: cached_aggregate(compare_file, first_actions_filter, goals, max_routes, max_visible_answers)))
+        with stage(profile, 'compare', sum(count_rows(*aggregate) for aggregate in aggregates)) as record:
+            data_node, data_edge, data_answer = compare_aggregates(aggregates)
+            record['rows_out'] = count_rows(data_node, data_edge, data_answer)
+
+
+    metrics = st.sidebar.pills('Metrics to show', ['users','conversion-rate','percent-of-total','duration-median', 'duration-p90', 'duration-p99', 'duration-mean'], selection_mode = 'multi', 
     default = ['users','conversion-rate','percent-of-total','duration-median'], format_func = lambda option: metric_lookup[option])
     
     show_drop = st.sidebar.checkbox("Show drops", value = True)
@@ -195,33 +248,46 @@ if csv_file is not None:
             html += ');"> &nbsp;</div>'
 
             st.sidebar.html(html)
-            gradient_metric = st.sidebar.selectbox('Metric', ('conversion-rate', 'duration-median', 'duration-mean', 'percent-of-total', 'users'), format_func = lambda option: metric_lookup[option] )
+            gradient_metric = st.sidebar.selectbox('Metric', ('conversion-rate', 'duration-median', 'duration-p90', 'duration-p99', 'duration-mean', 'percent-of-total', 'users'), format_func = lambda option: metric_lookup[option] )
       
-    # Draw chart and load it into sttreamlit //////////////////////////////////////
-    draw(data_node, data_edge, data_answer, goals, min_edge_count, max_edge_width, general_file_name, show_drop, show_answer, max_visible_answers , ['svg','pdf'], gradient, gradient_metric, metrics = metrics)
-    st.image(general_file_name+'.svg',width=1000)
+    # Draw chart in memory and load it into sttreamlit, sessions do not share files //////////////////////////////////////
+    # only the svg is rendered here, the pdf is made when it is downloaded
+    render_key = (file_hash(csv_file), tuple(file_hash(compare_file) for compare_file in compare_files), frozenset(first_actions_filter), frozenset(goals),
+                  max_routes, show_drop, show_answer, max_visible_answers, tuple(gradient), gradient_metric, tuple(metrics))
+    draw_arguments = (data_node, data_edge, data_answer, goals, min_edge_count, max_edge_width, show_drop, show_answer, max_visible_answers)
+    draw_options = {'conditional_format_gradient': gradient, 'conditional_format_metric': gradient_metric, 'metrics': metrics}
+    svg, render_profile = render_in_background(render_key, partial(draw_to_bytes, *draw_arguments, ['svg'], **draw_options))
+    svg = svg['svg']
+    st.image(svg.decode('utf-8'),width=1000)
 
     #export part of sidebar///////////////////////////////////////////////////////////////
     st.sidebar.subheader("Export", divider="gray")
-    with open(general_file_name+'.pdf', 'rb') as file:
-        st.sidebar.download_button(
-            label='Download PDF',
-            data=file,
-            file_name=general_file_name+'.pdf',
-            mime='image/pdf',
-            icon=':material/download:',
-        )
-    write_python()
-    with open('funnelius_code.py', 'rb') as code_file:
-        st.sidebar.download_button(
-            label='Download Python Code',
-            data=code_file,
-            file_name='funnelius_code.py',
-            mime='text/x-python',
-            icon=':material/download:',
-        )
+    st.sidebar.download_button(
+        label='Download PDF',
+        data=partial(render_pdf, *draw_arguments, ['pdf'], **draw_options),
+        file_name=general_file_name+'.pdf',
+        mime='image/pdf',
+        icon=':material/download:',
+    )
+    st.sidebar.download_button(
+        label='Download Python Code',
+        data=write_python(),
+        file_name='funnelius_code.py',
+        mime='text/x-python',
+        icon=':material/download:',
+    )
+
+    # performance panel, graph stages are the ones of the render on screen ///////////////////////////////////////////
+    with st.sidebar.expander('Performance'):
+        timings = pd.concat([profile.to_frame(), render_profile.to_frame()], ignore_index=True)
+        st.dataframe(timings, hide_index=True, column_config={
+            'seconds': st.column_config.NumberColumn(format='%.3f'),
+            'peak_memory_mb': st.column_config.NumberColumn('peak MB', format='%.1f'),
+        })
+        st.caption('Total ' + format(timings['seconds'].sum(), '.3f') + ' s. Cached stages were reused from an earlier run, deferred stages only built '
+                   'a lazy query that runs in the aggregate stage, peak memory is process wide.')
 
 else:
-    st.info('Please load a csv file from left sidebar.', icon="ℹ️")
+    st.info('Please load a csv, parquet or arrow file from left sidebar.', icon="ℹ️")
 
 
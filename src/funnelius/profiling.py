@@ -0,0 +1,119 @@
+import logging
+import mmap
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+import polars as pl
+
+logger = logging.getLogger('funnelius.profile')
+
+#fields of a stage record. bytes_out is the dot source size or the size of a graphviz output, cached marks stages
+#whose result came from the layout or render cache. deferred marks stages that only built a lazy query, their work
+#is timed in the stage that collects it
+record_fields = ['stage', 'seconds', 'peak_memory_mb', 'rows_in', 'rows_out', 'bytes_out', 'cached', 'deferred']
+
+#memory is read from /proc, so it is only measured on linux. the helpers return None elsewhere
+def current_memory_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * mmap.PAGESIZE / 1024 ** 2
+    except OSError:
+        return None
+
+def peak_memory_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+#stages being measured in this process. the high water mark is process wide, so it is only reset when no other stage
+#is measuring, a reset would otherwise hide the peak of a stage that is still running in another thread
+active_stages = 0
+active_stages_lock = threading.Lock()
+
+def reset_peak_memory():
+    # linux lets a process reset its own high water mark, elsewhere memory is not recorded
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+def memory_growth_mb(memory_before):
+    # peak memory added since reset_peak_memory() was called with memory_before in use, None when it is not measured
+    peak = peak_memory_mb()
+    if peak is None or memory_before is None:
+        return None
+    return round(max(peak - memory_before, 0.0), 1)
+
+def count_rows(*frames):
+    # rows of eager frames, lazy frames are not counted because that would run their query
+    if any(not isinstance(frame, (pd.DataFrame, pl.DataFrame)) for frame in frames):
+        return None
+    return sum(len(frame) for frame in frames)
+
+def is_deferred(frame):
+    # polars lazy frames and duckdb relations are queries that run when they are collected
+    return isinstance(frame, pl.LazyFrame) or type(frame).__name__ == 'DuckDBPyRelation'
+
+class Profile:
+    # collects the stage records of render calls: render(df, profile=Profile()) then profile.to_frame()
+    def __init__(self):
+        self.records = []
+
+    def __call__(self, record):
+        self.records.append(record)
+
+    def to_frame(self):
+        frame = pd.DataFrame(self.records, columns=record_fields)
+        return frame.astype({'rows_in': 'Int64', 'rows_out': 'Int64', 'bytes_out': 'Int64'})
+
+    def total_seconds(self):
+        return sum(record['seconds'] for record in self.records)
+
+    def __repr__(self):
+        return self.to_frame().to_string(index=False)
+
+def log_record(record):
+    # profile=True sends every stage to the funnelius.profile logger, the record is attached for structured handlers
+    logger.info('%s %.3fs peak %s MB rows %s -> %s%s', record['stage'], record['seconds'], record['peak_memory_mb'],
+                record['rows_in'], record['rows_out'], ' deferred' if record['deferred'] else '', extra={'funnelius_profile': record})
+
+def profiler(profile):
+    # the callable receiving stage records: None when profiling is off, the logger for profile=True, or the callback
+    if profile is None or profile is False:
+        return None
+    if profile is True:
+        return log_record
+    return profile
+
+@contextmanager
+def stage(profile, name, rows_in=None):
+    # measures the wall time and peak memory growth of the enclosed block. the block may set rows_out, bytes_out and
+    # cached on the yielded record. peak memory is process wide, so concurrent renders show up in each other's stages
+    global active_stages
+    record = dict.fromkeys(record_fields)
+    record.update(stage=name, rows_in=rows_in)
+    if profile is None:
+        yield record
+        return
+    with active_stages_lock:
+        if active_stages == 0:
+            reset_peak_memory()
+        active_stages += 1
+    try:
+        memory_before = current_memory_mb()
+        started = time.perf_counter()
+        yield record
+        record['seconds'] = time.perf_counter() - started
+        record['peak_memory_mb'] = memory_growth_mb(memory_before)
+    finally:
+        with active_stages_lock:
+            active_stages -= 1
+    profile(record)
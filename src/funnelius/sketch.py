@@ -0,0 +1,111 @@
+import math
+from collections import Counter
+
+import numpy as np
+import polars as pl
+
+#values at or below min_value are counted in one zero bucket, the logarithm of 0 is not defined
+min_value = 1e-9
+zero_bucket = -2 ** 62
+
+def gamma(relative_accuracy):
+    return (1 + relative_accuracy) / (1 - relative_accuracy)
+
+def bucket_index(values, relative_accuracy):
+    # logarithmic bucket of every value, a bucket covers (gamma ** (k - 1), gamma ** k]
+    values = np.asarray(values, dtype=float)
+    positive = values > min_value
+    indexes = np.full(len(values), zero_bucket, dtype='int64')
+    indexes[positive] = np.ceil(np.log(values[positive]) / math.log(gamma(relative_accuracy)))
+    return indexes
+
+def bucket_value(indexes, relative_accuracy):
+    # the value every bucket stands for, within relative_accuracy of all values in the bucket
+    indexes = np.asarray(indexes, dtype='int64')
+    values = np.zeros(len(indexes))
+    nonzero = indexes != zero_bucket
+    g = gamma(relative_accuracy)
+    values[nonzero] = 2 * np.power(g, indexes[nonzero].astype(float)) / (g + 1)
+    return values
+
+def bucket_index_pl(value, relative_accuracy):
+    # polars expression version of bucket_index
+    return (
+        pl.when(value > min_value)
+        .then((value.log() / math.log(gamma(relative_accuracy))).ceil().cast(pl.Int64))
+        .otherwise(pl.lit(zero_bucket, dtype=pl.Int64))
+    )
+
+def bucket_index_sql(value, relative_accuracy):
+    # sql expression version of bucket_index, value is a column name or expression
+    return ('CASE WHEN ' + value + ' > ' + repr(min_value) + ' THEN CAST(ceil(ln(' + value + ') / ' + repr(math.log(gamma(relative_accuracy)))
+            + ') AS BIGINT) ELSE ' + str(zero_bucket) + ' END')
+
+def bucket_value_pl(index, relative_accuracy):
+    g = gamma(relative_accuracy)
+    return pl.when(index == zero_bucket).then(0.0).otherwise(2 * pl.lit(g).pow(index.cast(pl.Float64)) / (g + 1))
+
+def grouped_quantiles(codes, indexes, counts, num_groups, quantile, relative_accuracy):
+    # quantile of every group from (group code, bucket, count) rows. like pandas, the value between two ranks is
+    # interpolated linearly, so the median of an even count is the mean of the two middle values
+    codes = np.asarray(codes, dtype='int64')
+    indexes = np.asarray(indexes, dtype='int64')
+    counts = np.asarray(counts, dtype='int64')
+    order = np.lexsort((indexes, codes))
+    codes, indexes, counts = codes[order], indexes[order], counts[order]
+
+    totals = np.bincount(codes, weights=counts, minlength=num_groups).astype('int64')
+    cumulative = np.cumsum(counts)
+    group_start = np.cumsum(totals) - totals
+    rank = (totals - 1) * quantile
+    lower = np.searchsorted(cumulative, group_start + np.floor(rank), side='right')
+    upper = np.searchsorted(cumulative, group_start + np.ceil(rank), side='right')
+
+    quantiles = np.full(num_groups, np.nan)
+    has_values = totals > 0
+    lower_values = bucket_value(indexes[lower[has_values]], relative_accuracy)
+    upper_values = bucket_value(indexes[upper[has_values]], relative_accuracy)
+    fraction = rank[has_values] - np.floor(rank[has_values])
+    quantiles[has_values] = lower_values + (upper_values - lower_values) * fraction
+    return quantiles
+
+def sketch_quantile_pl(quantile, relative_accuracy):
+    # aggregation expression for a group of (bucket, count) rows sorted by bucket
+    total = pl.col('count').sum()
+    rank = (total - 1) * quantile
+    cumulative = pl.col('count').cum_sum()
+    lower = bucket_value_pl(pl.col('bucket').filter(cumulative > rank.floor()).first(), relative_accuracy)
+    upper = bucket_value_pl(pl.col('bucket').filter(cumulative > rank.ceil()).first(), relative_accuracy)
+    return lower + (upper - lower) * (rank - rank.floor())
+
+class DDSketch:
+    # quantile sketch with a relative error bound (DDSketch, Masson et al. 2019). values are counted in
+    # logarithmic buckets, so memory grows with the log of the value range and sketches merge by adding counts.
+    def __init__(self, relative_accuracy=0.01):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError('relative_accuracy should be between 0 and 1')
+        self.relative_accuracy = relative_accuracy
+        self.buckets = Counter()
+        self.count = 0
+
+    def add(self, value, count=1):
+        if value > min_value:
+            index = math.ceil(math.log(value) / math.log(gamma(self.relative_accuracy)))
+        else:
+            index = zero_bucket
+        self.buckets[index] += count
+        self.count += count
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError('sketches with different relative accuracy can not be merged')
+        self.buckets.update(other.buckets)
+        self.count += other.count
+        return self
+
+    def quantile(self, quantile):
+        if self.count == 0:
+            return np.nan
+        indexes = np.fromiter(self.buckets.keys(), dtype='int64', count=len(self.buckets))
+        counts = np.fromiter(self.buckets.values(), dtype='int64', count=len(self.buckets))
+        return grouped_quantiles(np.zeros(len(indexes), dtype='int64'), indexes, counts, 1, quantile, self.relative_accuracy)[0]
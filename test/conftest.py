@@ -0,0 +1,55 @@
+import os
+
+import graphviz
+import pandas as pd
+import polars as pl
+import pytest
+
+from funnelius.functions import polars_to_pandas
+
+sample_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sample_data_vehicle.csv')
+
+@pytest.fixture
+def events():
+    return pd.read_csv(sample_path)
+
+def sorted_frame(df):
+    #polars group-by output is unordered, frames are compared as pandas sorted by their key columns
+    if isinstance(df, (pl.DataFrame, pl.LazyFrame)):
+        df = polars_to_pandas(df.lazy().collect())
+    #polars start rows carry a '-' answer that pandas leaves empty, answers of start are not compared
+    if 'answer_count' in df.columns:
+        df = df[df['action'] != 'Start']
+    keys = [column for column in ['action', 'action_next', 'answer'] if column in df.columns]
+    return df.sort_values(keys).reset_index(drop=True)
+
+goals = ['data_posted']
+
+@pytest.fixture
+def tied_events():
+    # two routes with two users each and one route with one user, the tied routes are written in both orders
+    journeys = {
+        'a1': ['intro', 'make', 'data_posted'], 'a2': ['intro', 'make', 'data_posted'],
+        'b1': ['intro', 'year', 'data_posted'], 'b2': ['intro', 'year', 'data_posted'],
+        'c1': ['intro'],
+    }
+    rows = []
+    for user_id, actions in journeys.items():
+        for step, action in enumerate(actions):
+            rows.append((user_id, action, pd.Timestamp('2025-01-01') + pd.Timedelta(minutes=step), 'x'))
+    return pd.DataFrame(rows, columns=['user_id', 'action', 'action_start', 'answer'])
+
+def assert_aggregates_equal(left, right):
+    for left_frame, right_frame in zip(left, right):
+        pd.testing.assert_frame_equal(sorted_frame(left_frame), sorted_frame(right_frame), check_dtype=False)
+
+@pytest.fixture
+def fake_graphviz(monkeypatch, tmp_path):
+    # graphviz output without the dot binary: the layout is empty and every format holds the dot source. the render
+    # cache is kept in a temporary directory and the layout cache starts empty
+    from funnelius import functions
+    from funnelius.cache import DiskCache
+    monkeypatch.setattr(graphviz.Digraph, 'pipe', lambda self, format=None, **kwargs: b'{"objects": []}' if format == 'json' else self.source.encode())
+    monkeypatch.setattr(functions, 'render_cache', DiskCache(str(tmp_path / 'render')))
+    functions.layout_cache.clear()
+    return functions
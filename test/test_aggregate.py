@@ -0,0 +1,47 @@
+import polars as pl
+import pytest
+
+from funnelius.functions import transform, apply_filter, aggregate, collect_frames
+from conftest import goals, assert_aggregates_equal
+
+def batch_aggregates(df, max_path_num, first_actions_filter=[]):
+    data = transform(df)[0]
+    data, route_num = apply_filter(data, first_actions_filter, goals)
+    #same route number as render, a lazy query does not know its route number before it is collected
+    if max_path_num > 0:
+        route_num = max_path_num if route_num is None else min(route_num, max_path_num)
+    return collect_frames(*aggregate(data, route_num, 5))
+
+@pytest.mark.parametrize('max_path_num', [0, 1, 4, 12, 16])
+def test_pandas_polars_aggregates(events, max_path_num):
+    assert_aggregates_equal(batch_aggregates(pl.from_pandas(events), max_path_num), batch_aggregates(events, max_path_num))
+
+def test_pandas_polars_first_actions_filter(events):
+    expected = batch_aggregates(events, 5, ['postal_code'])
+    assert_aggregates_equal(batch_aggregates(pl.from_pandas(events), 5, ['postal_code']), expected)
+
+def test_drop_nodes(events):
+    #every drop node holds the users whose journey stops at its action without reaching a goal
+    node_data, edge_data, __v1 = batch_aggregates(events, 0)
+    drops = node_data[node_data['is_drop']].set_index('action')['users']
+    drop_edges = edge_data[edge_data['is_drop']].set_index('action_next')['edge_count']
+    assert len(drops) > 0
+    assert drops.sort_index().tolist() == drop_edges.sort_index().tolist()
+    assert all(action.startswith('Funnelius-Drop') for action in drops.index)
+    assert not node_data.loc[~node_data['is_drop'], 'action'].str.startswith('Funnelius-Drop').any()
+
+@pytest.mark.parametrize('max_path_num', [0, 4, 12])
+def test_lazy_polars_aggregates(events, max_path_num):
+    data = transform(pl.from_pandas(events).lazy())[0]
+    assert isinstance(data, pl.LazyFrame)
+    assert_aggregates_equal(batch_aggregates(pl.from_pandas(events).lazy(), max_path_num), batch_aggregates(events, max_path_num))
+
+def test_path_aggregates(events, tmp_path):
+    #csv and parquet paths are scanned as one lazy query
+    csv_path = str(tmp_path / 'events.csv')
+    parquet_path = str(tmp_path / 'events.parquet')
+    events.to_csv(csv_path, index=False)
+    pl.from_pandas(events).with_columns(pl.col('action_start').str.to_datetime()).write_parquet(parquet_path)
+    expected = batch_aggregates(events, 8)
+    for path in [csv_path, parquet_path]:
+        assert_aggregates_equal(batch_aggregates(path, 8), expected)
@@ -0,0 +1,36 @@
+import pandas as pd
+import polars as pl
+import pytest
+
+from funnelius.functions import transform, apply_filter, aggregate, collect_frames, polars_to_pandas
+from conftest import goals, assert_aggregates_equal
+
+def user_routes(df, first_actions_filter=[]):
+    data, route_num = apply_filter(transform(df)[0], first_actions_filter, goals)
+    if isinstance(data, pl.DataFrame):
+        data = polars_to_pandas(data)
+    starts = data[data['action_order'] == 0]
+    return starts.set_index('user_id')['route_order'].sort_index(), route_num
+
+@pytest.mark.parametrize('first_actions_filter', [[], ['postal_code']])
+def test_pandas_polars_route_order(events, first_actions_filter):
+    #the sample data has routes with the same number of users, they get the same rank on both backends
+    expected, expected_route_num = user_routes(events, first_actions_filter)
+    route_order, route_num = user_routes(pl.from_pandas(events), first_actions_filter)
+    assert route_num == expected_route_num
+    pd.testing.assert_series_equal(route_order, expected, check_dtype=False)
+
+def test_routes_ranked_by_users(events):
+    route_order = user_routes(events)[0]
+    users = route_order.value_counts().sort_index()
+    assert users.is_monotonic_decreasing
+
+def test_tied_routes_keep_the_same_route(tied_events):
+    #routes with the same number of users are ranked by their actions, not by where they appear in the input
+    data, __v1 = apply_filter(transform(tied_events)[0], [], goals)
+    expected = collect_frames(*aggregate(data, 1, 5))
+    assert set(expected[0]['action']) == {'Start', 'intro', 'make', 'data_posted', 'End'}
+    reversed_events = tied_events.iloc[::-1].reset_index(drop=True)
+    for df in [reversed_events, pl.from_pandas(reversed_events)]:
+        data, __v1 = apply_filter(transform(df)[0], [], goals)
+        assert_aggregates_equal(collect_frames(*aggregate(data, 1, 5)), expected)
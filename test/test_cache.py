@@ -0,0 +1,55 @@
+import os
+import stat
+
+from funnelius.cache import DiskCache, user_cache_directory
+
+def test_hit_and_miss(tmp_path):
+    cache = DiskCache(str(tmp_path / 'render'))
+    calls = []
+    compute = lambda: calls.append(1) or b'svg'
+    assert cache.get('a', compute) == b'svg'
+    assert cache.get('a', compute) == b'svg'
+    assert len(calls) == 1
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+def test_directory_is_private(tmp_path):
+    cache = DiskCache(str(tmp_path / 'render'))
+    cache.get('a', lambda: b'svg')
+    assert stat.S_IMODE(os.stat(cache.directory).st_mode) == 0o700
+
+def test_least_recently_used_files_are_evicted(tmp_path):
+    cache = DiskCache(str(tmp_path / 'render'), max_bytes=25)
+    for age, key in enumerate(['old', 'used', 'new']):
+        cache.get(key, lambda: b'0123456789')
+        #modification times record use, they are spread out so the order does not depend on timer resolution
+        os.utime(cache.path(key), (1000 + age, 1000 + age))
+    cache.get('used', lambda: b'')
+    cache.get('newest', lambda: b'0123456789')
+    assert sorted(os.listdir(cache.directory)) == ['newest', 'used']
+
+def test_entries_larger_than_the_cache_are_not_stored(tmp_path):
+    cache = DiskCache(str(tmp_path / 'render'), max_bytes=4)
+    assert cache.get('a', lambda: b'0123456789') == b'0123456789'
+    assert not os.path.exists(cache.path('a'))
+
+def test_failed_write_leaves_no_entry(tmp_path, monkeypatch):
+    #an entry is renamed into place, a write that fails before the rename leaves neither the entry nor a temporary file
+    cache = DiskCache(str(tmp_path / 'render'))
+    def fail(source, target):
+        raise OSError('disk full')
+    monkeypatch.setattr(os, 'replace', fail)
+    assert cache.get('a', lambda: b'svg') == b'svg'
+    assert os.listdir(cache.directory) == []
+
+def test_unwritable_directory_renders_uncached(tmp_path):
+    #the cache directory is a file, so nothing can be stored and every get computes
+    blocked = tmp_path / 'blocked'
+    blocked.write_bytes(b'')
+    cache = DiskCache(str(blocked / 'render'))
+    assert cache.get('a', lambda: b'svg') == b'svg'
+    assert cache.get('a', lambda: b'svg') == b'svg'
+    assert cache.stats()['misses'] == 2
+
+def test_user_cache_directory(monkeypatch, tmp_path):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+    assert user_cache_directory('render') == os.path.join(str(tmp_path), 'funnelius', 'render')
@@ -0,0 +1,49 @@
+import pandas as pd
+import pytest
+
+from funnelius.functions import transform, apply_filter, aggregate, render
+from conftest import goals, sorted_frame, assert_aggregates_equal
+from test_aggregate import batch_aggregates
+
+def compact_aggregates(df, max_path_num, first_actions_filter=[]):
+    data = transform(df, compact=True)[0]
+    data, route_num = apply_filter(data, first_actions_filter, goals)
+    if max_path_num > 0:
+        route_num = min(route_num, max_path_num)
+    return aggregate(data, route_num, 5)
+
+def test_compact_transform_dtypes(events):
+    data, first_actions, all_actions = transform(events.assign(extra=1), compact=True)
+    assert 'extra' not in data.columns
+    assert data['user_id'].dtype == 'int32'
+    assert data['action_order'].dtype == 'int32'
+    assert data['duration'].dtype == 'float32'
+    for column in ['action', 'first_action', 'action_next']:
+        assert isinstance(data[column].dtype, pd.CategoricalDtype)
+    #one action dictionary, Start, End and the drop labels are codes too
+    categories = data['action'].cat.categories
+    assert data['action_next'].cat.categories.equals(categories)
+    assert {'Start', 'End', 'Funnelius-Drop' + first_actions[0]} <= set(categories)
+    assert sorted(map(str, all_actions)) == sorted(map(str, transform(events)[2]))
+
+def test_compact_transform_uses_less_memory(events):
+    default = transform(events)[0].memory_usage(deep=True).sum()
+    compact = transform(events, compact=True)[0].memory_usage(deep=True).sum()
+    assert compact < default / 2
+
+@pytest.mark.parametrize('max_path_num', [0, 3, 8])
+def test_compact_aggregates_match_default(events, max_path_num):
+    compact = compact_aggregates(events, max_path_num)
+    for table in compact:
+        for column in table.columns:
+            assert not isinstance(table[column].dtype, pd.CategoricalDtype)
+    assert_aggregates_equal(compact, batch_aggregates(events, max_path_num))
+
+def test_compact_aggregates_with_first_action_filter(events):
+    first_action = events.sort_values('action_start').groupby('user_id')['action'].first().mode()[0]
+    assert_aggregates_equal(compact_aggregates(events, 3, [first_action]), batch_aggregates(events, 3, [first_action]))
+
+def test_compact_render_matches_default(events, fake_graphviz):
+    default = render(events, goals=goals, output='bytes', export_formats=['svg'])
+    compact = render(events, goals=goals, output='bytes', export_formats=['svg'], compact=True)
+    assert compact == default
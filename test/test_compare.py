@@ -0,0 +1,82 @@
+import pandas as pd
+import polars as pl
+import pytest
+
+from funnelius import Engine
+from funnelius.functions import dataset_aggregates, compare_aggregates, render
+from conftest import goals, sorted_frame, assert_aggregates_equal
+from test_aggregate import batch_aggregates
+
+@pytest.fixture
+def datasets(events):
+    #two halves of the users, all users again, and a dataset where the year question is renamed
+    users = events['user_id'].unique()
+    first_half = events[events['user_id'].isin(users[::2])]
+    renamed = first_half.assign(action=first_half['action'].replace('year', 'model_year'))
+    return [events[events['user_id'].isin(users[1::2])], first_half, events, renamed]
+
+def as_backend(frames, backend):
+    return [frame if backend == 'pandas' else pl.from_pandas(frame) for frame in frames]
+
+@pytest.mark.parametrize('backend', ['pandas', 'polars'])
+@pytest.mark.parametrize('max_path_num', [0, 3, 8])
+def test_dataset_aggregates_match_separate_runs(datasets, backend, max_path_num):
+    aggregates = dataset_aggregates(as_backend(datasets, backend), [], goals, max_path_num, 5, 0.01)
+    assert len(aggregates) == len(datasets)
+    for aggregate, frame in zip(aggregates, datasets):
+        assert_aggregates_equal(aggregate, batch_aggregates(frame, max_path_num))
+
+def test_dataset_aggregates_first_actions_filter(datasets):
+    aggregates = dataset_aggregates(datasets, ['postal_code'], goals, 3, 5, 0.01)
+    for aggregate, frame in zip(aggregates, datasets):
+        assert_aggregates_equal(aggregate, batch_aggregates(frame, 3, ['postal_code']))
+
+def test_dataset_aggregates_duckdb_fallback(datasets):
+    pytest.importorskip('duckdb')
+    engine = Engine('duckdb')
+    aggregates = dataset_aggregates([engine.to_backend(frame) for frame in datasets], [], goals, 3, 5, 0.01)
+    for aggregate, frame in zip(aggregates, datasets):
+        assert_aggregates_equal(aggregate, batch_aggregates(frame, 3))
+
+@pytest.mark.parametrize('backend', ['pandas', 'polars'])
+def test_compare_aggregates_columns(datasets, backend):
+    aggregates = [batch_aggregates(frame, 0) for frame in as_backend(datasets, backend)]
+    node_data, edge_data, answer_data = [sorted_frame(table) for table in compare_aggregates(aggregates)]
+    for suffix in ['', '_2', '_3']:
+        assert 'users_compare' + suffix in node_data.columns and 'users_change' + suffix in node_data.columns
+        assert 'edge_count_compare' + suffix in edge_data.columns
+        assert 'answer_percent_compare' + suffix in answer_data.columns
+    assert 'users_compare_4' not in node_data.columns
+
+    #the first dataset keeps its own metrics, every comparison carries the metrics of its own run
+    for k, frame in enumerate(datasets[1:], 1):
+        suffix = '' if k == 1 else '_' + str(k)
+        expected = sorted_frame(batch_aggregates(frame, 0)[0]).set_index('action')['users']
+        compared = node_data.set_index('action')['users_compare' + suffix].dropna()
+        pd.testing.assert_series_equal(compared.sort_index(), expected.sort_index().astype(compared.dtype), check_names=False)
+        changes = node_data['users'] / node_data['users_compare' + suffix] - 1
+        pd.testing.assert_series_equal(node_data['users_change' + suffix], changes, check_names=False)
+    expected = sorted_frame(batch_aggregates(datasets[0], 0)[0]).set_index('action')['users']
+    assert (node_data.set_index('action')['users'].loc[expected.index] == expected).all()
+
+def test_compare_only_nodes_and_edges(datasets):
+    node_data, edge_data, __v1 = compare_aggregates([batch_aggregates(frame, 0) for frame in datasets])
+    model_year = node_data[node_data['action'] == 'model_year'].iloc[0]
+    assert model_year['users'] == 0 and model_year['users_compare_3'] > 0
+    assert pd.isna(model_year['users_compare'])
+    model_year_edges = edge_data[edge_data['action_next'] == 'model_year']
+    assert len(model_year_edges) > 0
+    assert (model_year_edges['edge_count'] == 0).all() and (model_year_edges['edge_count_compare_3'] > 0).all()
+    #answers are only shown for the first dataset's rows
+    answers = compare_aggregates([batch_aggregates(frame, 0) for frame in datasets])[2]
+    assert 'model_year' not in answers['action'].tolist()
+
+@pytest.mark.parametrize('backend', ['pandas', 'polars'])
+def test_render_with_comparison_list(datasets, fake_graphviz, backend):
+    df, *comparisons = as_backend(datasets, backend)
+    single = render(df, goals=goals, max_path_num=3, comparison_df=comparisons[0], output='bytes', export_formats=['svg'])
+    listed = render(df, goals=goals, max_path_num=3, comparison_df=comparisons[:1], output='bytes', export_formats=['svg'])
+    assert sorted(single['svg'].splitlines()) == sorted(listed['svg'].splitlines())
+    engine = Engine(backend)
+    outputs = engine.render(df, goals=goals, max_path_num=3, comparison_df=comparisons, output='bytes', export_formats=['svg'])
+    assert b'model_year' in outputs['svg']
@@ -0,0 +1,60 @@
+import os
+
+import polars as pl
+import pytest
+
+from funnelius.functions import transform, apply_filter, aggregate, draw_to_bytes, render
+from conftest import goals
+
+def funnel_frames(df):
+    data, route_num = apply_filter(transform(df)[0], [], goals)
+    return aggregate(data, route_num, 5)
+
+def without_drop_flag(frame):
+    return frame.drop('is_drop') if isinstance(frame, pl.DataFrame) else frame.drop(columns='is_drop')
+
+def svg(node_data, edge_data, answer_data, **options):
+    return draw_to_bytes(node_data, edge_data, answer_data, goals, 0, 20, True, True, 5, ['svg'], **options)['svg']
+
+@pytest.mark.parametrize('backend', ['pandas', 'polars'])
+def test_draw_without_is_drop(events, fake_graphviz, backend):
+    #frames without is_drop, like the ones of earlier versions, draw the same graph
+    node_data, edge_data, answer_data = funnel_frames(events if backend == 'pandas' else pl.from_pandas(events))
+    expected = svg(node_data, edge_data, answer_data)
+    assert b'Funnelius-Drop' in expected
+    assert svg(without_drop_flag(node_data), without_drop_flag(edge_data), answer_data) == expected
+
+def test_layout_reused_for_the_same_labels(events, fake_graphviz):
+    node_data, edge_data, answer_data = funnel_frames(events)
+    misses = fake_graphviz.layout_cache.misses
+    svg(node_data, edge_data, answer_data)
+    svg(node_data, edge_data, answer_data, conditional_format_gradient=['#000', '#fff', '#0f0'])
+    assert fake_graphviz.layout_cache.misses == misses + 1
+
+def test_changed_labels_miss_the_layout_cache(events, fake_graphviz):
+    node_data, edge_data, answer_data = funnel_frames(events)
+    svg(node_data, edge_data, answer_data)
+    misses = fake_graphviz.layout_cache.misses
+
+    #answers of the same length with other letters, and the same graph without answers
+    svg(node_data, edge_data, answer_data.assign(answer=answer_data['answer'].str.swapcase()))
+    assert fake_graphviz.layout_cache.misses == misses + 1
+    draw_to_bytes(node_data, edge_data, answer_data, goals, 0, 20, True, False, 5, ['svg'])
+    assert fake_graphviz.layout_cache.misses == misses + 2
+
+def test_bytes_output_writes_nothing(events, fake_graphviz, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    node_data, edge_data, answer_data = funnel_frames(events)
+    outputs = draw_to_bytes(node_data, edge_data, answer_data, goals, 0, 20, True, True, 5, ['svg', 'pdf'])
+    assert sorted(outputs) == ['pdf', 'svg'] and all(isinstance(output, bytes) for output in outputs.values())
+    outputs = render(events, goals=goals, output='bytes', export_formats=['svg'])
+    assert list(outputs) == ['svg']
+    #only the render cache directory of the fake_graphviz fixture is there
+    assert os.listdir(tmp_path) == ['render']
+
+def test_file_output(events, fake_graphviz, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    render(events, title='funnel', goals=goals, export_formats=['svg'])
+    assert (tmp_path / 'funnel.svg').read_bytes().startswith(b'digraph')
+    with pytest.raises(ValueError):
+        render(events, output='screen')
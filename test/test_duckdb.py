@@ -0,0 +1,54 @@
+import pytest
+
+from funnelius import Engine
+from funnelius.functions import transform, apply_filter, aggregate, collect_frames, render_segments, build_route_index
+from conftest import goals, sample_path, assert_aggregates_equal
+from test_aggregate import batch_aggregates
+
+duckdb = pytest.importorskip('duckdb')
+
+def duckdb_aggregates(relation, max_path_num, first_actions_filter=[]):
+    data = transform(relation)[0]
+    data, route_num = apply_filter(data, first_actions_filter, goals)
+    if max_path_num > 0:
+        route_num = max_path_num if route_num is None else min(route_num, max_path_num)
+    return collect_frames(*aggregate(data, route_num, 5))
+
+#the sample data has routes with the same number of users at the cut of 4, 12 and 16 routes
+@pytest.mark.parametrize('max_path_num', [0, 1, 4, 12, 16])
+def test_duckdb_matches_pandas(events, max_path_num):
+    relation = duckdb.connect().from_df(events)
+    assert_aggregates_equal(duckdb_aggregates(relation, max_path_num), batch_aggregates(events, max_path_num))
+
+def test_duckdb_first_actions_filter(events):
+    relation = duckdb.connect().from_df(events)
+    assert_aggregates_equal(duckdb_aggregates(relation, 5, ['postal_code']), batch_aggregates(events, 5, ['postal_code']))
+
+def test_duckdb_tied_routes(tied_events):
+    expected = batch_aggregates(tied_events, 1)
+    relation = duckdb.connect().from_df(tied_events.iloc[::-1].reset_index(drop=True))
+    assert_aggregates_equal(duckdb_aggregates(relation, 1), expected)
+
+def test_duckdb_engine(events):
+    #pandas input is loaded into the engine's database
+    engine = Engine('duckdb')
+    data = engine.apply_filter(engine.transform(events)[0], [], goals)[0]
+    assert_aggregates_equal(collect_frames(*engine.aggregate(data, 4)), batch_aggregates(events, 4))
+
+def test_duckdb_unsupported(events):
+    relation = duckdb.connect().from_df(events)
+    with pytest.raises(ValueError):
+        render_segments(relation, 'first_action', output='bytes')
+    with pytest.raises(ValueError):
+        build_route_index(relation)
+
+def test_duckdb_engine_reads_paths(events):
+    #the file is queried in place
+    engine = Engine('duckdb')
+    data = engine.apply_filter(engine.transform(sample_path)[0], [], goals)[0]
+    assert_aggregates_equal(collect_frames(*engine.aggregate(data, 4)), batch_aggregates(events, 4))
+
+def test_duckdb_render(events, fake_graphviz):
+    outputs = Engine('duckdb').render(events, goals=goals, max_path_num=4, output='bytes', export_formats=['svg'])
+    expected = Engine('pandas').render(events, goals=goals, max_path_num=4, output='bytes', export_formats=['svg'])
+    assert sorted(outputs['svg'].splitlines()) == sorted(expected['svg'].splitlines())
@@ -0,0 +1,72 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import polars as pl
+import pytest
+
+from funnelius import Engine
+from funnelius.functions import transform, apply_filter, aggregate, render
+from conftest import goals, sample_path, assert_aggregates_equal
+from test_aggregate import batch_aggregates
+
+def engine_aggregates(engine, df, max_path_num=3):
+    data = engine.transform(df)[0]
+    data, route_num = engine.apply_filter(data, [], goals)
+    return collect_if_lazy(engine.aggregate(data, min(route_num, max_path_num)))
+
+def collect_if_lazy(frames):
+    return tuple(frame.collect() if isinstance(frame, pl.LazyFrame) else frame for frame in frames)
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        Engine('spark')
+
+@pytest.mark.parametrize('backend, frame_type', [('pandas', pd.DataFrame), ('polars', pl.DataFrame)])
+def test_engine_converts_inputs(events, backend, frame_type):
+    engine = Engine(backend)
+    for df in [events, pl.from_pandas(events)]:
+        assert isinstance(engine.to_backend(df), frame_type)
+        data = engine.transform(df)[0]
+        assert isinstance(data, frame_type) or isinstance(data, pl.LazyFrame) and frame_type is pl.DataFrame
+        assert_aggregates_equal(engine_aggregates(engine, df), batch_aggregates(events, 3))
+
+def test_pandas_engine_reads_paths(events):
+    engine = Engine('pandas')
+    assert isinstance(engine.to_backend(sample_path), pd.DataFrame)
+    assert isinstance(engine.to_backend(pl.from_pandas(events).lazy()), pd.DataFrame)
+    assert_aggregates_equal(engine_aggregates(engine, sample_path), batch_aggregates(events, 3))
+
+def test_default_engine_keeps_input_type(events):
+    engine = Engine()
+    assert engine.to_backend(events) is events
+    polars_events = pl.from_pandas(events)
+    assert engine.to_backend(polars_events) is polars_events
+    assert isinstance(transform(events)[0], pd.DataFrame)
+    assert isinstance(transform(polars_events)[0], (pl.DataFrame, pl.LazyFrame))
+    data, route_num = apply_filter(transform(polars_events)[0], [], goals)
+    assert all(isinstance(frame, (pl.DataFrame, pl.LazyFrame)) for frame in aggregate(data, route_num, 5))
+
+def test_engine_defaults_apply_to_calls(events):
+    data = Engine('pandas', compact=True).transform(events)[0]
+    assert isinstance(data['action'].dtype, pd.CategoricalDtype)
+    data = Engine('pandas', compact=True).transform(events, compact=False)[0]
+    assert not isinstance(data['action'].dtype, pd.CategoricalDtype)
+
+def graph_lines(outputs):
+    #polars group-by output is unordered, so graphs are compared by their statements
+    return sorted(outputs['svg'].decode().splitlines())
+
+def test_engines_in_threads(events, fake_graphviz):
+    engines = [Engine('pandas'), Engine('polars')]
+    expected = [graph_lines(render(events, goals=goals, output='bytes', export_formats=['svg'], max_path_num=max_path_num))
+                for max_path_num in [2, 5]]
+
+    def run(job):
+        engine, max_path_num = job
+        return engine.render(events, goals=goals, output='bytes', export_formats=['svg'], max_path_num=max_path_num)
+
+    jobs = [(engine, max_path_num) for __v1 in range(4) for engine in engines for max_path_num in [2, 5]]
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(run, jobs))
+    for (__v1, max_path_num), result in zip(jobs, results):
+        assert graph_lines(result) == expected[[2, 5].index(max_path_num)]
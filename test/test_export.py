@@ -0,0 +1,56 @@
+import pandas as pd
+import polars as pl
+import pyarrow as pa
+import pytest
+
+from funnelius.functions import transform, apply_filter, aggregate, export_aggregates, aggregates_to_arrow, render
+from conftest import goals, sorted_frame
+
+def funnel_frames(df):
+    data, route_num = apply_filter(transform(df)[0], [], goals)
+    return aggregate(data, route_num, 5)
+
+def read_export(name, format, directory):
+    path = str(directory / (name + '.' + format))
+    if format == 'csv':
+        return pd.read_csv(path)
+    elif format == 'parquet':
+        return pd.read_parquet(path)
+    return pd.read_feather(path)
+
+@pytest.mark.parametrize('backend', ['pandas', 'polars'])
+@pytest.mark.parametrize('format', ['csv', 'parquet', 'arrow'])
+def test_export_round_trip(events, tmp_path, backend, format):
+    node_data, edge_data, answer_data = funnel_frames(events if backend == 'pandas' else pl.from_pandas(events))
+    export_aggregates(node_data, edge_data, answer_data, format, str(tmp_path))
+
+    expected = sorted_frame(node_data)
+    expected['action'] = expected['action'].astype(str).str.replace('Funnelius-Drop', 'Drop:', regex=False)
+    node_export = sorted_frame(read_export('node_data', format, tmp_path).astype({'action': str}))
+    pd.testing.assert_frame_equal(node_export, sorted_frame(expected), check_dtype=False, check_categorical=False)
+    edge_export = read_export('edge_data', format, tmp_path)
+    assert edge_export['edge_count'].sum() == sorted_frame(edge_data)['edge_count'].sum()
+    assert edge_export['action_next'].astype(str).str.startswith('Drop:').any()
+    answer_export = read_export('answer_data', format, tmp_path)
+    assert len(answer_export) == len(answer_data)
+
+def test_unknown_export_format(events, tmp_path):
+    with pytest.raises(ValueError):
+        export_aggregates(*funnel_frames(events), 'xlsx', str(tmp_path))
+
+@pytest.mark.parametrize('backend', ['pandas', 'polars'])
+def test_arrow_labels_are_dictionary_encoded(events, backend):
+    node_table, edge_table, answer_table = aggregates_to_arrow(*funnel_frames(events if backend == 'pandas' else pl.from_pandas(events)))
+    label_type = pa.dictionary(pa.int32(), pa.string())
+    assert node_table.schema.field('action').type == label_type
+    assert edge_table.schema.field('action').type == label_type
+    assert edge_table.schema.field('action_next').type == label_type
+    assert answer_table.schema.field('action').type == label_type
+    assert 'Drop:' in ' '.join(node_table.column('action').to_pylist())
+
+def test_export_data_with_bytes_output(events, fake_graphviz, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    outputs = render(events, goals=goals, output='bytes', export_formats=['svg'], export_data='parquet')
+    assert list(outputs) == ['svg']
+    assert len(pd.read_parquet(tmp_path / 'node_data.parquet')) > 0
+    assert (tmp_path / 'edge_data.parquet').exists() and (tmp_path / 'answer_data.parquet').exists()
@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+import polars as pl
+import pytest
+
+from funnelius import FunnelState
+from funnelius.functions import transform, apply_filter, aggregate
+from conftest import goals, assert_aggregates_equal
+
+@pytest.mark.parametrize('backend', ['pandas', 'polars'])
+@pytest.mark.parametrize('first_actions_filter', [[], ['postal_code']])
+def test_funnel_state_matches_batch(events, backend, first_actions_filter):
+    events['action_start'] = pd.to_datetime(events['action_start'])
+    df = events if backend == 'pandas' else pl.from_pandas(events)
+    data, route_num = apply_filter(transform(df)[0], first_actions_filter, goals)
+    expected = aggregate(data, route_num, 5)
+
+    #events arrive in four time slices, journeys of many users are split across slices
+    state = FunnelState(first_actions_filter=first_actions_filter, goals=goals, backend=backend)
+    starts = events['action_start'].astype('int64')
+    previous_cut = -np.inf
+    for cut in np.quantile(starts, [0.2, 0.5, 0.8, 1.0]):
+        state.update(events[(starts > previous_cut) & (starts <= cut)])
+        previous_cut = cut
+
+    assert state.route_num == route_num
+    assert_aggregates_equal(state.frames(), expected)
@@ -0,0 +1,38 @@
+import polars as pl
+import pytest
+
+from funnelius.functions import (transform, apply_filter, aggregate, collect_frames, aggregate_route_index, partitioned_route_index,
+                                 spill_partitions, polars_to_pandas)
+from conftest import goals, assert_aggregates_equal
+from test_aggregate import batch_aggregates
+
+@pytest.mark.parametrize('backend', ['pandas', 'polars'])
+def test_partitioned_matches_in_memory(events, backend):
+    df = events if backend == 'pandas' else pl.from_pandas(events)
+    route_index = partitioned_route_index(df, [], goals, 3, backend)
+    for max_path_num in [1, 4, 12, 16]:
+        assert_aggregates_equal(aggregate_route_index(route_index, max_path_num, 5), batch_aggregates(events, max_path_num))
+
+def test_spill_keeps_users_in_one_partition(events, tmp_path):
+    paths = spill_partitions(events, 4, str(tmp_path))
+    users = [set(pl.scan_ipc(path + '/*.ipc').select('user_id').collect()['user_id']) for path in paths]
+    assert sum(len(partition) for partition in users) == events['user_id'].nunique()
+    assert len(set.union(*users)) == events['user_id'].nunique()
+
+def journeys(data):
+    if isinstance(data, pl.DataFrame):
+        data = polars_to_pandas(data)
+    columns = ['user_id', 'action_order', 'action', 'action_next', 'first_action']
+    return data[columns].sort_values(['user_id', 'action_order']).reset_index(drop=True)
+
+@pytest.mark.parametrize('backend', ['pandas', 'polars'])
+def test_parallel_matches_serial(events, backend):
+    #two spawned workers, each reads its own shard
+    df = events if backend == 'pandas' else pl.from_pandas(events)
+    route_index = partitioned_route_index(df, [], goals, 2, backend, parallel=2)
+    assert_aggregates_equal(aggregate_route_index(route_index, 8, 5), batch_aggregates(events, 8))
+
+    data = transform(df, parallel=2)[0]
+    assert journeys(data).equals(journeys(transform(df)[0]))
+    data, __v1 = apply_filter(data, [], goals)
+    assert_aggregates_equal(collect_frames(*aggregate(data, 8, 5, parallel=2)), batch_aggregates(events, 8))
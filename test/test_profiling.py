@@ -0,0 +1,73 @@
+import logging
+
+import pytest
+
+from funnelius import Profile
+from funnelius import profiling
+from funnelius.profiling import stage, profiler, log_record, record_fields
+from funnelius.functions import render
+from conftest import goals, sample_path
+
+def test_render_records_every_stage(events, fake_graphviz):
+    profile = Profile()
+    render(events, goals=goals, output='bytes', export_formats=['svg'], profile=profile)
+    names = [record['stage'] for record in profile.records]
+    assert names == ['transform', 'apply_filter', 'aggregate', 'dot', 'layout', 'graphviz svg']
+    for record in profile.records:
+        assert list(record) == record_fields
+        assert record['seconds'] >= 0
+        assert not record['deferred']
+    transform_record = profile.records[0]
+    assert transform_record['rows_in'] == len(events)
+    assert transform_record['rows_out'] > len(events)
+    assert profile.records[3]['bytes_out'] > 0
+    assert profile.total_seconds() == sum(record['seconds'] for record in profile.records)
+
+def test_lazy_stages_are_deferred(fake_graphviz):
+    profile = Profile()
+    render(sample_path, goals=goals, output='bytes', export_formats=['svg'], profile=profile)
+    records = {record['stage']: record for record in profile.records}
+    assert records['transform']['deferred'] and records['apply_filter']['deferred']
+    assert records['transform']['rows_out'] is None
+    assert records['aggregate']['rows_out'] > 0
+
+def test_profile_frame(events, fake_graphviz):
+    profile = Profile()
+    render(events, goals=goals, output='bytes', export_formats=['svg'], profile=profile)
+    frame = profile.to_frame()
+    assert list(frame.columns) == record_fields
+    assert len(frame) == len(profile.records)
+    assert str(frame['rows_in'].dtype) == 'Int64' and str(frame['bytes_out'].dtype) == 'Int64'
+
+def test_profile_off(monkeypatch):
+    assert profiler(None) is None and profiler(False) is None
+    calls = []
+    monkeypatch.setattr(profiling, 'reset_peak_memory', lambda: calls.append('reset'))
+    with stage(None, 'transform', 10) as record:
+        record['rows_out'] = 5
+    assert calls == [] and record['seconds'] is None
+
+def test_profile_logger(caplog):
+    assert profiler(True) is log_record
+    with caplog.at_level(logging.INFO, logger='funnelius.profile'):
+        with stage(profiler(True), 'transform', 10) as record:
+            record['rows_out'] = 12
+    assert caplog.records[0].funnelius_profile['rows_out'] == 12
+    assert caplog.records[0].getMessage().startswith('transform ')
+
+def test_peak_memory_reset_only_without_active_stages(monkeypatch):
+    calls = []
+    monkeypatch.setattr(profiling, 'reset_peak_memory', lambda: calls.append('reset'))
+    profile = Profile()
+    with stage(profile, 'outer'):
+        with stage(profile, 'inner'):
+            pass
+    assert calls == ['reset']
+    with pytest.raises(RuntimeError):
+        with stage(profile, 'failing'):
+            raise RuntimeError
+    assert profiling.active_stages == 0
+    with stage(profile, 'next'):
+        pass
+    assert calls == ['reset', 'reset', 'reset']
+    assert [record['stage'] for record in profile.records] == ['inner', 'outer', 'next']
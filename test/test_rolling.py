@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import polars as pl
+import pytest
+
+from funnelius.functions import rolling_aggregates, rolling_funnels, render_rolling
+from conftest import goals, assert_aggregates_equal
+from test_aggregate import batch_aggregates
+
+@pytest.fixture
+def daily_events(events):
+    #the sample users spread over ten days, every journey keeps its own timing
+    users = events['user_id'].unique()
+    offsets = pd.Series(np.random.default_rng(0).integers(0, 10, len(users)), index=users)
+    action_start = pd.to_datetime(events['action_start']) + pd.to_timedelta(events['user_id'].map(offsets), unit='D')
+    return events.assign(action_start=action_start)
+
+def first_days(events):
+    return events.groupby('user_id')['action_start'].min().dt.floor('D')
+
+@pytest.mark.parametrize('backend', ['pandas', 'polars'])
+@pytest.mark.parametrize('max_path_num', [0, 3])
+def test_windows_match_direct_runs(daily_events, backend, max_path_num):
+    df = daily_events if backend == 'pandas' else pl.from_pandas(daily_events)
+    first_day = first_days(daily_events)
+    windows = list(rolling_aggregates(df, 3, goals=goals, max_path_num=max_path_num))
+    assert [window[0] for window in windows] == list(pd.date_range(first_day.min() + pd.Timedelta(days=2), first_day.max()))
+    for window_end, *aggregates in windows:
+        users = first_day[(first_day > window_end - pd.Timedelta(days=3)) & (first_day <= window_end)].index
+        assert_aggregates_equal(aggregates, batch_aggregates(daily_events[daily_events['user_id'].isin(users)], max_path_num))
+
+def test_short_data_gives_one_window(daily_events):
+    windows = list(rolling_aggregates(daily_events, 30, goals=goals))
+    assert [window[0] for window in windows] == [first_days(daily_events).max()]
+    assert_aggregates_equal(windows[0][1:], batch_aggregates(daily_events, 0))
+
+def test_rolling_funnels_backends(daily_events):
+    series = rolling_funnels(daily_events, 3, goals=goals, max_path_num=3)
+    polars_series = rolling_funnels(pl.from_pandas(daily_events), 3, goals=goals, max_path_num=3)
+    assert series['window_end'].dtype.kind == 'M'
+    assert polars_series['window_end'].dtype == pl.Datetime
+    assert list(series.columns) == polars_series.columns
+    polars_series = polars_series.to_pandas()
+    keys = ['window_end', 'action']
+    pd.testing.assert_frame_equal(series.sort_values(keys).reset_index(drop=True)[keys + ['users']],
+                                  polars_series.sort_values(keys).reset_index(drop=True)[keys + ['users']], check_dtype=False)
+    assert series['window_end'].nunique() == 8
+
+def test_render_rolling_bytes(daily_events, fake_graphviz):
+    outputs = render_rolling(daily_events, 3, goals=goals, output='bytes', export_formats=['svg'])
+    windows = list(rolling_aggregates(daily_events, 3, goals=goals))
+    assert list(outputs) == [window[0].strftime('%Y-%m-%d') for window in windows]
+    assert all(list(formats) == ['svg'] for formats in outputs.values())
+
+def test_duckdb_error_names_the_function(daily_events):
+    duckdb = pytest.importorskip('duckdb')
+    relation = duckdb.connect().from_df(daily_events)
+    with pytest.raises(ValueError, match='^rolling_funnels '):
+        rolling_funnels(relation, 3)
+    with pytest.raises(ValueError, match='^render_rolling '):
+        render_rolling(relation, 3, output='bytes')
+    with pytest.raises(ValueError, match='^rolling_aggregates '):
+        next(rolling_aggregates(relation, 3))
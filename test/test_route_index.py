@@ -0,0 +1,20 @@
+import polars as pl
+import pytest
+
+from funnelius.functions import transform, apply_filter, build_route_index, aggregate_route_index
+from conftest import goals, assert_aggregates_equal
+from test_aggregate import batch_aggregates
+
+@pytest.mark.parametrize('backend', ['pandas', 'polars'])
+@pytest.mark.parametrize('max_path_num', [1, 4, 12, 30])
+def test_route_index_matches_aggregate(events, backend, max_path_num):
+    df = events if backend == 'pandas' else pl.from_pandas(events)
+    data, route_num = apply_filter(transform(df)[0], [], goals)
+    route_index = build_route_index(data)
+    assert route_index['route_num'] == route_num
+    assert_aggregates_equal(aggregate_route_index(route_index, max_path_num, 5), batch_aggregates(df, max_path_num))
+
+def test_route_index_tied_routes(tied_events):
+    expected = batch_aggregates(tied_events, 1)
+    route_index = build_route_index(apply_filter(transform(tied_events.iloc[::-1].reset_index(drop=True))[0], [], goals)[0])
+    assert_aggregates_equal(aggregate_route_index(route_index, 1, 5), expected)
@@ -0,0 +1,41 @@
+import pandas as pd
+import polars as pl
+import pytest
+
+from funnelius.functions import scan_events, filter_date_range
+from conftest import sample_path
+
+def write_events(events, format, directory):
+    events = events.assign(action_start=pd.to_datetime(events['action_start']), extra=1)
+    path = directory / ('events.' + format)
+    if format == 'parquet':
+        events.to_parquet(path, row_group_size=100)
+    else:
+        pl.from_pandas(events).write_ipc(path)
+    return path
+
+@pytest.mark.parametrize('format', ['parquet', 'arrow'])
+def test_scan_reads_only_event_columns(events, tmp_path, format):
+    df = scan_events(write_events(events, format, tmp_path))
+    assert 'PROJECT 4/5 COLUMNS' in df.explain()
+    assert df.collect().columns == ['user_id', 'action', 'action_start', 'answer']
+
+@pytest.mark.parametrize('format', ['parquet', 'arrow'])
+@pytest.mark.parametrize('date_range', [('2025-04-27 23:44:17', None), (None, '2025-04-27 23:44:17'),
+                                        ('2025-04-27 23:44:00', '2025-04-27 23:45:00')])
+def test_scan_pushes_date_range_down(events, tmp_path, format, date_range):
+    df = scan_events(write_events(events, format, tmp_path), date_range=date_range)
+    plan = df.explain()
+    assert 'SELECTION' in plan and 'action_start' in plan.split('SELECTION')[1]
+
+    expected = filter_date_range(events.assign(action_start=pd.to_datetime(events['action_start'])), date_range)
+    assert 0 < len(expected) < len(events)
+    result = df.collect().to_pandas()
+    pd.testing.assert_frame_equal(result, expected.reset_index(drop=True), check_dtype=False)
+
+def test_scan_csv_matches_pandas_filter(events):
+    date_range = ('2025-04-27 23:44:17', None)
+    result = scan_events(sample_path, date_range=date_range).collect().to_pandas()
+    expected = filter_date_range(events, date_range)
+    assert len(result) == len(expected)
+    assert result['user_id'].tolist() == expected['user_id'].tolist()
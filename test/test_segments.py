@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import polars as pl
+import pytest
+
+from funnelius.functions import (transform, apply_filter, segment_events, route_partials, split_segment_partials, index_routes,
+                                 aggregate_route_index, user_segments_pd, frame_backend, render, render_segments)
+from conftest import goals, assert_aggregates_equal
+from test_aggregate import batch_aggregates
+
+@pytest.fixture
+def country_events(events):
+    #every user gets a country, some later events carry another one so only the earliest event decides
+    users = events['user_id'].unique()
+    country = pd.Series(np.random.default_rng(0).choice(['de', 'fr', 'nl'], len(users)), index=users)
+    events = events.assign(country=events['user_id'].map(country))
+    position = events.sort_values('action_start', kind='stable').groupby('user_id').cumcount()
+    events.loc[position[position == 2].index, 'country'] = 'xx'
+    return events
+
+def segment_aggregates(df, segment_col, max_path_num):
+    data = apply_filter(transform(df)[0], [], goals)[0]
+    data = segment_events(df, data, segment_col)
+    segments = split_segment_partials(route_partials(data, 0.01, ['__segment']))
+    results = {}
+    for segment, partials in segments.items():
+        route_index = index_routes(partials, frame_backend(data), 0.01)
+        route_num = route_index['route_num'] if max_path_num == 0 else min(route_index['route_num'], max_path_num)
+        results[segment] = aggregate_route_index(route_index, route_num, 5)
+    return results
+
+def segment_users(events, segment_col):
+    if segment_col == 'first_action':
+        return events.sort_values('action_start', kind='stable').groupby('user_id')['action'].first()
+    return user_segments_pd(events, segment_col)
+
+@pytest.mark.parametrize('backend', ['pandas', 'polars'])
+@pytest.mark.parametrize('segment_col', ['country', 'first_action'])
+@pytest.mark.parametrize('max_path_num', [0, 3])
+def test_segments_match_filtered_runs(country_events, backend, segment_col, max_path_num):
+    df = country_events if backend == 'pandas' else pl.from_pandas(country_events)
+    results = segment_aggregates(df, segment_col, max_path_num)
+    users = segment_users(country_events, segment_col)
+    assert sorted(results) == sorted(users.unique())
+    assert 'xx' not in results
+    for segment, aggregates in results.items():
+        segment_events = country_events[country_events['user_id'].isin(users[users == segment].index)]
+        assert_aggregates_equal(aggregates, batch_aggregates(segment_events, max_path_num))
+
+@pytest.mark.parametrize('backend', ['pandas', 'polars'])
+def test_render_segments_bytes(country_events, fake_graphviz, backend):
+    df = country_events if backend == 'pandas' else pl.from_pandas(country_events)
+    outputs = render_segments(df, 'country', goals=goals, max_path_num=3, output='bytes', export_formats=['svg', 'pdf'])
+    assert sorted(outputs) == ['de', 'fr', 'nl']
+    users = user_segments_pd(country_events, 'country')
+    for segment, formats in outputs.items():
+        assert sorted(formats) == ['pdf', 'svg']
+        assert all(isinstance(value, bytes) for value in formats.values())
+        segment_events = country_events[country_events['user_id'].isin(users[users == segment].index)]
+        expected = render(segment_events, goals=goals, max_path_num=3, output='bytes', export_formats=['svg'], partitions=1)
+        assert sorted(formats['svg'].splitlines()) == sorted(expected['svg'].splitlines())
+
+def test_render_segments_parallel(country_events, fake_graphviz):
+    serial = render_segments(country_events, 'first_action', goals=goals, output='bytes', export_formats=['svg'])
+    assert render_segments(country_events, 'first_action', goals=goals, output='bytes', export_formats=['svg'], parallel=2) == serial
+
+def test_render_segments_output(country_events):
+    with pytest.raises(ValueError):
+        render_segments(country_events, 'country', output='png')
@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import polars as pl
+import pytest
+
+from funnelius.sketch import DDSketch, bucket_index, bucket_index_pl, bucket_index_sql, grouped_quantiles, sketch_quantile_pl
+
+quantiles = [0.0, 0.1, 0.5, 0.9, 0.99, 1.0]
+
+def sample_values(seed=0):
+    rng = np.random.default_rng(seed)
+    return np.concatenate([rng.exponential(30, 5000), rng.lognormal(3, 2, 5000), [0.0, 0.5, 1.0, 2.0]])
+
+def sketch_of(values, relative_accuracy):
+    sketch = DDSketch(relative_accuracy)
+    for value in values:
+        sketch.add(value)
+    return sketch
+
+@pytest.mark.parametrize('relative_accuracy', [0.01, 0.05])
+def test_quantiles_within_relative_accuracy(relative_accuracy):
+    values = sample_values()
+    sketch = sketch_of(values, relative_accuracy)
+    for quantile in quantiles:
+        exact = np.quantile(values, quantile)
+        assert abs(sketch.quantile(quantile) - exact) <= relative_accuracy * exact + 1e-9
+
+def test_merge_equals_sketch_of_concatenated_values():
+    values = sample_values()
+    merged = sketch_of(values[:3000], 0.01).merge(sketch_of(values[3000:], 0.01))
+    whole = sketch_of(values, 0.01)
+    assert merged.buckets == whole.buckets and merged.count == whole.count
+    assert [merged.quantile(quantile) for quantile in quantiles] == [whole.quantile(quantile) for quantile in quantiles]
+
+def test_merge_needs_the_same_accuracy():
+    with pytest.raises(ValueError):
+        DDSketch(0.01).merge(DDSketch(0.02))
+
+def test_buckets_match_on_every_backend():
+    values = sample_values()
+    expected = bucket_index(values, 0.01)
+    polars_buckets = pl.DataFrame({'value': values}).select(bucket_index_pl(pl.col('value'), 0.01))['value'].to_numpy()
+    assert (polars_buckets == expected).all()
+    duckdb = pytest.importorskip('duckdb')
+    frame = pd.DataFrame({'value': values})
+    duckdb_buckets = duckdb.connect().from_df(frame).query('frame', 'SELECT ' + bucket_index_sql('value', 0.01) + ' FROM frame').fetchnumpy()
+    assert (next(iter(duckdb_buckets.values())) == expected).all()
+
+def test_grouped_quantiles_match_polars():
+    #two groups of (bucket, count) rows, read with numpy and with the polars aggregation expression
+    values = sample_values()
+    codes = (np.arange(len(values)) % 2).astype('int64')
+    buckets = pd.DataFrame({'code': codes, 'bucket': bucket_index(values, 0.01)}).value_counts().rename('count').reset_index()
+    for quantile in quantiles:
+        expected = grouped_quantiles(buckets['code'], buckets['bucket'], buckets['count'], 2, quantile, 0.01)
+        result = (pl.from_pandas(buckets).sort(['code', 'bucket']).group_by('code', maintain_order=True)
+                  .agg(sketch_quantile_pl(quantile, 0.01).alias('quantile')).sort('code')['quantile'].to_numpy())
+        np.testing.assert_allclose(result, expected)
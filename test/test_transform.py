@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import polars as pl
+from pandas.api.types import is_datetime64_any_dtype as is_datetime
+
+from funnelius.functions import transform, transform_pd, transform_pl
+from conftest import sorted_frame
+
+def transform_reference(df):
+    # the first pandas transform, a rank, two self merges and a row wise apply. the vectorized transform must give the same rows
+    if 'answer' not in df.columns:
+        df['answer'] = np.nan
+    if not is_datetime(df['action_start']):
+        df['action_start'] = pd.to_datetime(df['action_start'])
+    df['action_order'] = df.groupby('user_id')['action_start'].rank(method='first').astype(int)
+
+    df_first_action = df[df['action_order']==1][['user_id','action']]
+    df_first_action = df_first_action.rename(columns={'action': 'first_action'})
+    data = pd.merge(df, df_first_action, on='user_id', how='left')
+
+    data_next = data.copy()
+    data_next['action_order'] -= 1
+    data = pd.merge(data, data_next[['user_id', 'action_order', 'action', 'action_start']],
+                on=['user_id','action_order'], how='left', suffixes =('','_next'))
+    data['duration'] = data.apply( lambda row: np.nan if pd.isna(row['action_next'])
+                               else (row['action_start_next'] - row['action_start']).total_seconds(), axis =1 )
+    data = data.drop(columns=['action_start_next'])
+
+    start_rows = data.groupby('user_id').agg({'action_start': 'min', 'first_action': 'first'}).reset_index()
+    start_rows['action'] = 'Start'
+    start_rows['action_order'] = 0
+    start_rows['action_next'] = start_rows['first_action']
+    data = pd.concat([data, start_rows[['user_id', 'action', 'action_start', 'action_order', 'first_action', 'action_next']]])
+
+    first_actions = data[data['action_order']==1]['action'].drop_duplicates().tolist()
+    all_actions = data['action'].drop_duplicates().tolist()
+    return data, first_actions, all_actions
+
+def journey_rows(data):
+    columns = ['user_id', 'action_order', 'action', 'first_action', 'action_next', 'duration']
+    return data[columns].sort_values(['user_id', 'action_order']).reset_index(drop=True)
+
+def test_transform_matches_reference(events):
+    #equal action starts of one user keep their input order
+    events.loc[5, 'action_start'] = events.loc[4, 'action_start']
+    expected, expected_first_actions, expected_all_actions = transform_reference(events.copy())
+    data, first_actions, all_actions = transform_pd(events)
+
+    pd.testing.assert_frame_equal(journey_rows(data), journey_rows(expected), check_dtype=False)
+    assert sorted(first_actions) == sorted(expected_first_actions)
+    assert sorted(all_actions) == sorted(expected_all_actions)
+
+def test_transform_keeps_input(events):
+    columns = list(events.columns)
+    transform_pd(events)
+    assert list(events.columns) == columns
+
+def test_transform_shuffled_input(events):
+    expected = transform_reference(events.copy())[0]
+    data = transform_pd(events.sample(frac=1, random_state=1))[0]
+    pd.testing.assert_frame_equal(journey_rows(data), journey_rows(expected), check_dtype=False)
+
+def test_transform_pandas_polars(events):
+    data_pd = transform(events)[0]
+    data_pl = transform_pl(pl.from_pandas(events))[0]
+    assert isinstance(data_pl, pl.DataFrame)
+    #the polars start rows have a duration of 0 instead of nan, only action rows are compared
+    left = journey_rows(data_pd[data_pd['action_order'] > 0])
+    right = journey_rows(sorted_frame(data_pl.filter(pl.col('action_order') > 0))).replace({None: np.nan})
+    pd.testing.assert_frame_equal(left, right, check_dtype=False)